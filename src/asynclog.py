@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""Asynchronous logging that can't stall the caller.
+
+install() replaces the handlers of the root logger by a handler that
+only appends the record to a bounded queue. A listener thread takes the
+records in batches, formats them and writes them with the former
+handlers, one flush per batch:
+
+- the message is formatted by the listener: pass the arguments, not a
+  formatted string, and wrap objects to dump as LazyJSON(obj);
+- the queue is bounded: when it is full the record is dropped and
+  counted, the caller never waits;
+- repeated messages are rate limited: per logger and message template
+  at most `burst` records per `period` seconds pass, the number of
+  suppressed records is logged by the listener when the period is
+  over. Records of level ERROR and above are never suppressed.
+
+The arguments are kept by reference until the record is written, so
+they should not be modified after the logging call.
+
+Under gevent the listener is a real thread, not a greenlet, so the file
+I/O does not block the hub. The rate limit windows are shared by the
+callers and the listener under a lock that is not patched by gevent.
+
+The numbers of records written, queued, dropped (queue full) and
+suppressed are the oanda_log_records gauge of metrics.py, and are
+logged when the listener stops.
+"""
+import sys
+import json
+import time
+import atexit
+import logging
+from collections import deque
+
+import metrics
+
+
+class LazyJSON(object):
+    """an object that is dumped as JSON only when the record is written."""
+
+    __slots__ = ["obj", "indent"]
+
+    def __init__(self, obj, indent=2):
+        self.obj = obj
+        self.indent = indent
+
+    def __str__(self):
+        return json.dumps(self.obj, indent=self.indent)
+
+
+def _originals():
+    """thread start, lock and sleep not patched by gevent."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        monkey = None
+    if monkey is not None and monkey.is_module_patched("threading"):
+        return (monkey.get_original("_thread", "start_new_thread"),
+                monkey.get_original("_thread", "allocate_lock"),
+                monkey.get_original("time", "sleep"))
+    import _thread
+    return _thread.start_new_thread, _thread.allocate_lock, time.sleep
+
+
+class AsyncHandler(logging.Handler):
+    """Handler appending records to a bounded queue, see the module."""
+
+    def __init__(self, maxsize=10000, burst=20, period=10.0):
+        super(AsyncHandler, self).__init__()
+        self.queue = deque()
+        self.maxsize = maxsize
+        self.burst = burst
+        self.period = period
+        self.dropped = 0
+        self.suppressed = 0
+        self._windows = {}   # (logger, msg): [window start, n, suppressed]
+        self._windowsLock = _originals()[1]()
+
+    def emit(self, record):
+        if self.burst and record.levelno < logging.ERROR:
+            with self._windowsLock:
+                suppress = self._limit(record)
+            if suppress:
+                return
+        self._put(record)
+
+    def _limit(self, record):
+        """count the record in its window, True to suppress it."""
+        key = (record.name, record.msg)
+        now = record.created
+        try:
+            W = self._windows[key]
+        except KeyError:
+            if len(self._windows) >= self.maxsize:
+                # messages formatted by the caller are all different
+                self._windows.clear()
+            W = self._windows[key] = [now, 0, 0]
+        if now - W[0] >= self.period:
+            if W[2]:
+                self._put(self._summary(record, W[2]))
+            W[0], W[1], W[2] = now, 0, 0
+        W[1] += 1
+        if W[1] > self.burst:
+            W[2] += 1
+            self.suppressed += 1
+            return True
+        return False
+
+    def _put(self, record):
+        if len(self.queue) >= self.maxsize:
+            self.dropped += 1
+            return
+        self.queue.append(record)
+
+    @staticmethod
+    def _summary(record, n):
+        return logging.LogRecord(
+            record.name, logging.WARNING, record.pathname, record.lineno,
+            "%d records suppressed by the rate limit: %r", (n, record.msg),
+            None)
+
+    def flushSuppressed(self, now=None):
+        """queue the summaries of the suppressed records, with now only
+        of the windows whose period is over, these are removed."""
+        with self._windowsLock:
+            self._flushSuppressed(now)
+
+    def _flushSuppressed(self, now):
+        for key, W in list(self._windows.items()):
+            expired = now is not None and now - W[0] >= self.period
+            if now is not None and not expired:
+                continue
+            n, W[2] = W[2], 0
+            if n:
+                R = logging.LogRecord(key[0], logging.WARNING, "", 0, key[1],
+                                      None, None)
+                self._put(self._summary(R, n))
+            if expired:
+                self._windows.pop(key, None)
+
+
+class Listener(object):
+    """Writes the queued records with the handlers, in batches."""
+
+    def __init__(self, handler, handlers, interval=0.05, batch=1000):
+        self.handler = handler
+        # the summaries of the suppressed records are checked so often
+        self.flushInterval = min(1.0, handler.period / 2.0)
+        self.handlers = handlers
+        self.interval = interval
+        self.batch = batch
+        self.written = 0
+        self._running = False
+        self._stopped = False
+        self._start, _, self._sleep = _originals()
+
+    def start(self):
+        self._running = True
+        self._start(self._run, ())
+        return self
+
+    def _run(self):
+        flushed = time.time()
+        try:
+            while self._running:
+                now = time.time()
+                if now - flushed >= self.flushInterval:
+                    self.handler.flushSuppressed(now)
+                    flushed = now
+                if not self.drain():
+                    self._sleep(self.interval)
+        finally:
+            self._stopped = True
+
+    def drain(self):
+        """write the queued records, returns the number written."""
+        q = self.handler.queue
+        total = 0
+        while q:
+            records = []
+            while q and len(records) < self.batch:
+                records.append(q.popleft())
+            for h in self.handlers:
+                self._write(h, records)
+            total += len(records)
+        self.written += total
+        return total
+
+    @staticmethod
+    def _write(h, records):
+        records = [r for r in records if r.levelno >= h.level]
+        stream = getattr(h, "stream", None)
+        if not isinstance(h, logging.StreamHandler) or stream is None:
+            for r in records:
+                h.handle(r)
+            return
+
+        h.acquire()
+        try:
+            for r in records:
+                if not h.filter(r):
+                    continue
+                try:
+                    stream.write(h.format(r) + h.terminator)
+                except Exception:
+                    h.handleError(r)
+            h.flush()
+        finally:
+            h.release()
+
+    def stop(self):
+        """stop the thread and write what is left."""
+        if self._stopped and not self._running:
+            return   # stopped before
+        self._running = False
+        for _ in range(100):
+            if self._stopped:
+                break
+            self._sleep(self.interval / 5)
+        self.handler.flushSuppressed()
+        self.drain()
+        stats = self.stats()
+        self.handler.queue.append(logging.LogRecord(
+            __name__, logging.WARNING if stats["dropped"] else logging.INFO,
+            __file__, 0, "asynclog: %s", (stats,), None))
+        self.drain()
+        for h in self.handlers:
+            h.flush()
+
+    def stats(self):
+        return {"written": self.written,
+                "queued": len(self.handler.queue),
+                "dropped": self.handler.dropped,
+                "suppressed": self.handler.suppressed}
+
+
+def install(maxsize=10000, burst=20, period=10.0, logger=None):
+    """make the handlers of the logger (default root) asynchronous.
+
+    Returns the Listener, it is stopped, and the queue written, at exit.
+    """
+    logger = logger or logging.getLogger()
+    handlers = list(logger.handlers)
+    if not handlers:
+        handlers = [logging.StreamHandler(sys.stderr)]
+    handler = AsyncHandler(maxsize, burst, period)
+    for h in logger.handlers[:]:
+        logger.removeHandler(h)
+    logger.addHandler(handler)
+    listener = Listener(handler, handlers).start()
+    for key in listener.stats():
+        metrics.LOG_RECORDS.labels(key).setFunction(
+            lambda key=key: listener.stats()[key])
+    atexit.register(listener.stop)
+    return listener
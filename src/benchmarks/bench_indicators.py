@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Check and benchmark the streaming indicators against the batch mode.
+
+Feeds random walks bar by bar to an IndicatorSet with every indicator
+and compares the values after each bar with the series of
+IndicatorSet.batch: the same bars must be defined (the warm-up) and the
+values must agree within --rtol of the largest value of the series. The
+walks have the lengths around the warm-up of each indicator and lengths
+of several BLOCKs, so the EMA / Wilder smoothing is checked across the
+blocks. Exits with 1 on a mismatch. Needs NumPy.
+
+Usage:
+
+  python src/benchmarks/bench_indicators.py [--bars 5000] [--rtol 1e-9]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy                                   # noqa: E402
+from indicators import IndicatorSet, BLOCK     # noqa: E402
+
+
+def indicatorSet():
+    """a set with every indicator, some over the same windows."""
+    S = IndicatorSet()
+    S.sma(20)
+    S.ema(20)
+    S.wma(20)
+    S.bollinger(20, 2.0)
+    S.rsi(14)
+    S.atr(14)
+    S.macd(12, 26, 9)
+    S.rollingMin(30)
+    S.rollingMax(30)
+    S.ema(2)     # the largest factor of the block smoothing
+    S.ema(1)     # alpha 1: no smoothing
+    S.wma(1)
+    return S
+
+
+def walk(n, level, hl):
+    """closes of a random walk at level, with highs / lows if hl."""
+    c, x = [], level
+    for _ in range(n):
+        x += random.gauss(0, level * 0.0005)
+        c.append(x)
+    if not hl:
+        return c, None, None
+    h = [v + random.random() * level * 0.001 for v in c]
+    l = [v - random.random() * level * 0.001 for v in c]
+    return c, h, l
+
+
+def stream(S, c, h, l):
+    """the values of the indicators after each bar."""
+    out = dict((name, []) for name in S.indicators)
+    for i in range(len(c)):
+        S.update(c[i], h[i] if h else None, l[i] if l else None)
+        for name, I in S.indicators.items():
+            out[name].append(I.value)
+    return out
+
+
+def compare(S, c, h, l, rtol):
+    """the mismatches of the streaming and the batch values."""
+    streamed = stream(S, c, h, l)
+    errors = []
+    for name, y in S.batch(c, h, l).items():
+        nan = (numpy.nan,) * y.shape[1] if y.ndim == 2 else numpy.nan
+        s = numpy.array([nan if v is None else v for v in streamed[name]],
+                        dtype=float).reshape(y.shape)
+        if (numpy.isnan(s) != numpy.isnan(y)).any():
+            i = int(numpy.argmax(numpy.isnan(s) != numpy.isnan(y)))
+            errors.append("{}: bar {} defined {} streaming, {} batch".format(
+                name, i, not numpy.isnan(s.flat[i]),
+                not numpy.isnan(y.flat[i])))
+        elif y.size and not numpy.isnan(y).all():
+            # relative to the size of the series: the MACD lines are
+            # differences of EMAs and cross zero
+            d = numpy.nanmax(numpy.abs(s - y)) / numpy.nanmax(numpy.abs(y))
+            if d > rtol:
+                errors.append("{}: max relative difference {:.3g}".format(
+                    name, d))
+    return errors
+
+
+def main(clargs):
+    random.seed(clargs.seed)
+    # around the warm-ups: 1, 14, 20, 26, 30, 26 + 9 - 1 bars, and
+    # lengths over several blocks of the smoothing
+    lengths = sorted(set([0, 1, 2] +
+                         [n + d for n in (14, 15, 20, 26, 30, 34)
+                          for d in (-1, 0, 1)] +
+                         [BLOCK, BLOCK + 1, 3 * BLOCK + 7, clargs.bars]))
+    failed = 0
+    for n in lengths:
+        for level in (1.1, 150.0, 30000.0):
+            for hl in (False, True):
+                c, h, l = walk(n, level, hl)
+                errors = compare(indicatorSet(), c, h, l, clargs.rtol)
+                for e in errors:
+                    print("MISMATCH bars {} level {} high/low {}: {}".format(
+                        n, level, hl, e))
+                failed += len(errors)
+    print("{} lengths x 3 levels x 2 inputs: {}".format(
+        len(lengths), "{} mismatches".format(failed) if failed else "ok"))
+
+    c, h, l = walk(clargs.bars, 1.1, True)
+    S = indicatorSet()
+    start = time.time()
+    for i in range(len(c)):
+        S.update(c[i], h[i], l[i])
+    t = time.time() - start
+    print("streaming {:8.2f} us/bar ({} indicators)".format(
+        t / len(c) * 1e6, len(S.indicators)))
+    start = time.time()
+    S.batch(c, h, l)
+    t = time.time() - start
+    print("batch     {:8.2f} us/bar".format(t / len(c) * 1e6))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='bench_indicators')
+    parser.add_argument('--bars', default=5000, type=int)
+    parser.add_argument('--rtol', default=1e-9, type=float)
+    parser.add_argument('--seed', default=1, type=int)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the rendering of console instrument rows.
+
+Compares the former row rendering, that scanned all positions of the
+account snapshot and parsed the previous prices again for each tick,
+with console.rows.RowRenderer.
+
+Usage:
+
+  python src/benchmarks/bench_rows.py [--instruments 30] [--positions 30]
+"""
+import os
+import sys
+import random
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from console.account import AccountModel  # noqa: E402
+from console.rows import RowRenderer       # noqa: E402
+
+
+def fixture(ninstruments, npositions, nticks=10000):
+    """account details, changes and price records for the benchmark."""
+    instruments = ["INSTR{:02d}_USD".format(i) for i in range(ninstruments)]
+    positions = []
+    for i in range(npositions):
+        instrument = instruments[i % ninstruments]
+        positions.append({
+            "instrument": instrument,
+            "unrealizedPL": "10.0000",
+            "long": {"units": "100", "averagePrice": "1.10000"},
+            "short": {"units": "0"}})
+    details = {"account": {"NAV": "10000.0000", "positions": positions}}
+    changes = {"state": {
+        "NAV": "10000.0000",
+        "positions": [{"instrument": P["instrument"],
+                       "netUnrealizedPL": "10.0000"} for P in positions]}}
+
+    ticks = []
+    for n in range(nticks):
+        bid = 1.1 + random.random() / 100
+        ticks.append({"type": "PRICE",
+                      "instrument": random.choice(instruments),
+                      "time": "2017-09-25T11:38:55.123456789Z",
+                      "bids": [{"price": "{:.5f}".format(bid)}],
+                      "asks": [{"price": "{:.5f}".format(bid + 0.0002)}]})
+    return details, changes, ticks
+
+
+def baseline(prevRecords, snapshot, r):
+    """the former WidgetUpdate.mkrecord."""
+    try:
+        prev = prevRecords[r["instrument"]]
+    except KeyError:
+        directionB = " "
+        directionA = " "
+    else:
+        directionB = "^" if float(r["bids"][0]["price"]) > \
+                     float(prev["bids"][0]["price"]) else "v"
+        directionA = "^" if float(r["asks"][0]["price"]) > \
+                     float(prev["asks"][0]["price"]) else "v"
+
+    modeB = "red" if directionB == "v" else "green"
+    modeA = "red" if directionA == "v" else "green"
+
+    ext = []
+    if snapshot:
+        for P in snapshot.get('state').get('positions'):
+            if r["instrument"] == P["instrument"]:
+                netUnr = float(P.get('netUnrealizedPL'))
+                ext.append(('', "{:10.2f}".format(netUnr)))
+
+    prevRecords[r["instrument"]] = r
+    return ["{:<11s}".format(r["instrument"]),
+            (modeB, "{:10s}".format(r["bids"][0]["price"])),
+            (modeA, "{:10s}".format(r["asks"][0]["price"])),
+            ('', "{:s}".format(r["time"][11:22])),
+            directionB] + ext
+
+
+def main(clargs):
+    details, changes, ticks = fixture(clargs.instruments, clargs.positions)
+
+    prevRecords = {}
+
+    def runBaseline():
+        for r in ticks:
+            baseline(prevRecords, changes, r)
+
+    account = AccountModel()
+    account.seed(details)
+    account.apply(changes)
+    rows = RowRenderer(account)
+
+    def runRenderer():
+        for r in ticks:
+            rows.render(r)
+
+    for name, f in [("baseline", runBaseline), ("RowRenderer", runRenderer)]:
+        t = min(timeit.repeat(f, number=1, repeat=clargs.repeat))
+        print("{:12s} {:8.2f} us/row".format(name, t / len(ticks) * 1e6))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='bench_rows')
+    parser.add_argument('--instruments', default=30, type=int)
+    parser.add_argument('--positions', default=30, type=int)
+    parser.add_argument('--repeat', default=5, type=int)
+    main(parser.parse_args())
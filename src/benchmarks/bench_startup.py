@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Startup time report: import times and the config load.
+
+Each module is imported in a fresh interpreter with -X importtime. The
+report shows the total import time, the slowest imports by cumulative
+time and whether a startup budget is met. The console config is loaded
+from the YAML file and from the cache.
+
+Usage:
+
+  python src/benchmarks/bench_startup.py [--top 15] [--budget 250]
+                                         [--runs 3] [module ...]
+
+The modules default to oanda_console. The exit status is 1 if the
+median import time of a module exceeds the budget (in ms).
+"""
+import os
+import sys
+import shutil
+import tempfile
+import argparse
+import subprocess
+import statistics
+import time
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC)
+
+
+def importtime(module):
+    """[(self us, cumulative us, depth, name)] of importing module."""
+    code = "import sys; sys.path.insert(0, {!r}); import {}".format(
+        SRC, module)
+    # run in a scratch dir: modules may write log files in the cwd
+    cwd = tempfile.mkdtemp()
+    try:
+        p = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                           cwd=cwd, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.PIPE, universal_newlines=True)
+    finally:
+        shutil.rmtree(cwd)
+
+    if p.returncode:
+        raise RuntimeError("import {} failed:\n{}".format(module, p.stderr))
+
+    records = []
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        selfT, cumT, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        records.append((int(selfT), int(cumT), depth, name.strip()))
+    return records
+
+
+def report(module, runs, top):
+    totals = []
+    for _ in range(runs):
+        records = importtime(module)
+        totals.append(sum(r[0] for r in records) / 1000.0)
+
+    print("{}: {:.1f} ms median of {} runs (min {:.1f}, max {:.1f}), "
+          "{} modules".format(module, statistics.median(totals), runs,
+                              min(totals), max(totals), len(records)))
+    # the direct imports of the module and their dependencies,
+    # by cumulative time, from the last run
+    print("  {:>10s} {:>10s}  {}".format("self ms", "cumul ms", "module"))
+    for selfT, cumT, depth, name in sorted(records, key=lambda r: -r[1])[
+            :top]:
+        print("  {:10.1f} {:10.1f}  {}{}".format(
+            selfT / 1000.0, cumT / 1000.0, "  " * (depth - 1), name))
+    return statistics.median(totals)
+
+
+def configLoad(fileName):
+    """time to load the config from YAML and from the cache, in ms."""
+    from console.config import Config
+
+    tmp = tempfile.mkdtemp()
+    try:
+        cfgFile = os.path.join(tmp, os.path.basename(fileName))
+        shutil.copy(fileName, cfgFile)
+        t0 = time.time()
+        Config(cfgFile)
+        t1 = time.time()
+        Config(cfgFile)
+        t2 = time.time()
+    finally:
+        shutil.rmtree(tmp)
+
+    return (t1 - t0) * 1000, (t2 - t1) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="bench_startup")
+    parser.add_argument('--top', type=int, default=15,
+                        help="number of slowest imports to show")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--budget', type=float, default=None,
+                        help="import time budget in ms")
+    parser.add_argument('--config', default=os.path.join(
+                        os.path.dirname(SRC), "console.yml"))
+    parser.add_argument('modules', nargs="*", default=["oanda_console"])
+    clargs = parser.parse_args()
+
+    overBudget = []
+    for module in clargs.modules:
+        T = report(module, clargs.runs, clargs.top)
+        if clargs.budget is not None and T > clargs.budget:
+            overBudget.append(module)
+        print()
+
+    if os.path.exists(clargs.config):
+        yml, cached = configLoad(clargs.config)
+        print("config: {:.2f} ms parsing YAML, {:.2f} ms from the "
+              "cache".format(yml, cached))
+
+    if overBudget:
+        print("over budget ({} ms): {}".format(clargs.budget,
+                                              ", ".join(overBudget)))
+        sys.exit(1)
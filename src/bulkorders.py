@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""Submit a basket of orders concurrently.
+
+BulkOrders takes order specs: MarketOrderRequest (or other contrib
+request) instances, {"order": {...}} bodies or bare order dicts. The
+orders are created by a bounded pool of greenlets, the requests are
+started within a rate limit, so a basket costs about one round trip per
+`size` orders instead of one per order.
+
+Each order gets clientExtensions with an id derived from the batch id
+and its position in the basket, unless it has one. Before an order is
+retried after a connection error, a timeout or a 5xx/429 response, it
+is looked up by that id: if it was created the first attempt counts, so
+a retry never doubles an order. When the batch id is passed, to run a
+basket again, every order is looked up before its first attempt too:
+the orders created by the former run are reported as they are and only
+the missing ones are created.
+
+The results are in the order of the input: per order the client id,
+success, the HTTP status, the response or the error, the number of
+attempts and the latency.
+
+gevent must be monkey patched (before importing requests) for the
+requests to run concurrently.
+
+  python src/bulkorders.py orders.json [--size 10] [--rate 20]
+                                       [--batch ID] [--retries 2]
+
+orders.json: a JSON list of order bodies, or one order body per line.
+"""
+import json
+import time
+import uuid
+import logging
+
+import gevent
+from gevent.pool import Pool
+from gevent.lock import Semaphore
+
+from oandapyV20.exceptions import V20Error
+import oandapyV20.endpoints.orders as orders
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+
+logger = logging.getLogger(__name__)
+
+
+def orderBody(spec):
+    """the {"order": {...}} body of an order spec, as a copy."""
+    data = getattr(spec, "data", spec)
+    if "order" not in data:
+        data = {"order": data}
+    return {"order": dict(data["order"])}
+
+
+def retryable(e):
+    if isinstance(e, (ConnectionError, Timeout)):
+        return True
+    code = getattr(e, "code", None)
+    return isinstance(e, V20Error) and code is not None and \
+        (int(code) >= 500 or int(code) == 429)
+
+
+class RateLimiter(object):
+    """Space the starts of requests to at most rate per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = 0
+        self._lock = Semaphore()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.time()
+            t = max(now, self._next)
+            self._next = t + self.interval
+        if t > now:
+            gevent.sleep(t - now)
+
+
+class BulkOrders(object):
+    """Concurrent order submission, see the module docstring."""
+
+    def __init__(self, api, accountID, size=10, rate=20, retries=2,
+                 backoff=0.5):
+        self.api = api
+        self.accountID = accountID
+        self.size = size
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        # a connection per greenlet instead of the default pool of 10
+        api.client.mount("https://", HTTPAdapter(pool_connections=1,
+                                                 pool_maxsize=size))
+
+    def prepare(self, specs, batch=None):
+        """the order bodies with their client ids."""
+        batch = batch or uuid.uuid4().hex[:12]
+        bodies = []
+        for i, spec in enumerate(specs):
+            body = orderBody(spec)
+            ext = dict(body["order"].get("clientExtensions", {}))
+            ext.setdefault("id", "{}-{}".format(batch, i))
+            ext.setdefault("tag", "bulk-{}".format(batch))
+            body["order"]["clientExtensions"] = ext
+            bodies.append(body)
+        return bodies
+
+    def _request(self, r):
+        self.limiter.wait()
+        return self.api.request(r)
+
+    def _created(self, clientID):
+        """the order with the client id, None if it does not exist."""
+        r = orders.OrderDetails(accountID=self.accountID,
+                                orderID="@{}".format(clientID))
+        try:
+            return self._request(r)
+        except V20Error as e:
+            if int(e.code) == 404:
+                return None
+            raise
+
+    def submit(self, i, body, lookup=False):
+        """create the order, with lookup look it up by the client id
+        before the first attempt."""
+        clientID = body["order"]["clientExtensions"]["id"]
+        result = {"index": i, "clientID": clientID,
+                  "instrument": body["order"].get("instrument"),
+                  "units": body["order"].get("units"),
+                  "ok": False, "status": None, "attempts": 0}
+        start = time.time()
+        while True:
+            result["attempts"] += 1
+            r = orders.OrderCreate(accountID=self.accountID, data=body)
+            try:
+                if lookup or result["attempts"] > 1:
+                    # a former attempt or run may have created it
+                    rv = self._created(clientID)
+                    if rv is not None:
+                        result.update(ok=True, status=200, response=rv)
+                        break
+                rv = self._request(r)
+            except Exception as e:
+                if retryable(e) and result["attempts"] <= self.retries:
+                    logger.warning("order %s: attempt %d: %s", clientID,
+                                   result["attempts"], e)
+                    gevent.sleep(self.backoff * 2 ** (result["attempts"] - 1))
+                    continue
+                result.update(status=getattr(e, "code", None),
+                              error=str(e))
+                break
+            else:
+                result.update(ok=True, status=r.status_code, response=rv)
+                break
+
+        result["latency"] = time.time() - start
+        logger.info("order %s: ok: %s status: %s latency: %.3f",
+                    clientID, result["ok"], result["status"],
+                    result["latency"])
+        return result
+
+    def run(self, specs, batch=None):
+        """submit the orders, returns the results in input order."""
+        bodies = self.prepare(specs, batch)
+        lookup = batch is not None   # a run again of the basket
+        pool = Pool(self.size)
+        jobs = [pool.spawn(self.submit, i, body, lookup)
+                for i, body in enumerate(bodies)]
+        gevent.joinall(jobs, raise_error=True)
+        return [g.value for g in jobs]
+
+
+def report(results):
+    """the results as lines of text."""
+    lines = []
+    for R in results:
+        if R["ok"]:
+            rv = R["response"]
+            tx = rv.get("orderFillTransaction") or \
+                rv.get("orderCancelTransaction") or \
+                rv.get("orderCreateTransaction") or rv.get("order", {})
+            what = "{} {}".format(tx.get("type", ""),
+                                  tx.get("reason", "")).strip()
+        else:
+            what = R["error"]
+        lines.append("{:3d} {:24s} {:10s} {:>8s} {:5s} {:>4} {} "
+                     "{:7.3f}s  {}".format(
+                         R["index"], R["clientID"],
+                         str(R["instrument"]), str(R["units"]),
+                         "ok" if R["ok"] else "ERROR", str(R["status"]),
+                         R["attempts"], R["latency"], what))
+    ok = sum(1 for R in results if R["ok"])
+    lines.append("{} orders: {} ok, {} failed".format(
+        len(results), ok, len(results) - ok))
+    return lines
+
+
+def readOrders(fileName):
+    """order bodies from a JSON list or a file with one per line."""
+    with open(fileName) as I:
+        text = I.read()
+    try:
+        specs = json.loads(text)
+    except ValueError:
+        specs = [json.loads(line) for line in text.splitlines()
+                 if line.strip()]
+    return specs if isinstance(specs, list) else [specs]
+
+
+if __name__ == "__main__":
+    from gevent import monkey
+    monkey.patch_all()
+
+    import argparse
+    from oandapyV20 import API
+    from exampleauth import exampleAuth
+
+    parser = argparse.ArgumentParser(prog="bulkorders")
+    parser.add_argument('orders', help='file with the orders')
+    parser.add_argument('--size', type=int, default=10,
+                        help='number of concurrent requests')
+    parser.add_argument('--rate', type=float, default=20,
+                        help='max requests per second')
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--batch', type=str,
+                        help='batch id for the client ids, to resubmit '
+                             'a basket safely')
+    clargs = parser.parse_args()
+
+    logging.basicConfig(
+        filename="bulkorders.log",
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(name)s : %(message)s',
+    )
+
+    accountID, token = exampleAuth()
+    engine = BulkOrders(API(access_token=token), accountID,
+                        size=clargs.size, rate=clargs.rate,
+                        retries=clargs.retries)
+    print("\n".join(report(engine.run(readOrders(clargs.orders),
+                                      batch=clargs.batch))))
@@ -17,6 +17,7 @@ from oandapyV20.exceptions import V20Error
 import oandapyV20.endpoints.instruments as instruments
 from oandapyV20.definitions.instruments import CandlestickGranularity
 from exampleauth import exampleAuth
+from catalog import Catalog
 import re
 
 price = ['M', 'B', 'A', 'BA', 'MBA']
@@ -62,6 +63,12 @@ class Main(object):
                 params.update({"to": self.clargs.to})
             if self.clargs.price:
                 params.update({"price": self.clargs.price})
+            # check the names with the cached catalog, not a failed request
+            unknown = Catalog(self.api, self._accountID).load().unknown(
+                self.clargs.instruments)
+            if unknown:
+                raise ValueError("Unknown instruments: {}".format(
+                    ", ".join(unknown)))
             for i in self.clargs.instruments:
                 r = instruments.InstrumentsCandles(instrument=i, params=params)
                 rv = self.api.request(r)
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Instrument metadata of an account, cached on disk.
+
+The instruments are fetched once with AccountInstruments and kept in a
+JSON file for `ttl` seconds, so the bots, the console and the scripts
+get the precisions, pip location and margin rate of an instrument
+without a request at start:
+
+    catalog = Catalog(api, accountID).load()
+    EUR_USD = catalog["EUR_USD"]
+    EUR_USD.price(1.1234567)       # '1.12346', displayPrecision
+    EUR_USD.units(100)             # '100', tradeUnitsPrecision
+    catalog.byType("CFD")          # names, indexed at load
+    catalog.byCurrency("JPY")      # names with JPY as base or quote
+
+When the file is stale the instruments are fetched again. The API has no
+ETag for them, so the file keeps a digest of the instruments instead: if
+the fetched instruments have the same digest, only the time in the file
+is renewed and the loaded instruments and indexes are kept.
+
+Query the catalog from the command line:
+
+  python src/catalog.py [--refresh] [--type CFD] [--currency JPY]
+                        [--json] [NAME ...]
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+TTL = 24 * 3600
+
+
+class Instrument(object):
+    """the metadata of an instrument, with rounding by its precisions."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.name = spec["name"]
+        self.type = spec.get("type")
+        self.displayPrecision = int(spec.get("displayPrecision", 5))
+        self.tradeUnitsPrecision = int(spec.get("tradeUnitsPrecision", 0))
+        self.pipLocation = int(spec.get("pipLocation", -4))
+        self.marginRate = float(spec.get("marginRate", 0))
+        self.minimumTradeSize = float(spec.get("minimumTradeSize", 1))
+        self.priceFormat = "{{:.{}f}}".format(self.displayPrecision)
+        self.unitsFormat = "{{:.{}f}}".format(self.tradeUnitsPrecision)
+
+    def price(self, v):
+        """the price as a string, rounded to the display precision."""
+        return self.priceFormat.format(v)
+
+    def units(self, v):
+        """the units as a string, rounded to the trade units precision."""
+        return self.unitsFormat.format(v)
+
+    def __repr__(self):
+        return "Instrument({})".format(self.name)
+
+
+class Catalog(object):
+    """The instruments of an account, see the module docstring."""
+
+    def __init__(self, api=None, accountID=None, fileName=None, ttl=TTL):
+        self.api = api
+        self.accountID = accountID
+        self.fileName = fileName or ".instruments-{}.json".format(accountID)
+        self.ttl = ttl
+        self.fetched = None
+        self.digest = None
+        self._instruments = {}
+        self._byType = {}
+        self._byCurrency = {}
+
+    @property
+    def stale(self):
+        return self.fetched is None or time.time() - self.fetched > self.ttl
+
+    def load(self, refresh=False):
+        """the instruments from the file, fetched if stale or missing."""
+        cached = self._read()
+        if cached is not None and cached.get("digest") != self.digest:
+            self._index(cached["instruments"], cached.get("digest"))
+            self.fetched = cached["time"]
+        if refresh or cached is None or self.stale:
+            if cached is None:
+                return self.refresh()
+            try:
+                self.refresh()
+            except Exception as e:
+                # the stale instruments are better than none
+                logger.warning("catalog: refresh failed, using %s: %s",
+                               self.fileName, e)
+        return self
+
+    def refresh(self):
+        """fetch the instruments, reindex only if they changed."""
+        specs = self.fetch()
+        digest = self._digest(specs)
+        if digest == self.digest:
+            logger.info("catalog: %d instruments not modified", len(specs))
+        else:
+            self._index(specs, digest)
+        self.fetched = time.time()
+        self._write(specs)
+        return self
+
+    @staticmethod
+    def _digest(specs):
+        return hashlib.sha1(json.dumps(
+            specs, sort_keys=True).encode()).hexdigest()
+
+    def _index(self, specs, digest):
+        self.digest = digest or self._digest(specs)
+        instruments = {}
+        byType = defaultdict(list)
+        byCurrency = defaultdict(list)
+        for S in specs:
+            I = instruments[S["name"]] = Instrument(S)
+            byType[I.type].append(I.name)
+            for ccy in I.name.split("_"):
+                byCurrency[ccy].append(I.name)
+        self._instruments = instruments
+        self._byType = dict(byType)
+        self._byCurrency = dict(byCurrency)
+
+    def _read(self):
+        try:
+            with open(self.fileName) as I:
+                cached = json.load(I)
+            if cached["accountID"] != self.accountID and self.accountID:
+                return None
+            return cached
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def _write(self, specs):
+        tmp = self.fileName + ".tmp"
+        try:
+            with open(tmp, "w") as O:
+                json.dump({"time": self.fetched, "accountID": self.accountID,
+                           "digest": self.digest, "instruments": specs}, O)
+            os.rename(tmp, self.fileName)
+        except (IOError, OSError) as e:
+            logger.warning("catalog: can't write %s: %s", self.fileName, e)
+
+    def fetch(self):
+        """the instruments of the account, from the API."""
+        import oandapyV20.endpoints.accounts as accounts
+        r = accounts.AccountInstruments(accountID=self.accountID)
+        specs = self.api.request(r)["instruments"]
+        logger.info("catalog: %d instruments fetched", len(specs))
+        return specs
+
+    def byType(self, type):
+        """the names of the instruments of a type: CURRENCY, CFD, METAL."""
+        return self._byType.get(type, [])
+
+    def byCurrency(self, currency):
+        """the names of the instruments with the currency in the name."""
+        return self._byCurrency.get(currency, [])
+
+    def unknown(self, names):
+        """the names that are not instruments of the account."""
+        return [name for name in names if name not in self._instruments]
+
+    def specs(self):
+        """the instruments as returned by AccountInstruments."""
+        return [I.spec for I in self._instruments.values()]
+
+    def __getitem__(self, name):
+        return self._instruments[name]
+
+    def __contains__(self, name):
+        return name in self._instruments
+
+    def __len__(self):
+        return len(self._instruments)
+
+    def __iter__(self):
+        return iter(sorted(self._instruments))
+
+    def get(self, name, default=None):
+        return self._instruments.get(name, default)
+
+
+if __name__ == "__main__":
+    import argparse
+    from oandapyV20 import API
+    from exampleauth import exampleAuth
+
+    parser = argparse.ArgumentParser(prog="catalog")
+    parser.add_argument('names', nargs='*', help='instruments')
+    parser.add_argument('--type', type=str, help='CURRENCY, CFD, METAL')
+    parser.add_argument('--currency', type=str,
+                        help='instruments with the currency')
+    parser.add_argument('--refresh', action='store_true',
+                        help='fetch even if the file is not stale')
+    parser.add_argument('--ttl', type=int, default=TTL)
+    parser.add_argument('--json', action='store_true',
+                        help='the instrument specs as JSON')
+    clargs = parser.parse_args()
+
+    accountID, token = exampleAuth()
+    catalog = Catalog(API(access_token=token), accountID, ttl=clargs.ttl)
+    catalog.load(refresh=clargs.refresh)
+
+    names = set(clargs.names or catalog)
+    if clargs.type:
+        names &= set(catalog.byType(clargs.type))
+    if clargs.currency:
+        names &= set(catalog.byCurrency(clargs.currency))
+    for name in catalog.unknown(sorted(names)):
+        print("unknown instrument: {}".format(name))
+    selected = [catalog[name] for name in sorted(names) if name in catalog]
+    if clargs.json:
+        print(json.dumps([I.spec for I in selected], indent=2))
+    else:
+        for I in selected:
+            print("{:<12s} {:<9s} {:>2d} {:>3d} {:>2d} {:8.4f}  {}".format(
+                I.name, I.type, I.displayPrecision, I.pipLocation,
+                I.tradeUnitsPrecision, I.marginRate,
+                I.spec.get("displayName", "")))
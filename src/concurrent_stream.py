@@ -20,6 +20,7 @@ import argparse
 import json
 import gevent
 from gevent.pool import Group
+from gevent.event import Event
 from gevent import monkey
 import time
 import logging
@@ -27,9 +28,13 @@ import logging
 from oandapyV20 import API
 from oandapyV20.exceptions import V20Error, StreamTerminated
 from oandapyV20.endpoints.pricing import PricingStream
-from oandapyV20.endpoints.transactions import TransactionsStream
 from oandapyV20.endpoints.accounts import AccountChanges, AccountSummary
 from exampleauth import exampleAuth
+from pricehub import PriceHubClient
+from journal import TransactionJournal
+import profiling
+import metrics
+import asynclog
 from requests.exceptions import ConnectionError
 from datetime import datetime
 
@@ -46,6 +51,16 @@ parser.add_argument('--pollcount', default=0, type=int,
                     help='max # poll requests, default = unlimited.')
 parser.add_argument('--instruments', type=str, nargs='?',
                     action='append', help='instruments')
+parser.add_argument('--hub', type=str,
+                    help='socket of a pricehub to get the prices from')
+parser.add_argument('--metrics', type=int, metavar='PORT',
+                    help='serve the metrics on http://127.0.0.1:PORT/metrics')
+parser.add_argument('--synclog', action='store_true',
+                    help='log synchronously instead of from a background '
+                         'thread')
+parser.add_argument('--profsock', type=str,
+                    help='control socket of the profiler, see profiling.py; '
+                         'SIGUSR2 works without it')
 
 
 accountID, access_token = exampleAuth()
@@ -62,6 +77,7 @@ if clargs.timeout:
 api = API(access_token=access_token,
           environment="practice",
           request_params=request_params)
+metrics.instrumentAPI(api)
 
 logging.basicConfig(
     filename="./concurrent.log",
@@ -70,6 +86,14 @@ logging.basicConfig(
 )
 
 logger = logging.getLogger(__name__)
+if not clargs.synclog:
+    # the log file is written by a background thread
+    asynclog.install()
+
+# profile on demand: SIGUSR2 or a command on the control socket
+profiling.install(path=clargs.profsock)
+if clargs.metrics:
+    metrics.serve(clargs.metrics)
 
 
 # The greenlets ...
@@ -84,16 +108,21 @@ class StreamingPrices(gevent.Greenlet):
 
     def _run(self):
         tickMsg = "write tick record ...{}\n"
+        stats = metrics.StreamStats("prices")
         while True:
-            r = PricingStream(
-                    accountID=accountID,
-                    params={"instruments": ",".join(self.instruments)})
+            if clargs.hub:
+                r = PriceHubClient(clargs.hub, self.instruments)
+            else:
+                r = PricingStream(
+                        accountID=accountID,
+                        params={"instruments": ",".join(self.instruments)})
 
             se = None   # to save the exception if it occurs
             with open("prices.txt", "a") as O:
                 n = 0
                 try:
-                    for R in api.request(r):
+                    for R in (r if clargs.hub else api.request(r)):
+                        stats.message(R)
                         now = datetime.now()
                         sys.stderr.write(tickMsg.format(now))
 
@@ -115,6 +144,7 @@ class StreamingPrices(gevent.Greenlet):
 
                 except ConnectionError as e:
                     logger.error("ConnectionError: %s %d", e, n)
+                    stats.reconnect()
                     time.sleep(3)
 
                 except StreamTerminated as e:
@@ -131,44 +161,72 @@ class StreamingPrices(gevent.Greenlet):
 
 
 class StreamingEvents(gevent.Greenlet):
-    """Greenlet to handle streaming events."""
+    """Greenlet to handle streaming events.
+
+    The transactions are appended to the journal: after a restart the
+    missed transactions are fetched first. Each transaction sets the
+    trigger to let the ChangePoller fetch the account changes right away.
+    """
 
-    def __init__(self, m=0):
+    def __init__(self, m=0, trigger=None):
         super(StreamingEvents, self).__init__()
         self.m = m
+        self.trigger = trigger
 
     def _run(self):
-        r = TransactionsStream(accountID=accountID)
+        stats = metrics.StreamStats("transactions")
         while True:
-            with open("events.txt", "a") as O:
-                try:
-                    n = 0
-                    for R in api.request(r):
+            try:
+                n = 0
+                for R in journal.stream(api, accountID, heartbeats=True):
+                    stats.message(R)
+                    if R["type"] != "HEARTBEAT":
                         now = datetime.now()
                         sys.stderr.write("write event ...{}\n".format(now))
-                        O.write(json.dumps(R)+"\n")
-                        O.flush()
-                        gevent.sleep(0)
-                        n += 1
-                        if n > self.m:
-                            r.terminate("maxrecs received: {}".format(self.m))
+                        if self.trigger is not None:
+                            self.trigger.set()
+                    gevent.sleep(0)
+                    n += 1
+                    if n > self.m and journal.request is not None:
+                        journal.request.terminate(
+                            "maxrecs received: {}".format(self.m))
 
-                except StreamTerminated as e:
-                    logger.error("StreamTerminated: %s %d", e, n)
-                    # re-raise
-                    raise e
+            except StreamTerminated as e:
+                logger.error("StreamTerminated: %s %d", e, n)
+                # re-raise
+                raise e
 
-                except Exception as e:
-                    logger.error("Some exception: %s %d", e, n)
+            except Exception as e:
+                logger.error("Some exception: %s %d", e, n)
 
 
 class ChangePoller(gevent.Greenlet):
-    """Greenlet to poll for account changes."""
+    """Greenlet to poll for account changes.
 
-    def __init__(self, sinceTransactionID, maxpoll=0):
+    The poller waits for the trigger, set by StreamingEvents when a
+    transaction arrives, and polls right after. Without transactions
+    it falls back to a slow adaptive poll: the interval doubles after
+    each poll without changes, from minSleep up to maxSleep.
+    """
+
+    def __init__(self, sinceTransactionID, maxpoll=0, trigger=None,
+                 minSleep=15, maxSleep=300):
         super(ChangePoller, self).__init__()
         self.sinceTransactionID = sinceTransactionID
         self.maxpoll = maxpoll
+        self.trigger = trigger
+        self.minSleep = minSleep
+        self.maxSleep = maxSleep
+
+    def wait(self, timeout):
+        """wait for the trigger or the timeout, whichever comes first."""
+        if self.trigger is None:
+            gevent.sleep(timeout)
+            return False
+
+        triggered = self.trigger.wait(timeout=timeout)
+        self.trigger.clear()
+        return triggered
 
     def _run(self):
         r = AccountChanges(
@@ -176,6 +234,7 @@ class ChangePoller(gevent.Greenlet):
                 params={"sinceTransactionID": self.sinceTransactionID})
 
         n = 0
+        sleepTime = self.minSleep
         while True:
             try:
                 R = api.request(r)
@@ -201,8 +260,12 @@ class ChangePoller(gevent.Greenlet):
                         params = {"sinceTransactionID":
                                   self.sinceTransactionID}
                         r = AccountChanges(accountID=accountID, params=params)
+                        sleepTime = self.minSleep
+                    else:
+                        sleepTime = min(sleepTime * 2, self.maxSleep)
 
-                    gevent.sleep(15)
+            if self.wait(sleepTime):
+                sleepTime = self.minSleep
 
 
 # manage asynchronous tasks
@@ -213,7 +276,8 @@ def events_exceptionhandler(g):
     """create a new greenlet."""
     logger.info("restart greenlet %s", g.__class__.__name__)
     print("Restart {}".format(g.__class__.__name__))
-    x = g.__class__(m=5)
+    metrics.RECONNECTS.labels("transactions").inc()
+    x = g.__class__(m=5, trigger=g.trigger)
     gr.discard(g)
     x.link_exception(events_exceptionhandler)
     x.start()
@@ -226,7 +290,10 @@ p_stream = StreamingPrices(instruments=clargs.instruments,
                            maxrec=clargs.tickcount)
 p_stream.start()
 
-# figure out the ID to poll from
+# the transactions, in events.txt, checkpointed for a restart
+journal = TransactionJournal("events.txt")
+
+# figure out the ID to poll from: the journal, or the account
 r = AccountSummary(accountID=accountID)
 try:
     rv = api.request(r)
@@ -242,11 +309,18 @@ except Exception as e:
     exit(2)
 else:
     since = rv["lastTransactionID"]
+    if journal.lastID is not None:
+        # the changes since the last run
+        since = str(journal.lastID)
+
+# transactions trigger the poll of account changes
+txEvent = Event()
 
-ch_poller = ChangePoller(sinceTransactionID=since, maxpoll=clargs.pollcount)
+ch_poller = ChangePoller(sinceTransactionID=since, maxpoll=clargs.pollcount,
+                         trigger=txEvent)
 ch_poller.start()
 
-e_stream = StreamingEvents(5)
+e_stream = StreamingEvents(5, trigger=txEvent)
 e_stream.link_exception(events_exceptionhandler)
 e_stream.start()
 
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""In-memory model of the account.
+
+The model is seeded from an AccountDetails response and updated in place
+from the 'changes' and the 'state' of AccountChanges responses. Between
+those updates the open positions are revalued from the live prices, so
+the NAV and the unrealized PL move at tick rate without extra requests.
+"""
+
+# the lists of the account, all other fields are kept in model.account
+LISTS = ["positions", "trades", "orders"]
+
+
+class AccountModel(object):
+    """Local model of the account, see the module docstring."""
+
+    def __init__(self):
+        self.account = {}       # the account fields, without the lists
+        self.positions = {}     # instrument: position
+        self.trades = {}        # tradeID: trade
+        self.orders = {}        # orderID: order
+        self.lastTransactionID = None
+        self.NAV = 0.0
+        self.unrealizedPL = 0.0
+        # instrument: [longUnits, longAvg, shortUnits, shortAvg]
+        self._units = {}
+        self._server = {}   # instrument: server calculated unrealized PL
+        self._factor = {}   # instrument: quote -> home conversion factor
+        self._local = {}    # instrument: locally calculated unrealized PL
+
+    def _setPosition(self, P):
+        instrument = P["instrument"]
+        L, S = P.get("long", {}), P.get("short", {})
+        units = [float(L.get("units", 0)), float(L.get("averagePrice", 0)),
+                 float(S.get("units", 0)), float(S.get("averagePrice", 0))]
+        if units[0] == 0 and units[2] == 0:
+            self.positions.pop(instrument, None)
+            self._units.pop(instrument, None)
+            self._server.pop(instrument, None)
+            self._local.pop(instrument, None)
+        else:
+            self.positions[instrument] = P
+            self._units[instrument] = units
+            self._server[instrument] = float(P.get("unrealizedPL", 0))
+
+    def _serverValues(self):
+        """the server values are leading again."""
+        self._local.clear()
+        self.NAV = float(self.account.get("NAV", 0))
+        self.unrealizedPL = float(self.account.get("unrealizedPL", 0))
+
+    def seed(self, rv):
+        """seed the model from an AccountDetails response."""
+        account = rv["account"]
+        self.account = {k: v for k, v in account.items() if k not in LISTS}
+        self.positions.clear()
+        self._units.clear()
+        self._server.clear()
+        for P in account.get("positions", []):
+            self._setPosition(P)
+        self.trades = {T["id"]: T for T in account.get("trades", [])}
+        self.orders = {O["id"]: O for O in account.get("orders", [])}
+        self.lastTransactionID = rv.get("lastTransactionID")
+        self._serverValues()
+
+    def apply(self, rv):
+        """apply an AccountChanges response."""
+        changes = rv.get("changes", {})
+        for O in changes.get("ordersCreated", []):
+            self.orders[O["id"]] = O
+        for k in ["ordersCancelled", "ordersFilled", "ordersTriggered"]:
+            for O in changes.get(k, []):
+                self.orders.pop(O["id"], None)
+        for k in ["tradesOpened", "tradesReduced"]:
+            for T in changes.get(k, []):
+                self.trades[T["id"]] = T
+        for T in changes.get("tradesClosed", []):
+            self.trades.pop(T["id"], None)
+        for P in changes.get("positions", []):
+            self._setPosition(P)
+
+        state = rv.get("state", {})
+        for T in state.get("trades", []):
+            if T["id"] in self.trades:
+                self.trades[T["id"]]["unrealizedPL"] = T["unrealizedPL"]
+        for P in state.get("positions", []):
+            if P["instrument"] in self._units:
+                self._server[P["instrument"]] = \
+                    float(P.get("netUnrealizedPL", 0))
+                self.positions[P["instrument"]]["unrealizedPL"] = \
+                    P.get("netUnrealizedPL")
+        for O in state.get("orders", []):
+            if O["id"] in self.orders:
+                self.orders[O["id"]].update(O)
+
+        self.account.update({k: v for k, v in state.items()
+                             if k not in LISTS})
+        if rv.get("lastTransactionID"):
+            self.lastTransactionID = rv["lastTransactionID"]
+        if "NAV" in state:
+            self._serverValues()
+
+    def _raw(self, instrument, bid, ask):
+        lu, la, su, sa = self._units[instrument]
+        # longs are closed at the bid, shorts at the ask
+        return lu * (bid - la) + su * (ask - sa)
+
+    def onPrice(self, R, bid=None, ask=None):
+        """revalue the position of the instrument of price record R.
+
+        The bid and ask can be passed if already parsed from R.
+        Returns the unrealized PL, or None if there is no position.
+        """
+        instrument = R["instrument"]
+        if instrument not in self._units:
+            return None
+
+        if bid is None:
+            bid = float(R["bids"][0]["price"])
+            ask = float(R["asks"][0]["price"])
+
+        conv = R.get("quoteHomeConversionFactors")
+        if conv:
+            lu, la, su, sa = self._units[instrument]
+            pl = lu * (bid - la) * float(conv["positiveUnits"]) + \
+                su * (ask - sa) * float(conv["negativeUnits"])
+        else:
+            # derive the conversion from the last server calculated PL
+            raw = self._raw(instrument, bid, ask)
+            if instrument not in self._local:
+                self._factor[instrument] = \
+                    self._server[instrument] / raw if raw else 1.0
+            pl = raw * self._factor[instrument]
+
+        delta = pl - self._local.get(instrument, self._server[instrument])
+        self.NAV += delta
+        self.unrealizedPL += delta
+        self._local[instrument] = pl
+        return pl
+
+    def positionPL(self, instrument):
+        """the latest unrealized PL of the instrument or None."""
+        if instrument not in self._units:
+            return None
+        return self._local.get(instrument, self._server[instrument])
+
+    def tradesFor(self, instrument):
+        return [T for T in self.trades.values()
+                if T["instrument"] == instrument]
+
+    def ordersFor(self, instrument):
+        return [O for O in self.orders.values()
+                if O.get("instrument") == instrument]
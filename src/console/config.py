@@ -1,25 +1,86 @@
-import yaml
+import os
+import pickle
 
 
 class Config(object):
+    """Console configuration.
+
+    The YAML file is parsed once: the parsed configuration, the flattened
+    instrument list and the palette are cached in a pickle next to the
+    file. The cache is used as long as the mtime and size of the file
+    match, so a normal start does not import or run the YAML parser.
+    """
     CONSOLE_CFG = "console.yml"
 
-    def __init__(self, fileName=CONSOLE_CFG):
-        self._config = self.read_config(fileName=fileName)
+    def __init__(self, fileName=CONSOLE_CFG, cache=True):
+        self.fileName = fileName
+        self.cacheName = os.path.join(
+            os.path.dirname(fileName),
+            ".{}.cache".format(os.path.basename(fileName))) if cache else None
+        self._config, self._instruments, self._palette = self.load()
 
     @property
     def config(self):
         return self._config
 
+    def _stamp(self):
+        st = os.stat(self.fileName)
+        return st.st_mtime_ns, st.st_size
+
+    def load(self):
+        """the config, instruments and palette, from the cache if valid."""
+        stamp = self._stamp()
+        if self.cacheName:
+            try:
+                with open(self.cacheName, "rb") as I:
+                    cached = pickle.load(I)
+                if cached["stamp"] == stamp:
+                    return cached["data"]
+            except (IOError, OSError, EOFError, KeyError,
+                    pickle.UnpicklingError):
+                pass
+
+        cfg = self.read_config(fileName=self.fileName)
+        data = (cfg, self.flatten(cfg), self.mkpalette(cfg))
+        if self.cacheName:
+            try:
+                with open(self.cacheName, "wb") as O:
+                    pickle.dump({"stamp": stamp, "data": data}, O)
+            except (IOError, OSError):
+                pass   # not writable: parse again next time
+
+        return data
+
     def read_config(self, fileName):
+        # deferred: only needed when the cache is stale
+        import yaml
         with open(fileName) as I:
             try:
-                cfg = yaml.load(I)
+                cfg = yaml.safe_load(I)
             except Exception as e:
                 print(e)
+                raise
 
         return cfg
 
+    @staticmethod
+    def flatten(cfg):
+        fl = []  # flattenedlist
+        for G in cfg.get("instruments", []):
+            for k in G:
+                fl.extend(G[k])
+
+        return fl
+
+    @staticmethod
+    def mkpalette(cfg):
+        keywords = ["foreground", "background", "mono"]
+        _palette = []
+        for E, pi in cfg.get("palette", {}).items():
+            _palette.append(tuple([E] + [pi.get(kw, '') for kw in keywords]))
+
+        return _palette
+
     def instrument_groups(self):
         for G in self._config["instruments"]:
             k, = G
@@ -27,29 +88,11 @@ class Config(object):
 
     @property
     def palette(self):
-        keywords = ["foreground", "background", "mono"]
-        _palette = []
-        for E in self._config["palette"].keys():
-            t = [E]
-            pi = self._config["palette"].get(E)
-            for kw in keywords:
-                if kw in pi:
-                    t.append(pi.get(kw))
-                else:
-                    t.append('')
-
-            _palette.append(tuple(t))
-
-        return _palette
+        return self._palette
 
     @property
     def instruments(self):
-        fl = []  # flattenedlist
-        for G in self.instrument_groups():
-            name, items = G
-            fl = fl + items
-
-        return fl
+        return self._instruments
 
 
 if __name__ == "__main__":
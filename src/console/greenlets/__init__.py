@@ -1,2 +1,4 @@
 from . accountdetails import GAccountDetails
+from . replay import GReplayPrices
 from . stream import GStreamingPrices
+from . transactions import GStreamingTransactions
@@ -9,32 +9,56 @@ class GAccountDetails(gevent.Greenlet):
 
     Initially get the AccountDetails and then keep polling
     for account changes.
-    In case of changes put those on the NAV-Queue
+    The AccountDetails response and the changes are put on the NAV-Queue.
+    The changes are deltas, they can not be dropped: if the queue is
+    bounded and full the greenlet waits.
+
+    Polling is driven by the trigger: an event that is set by the
+    transactions stream. When a transaction arrives the changes are
+    fetched right away. Without transactions the poll interval adapts:
+    it starts at sleepTime and doubles after each poll without changes
+    until maxSleepTime is reached.
     """
-    def __init__(self, api, accountID, queue, sleepTime=4):
+    def __init__(self, api, accountID, queue, sleepTime=4,
+                 maxSleepTime=120, trigger=None):
         super(GAccountDetails, self).__init__()
         self.api = api
         self.accountID = accountID
         self.queue = queue
         self.sleepTime = sleepTime
+        self.maxSleepTime = maxSleepTime
+        self.trigger = trigger
+
+    def wait(self, timeout):
+        """wait for the trigger or the timeout, whichever comes first."""
+        if self.trigger is None:
+            gevent.sleep(timeout)
+            return False
+
+        triggered = self.trigger.wait(timeout=timeout)
+        self.trigger.clear()
+        return triggered
 
     def _run(self):
-        # setup the summary request
+        # setup the details request
         r = AccountDetails(accountID=self.accountID)
         rv = self.api.request(r)
+        self.queue.put(rv)
 
         lastTransactionID = rv.get("lastTransactionID")
-        lastLastTransactionID = lastTransactionID
-
-        r = None
+        sleepTime = self.sleepTime
         while True:
-            if not r or lastLastTransactionID != lastTransactionID:
-                params = {"sinceTransactionID":
-                          int(rv.get("lastTransactionID"))}
-                r = AccountChanges(accountID=self.accountID, params=params)
-                lastLastTransactionID = lastTransactionID
-
+            params = {"sinceTransactionID": int(lastTransactionID)}
+            r = AccountChanges(accountID=self.accountID, params=params)
             rv = self.api.request(r)
-            lastTransactionID = rv.get('lastTransactionID')
-            self.queue.put_nowait(rv)
-            gevent.sleep(self.sleepTime)
+            self.queue.put(rv)
+
+            if rv.get('lastTransactionID') != lastTransactionID:
+                lastTransactionID = rv.get('lastTransactionID')
+                sleepTime = self.sleepTime
+            else:
+                sleepTime = min(sleepTime * 2, self.maxSleepTime)
+
+            if self.wait(sleepTime):
+                # a transaction arrived: poll fast again
+                sleepTime = self.sleepTime
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import json
+import random
+import time
+import logging
+
+import gevent
+
+from console.perf import stamp
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic(instruments, price=1.1):
+    """endless random walk price records for the instruments."""
+    prices = {i: price for i in instruments}
+    while True:
+        instrument = random.choice(instruments)
+        prices[instrument] += random.choice([-1, 1]) * 0.00005
+        bid = prices[instrument]
+        t = time.time()
+        yield {"type": "PRICE",
+               "instrument": instrument,
+               "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t)) +
+               "{:.9f}Z".format(t % 1)[1:],
+               "bids": [{"price": "{:.5f}".format(bid)}],
+               "asks": [{"price": "{:.5f}".format(bid + 0.0002)}]}
+
+
+def replay(fileName):
+    """the price records of a file, as written by concurrent_stream.py."""
+    while True:
+        with open(fileName) as I:
+            for line in I:
+                R = json.loads(line)
+                if R.get("type") == "PRICE":
+                    yield R
+
+
+class GReplayPrices(gevent.Greenlet):
+    """Greenlet to feed price records at a fixed rate.
+
+    The records are replayed from a file, or generated if no file is
+    passed. They are put on the queue like GStreamingPrices does, so the
+    console can be driven without a connection, to benchmark it.
+    """
+
+    def __init__(self, instruments, queue, rate=1000, fileName=None,
+                 timed=False):
+        super(GReplayPrices, self).__init__()
+        self.instruments = instruments
+        self.queue = queue
+        self.rate = rate
+        self.fileName = fileName
+        self.timed = timed
+        self.n = 0
+
+    def _run(self):
+        records = replay(self.fileName) if self.fileName else \
+            synthetic(self.instruments)
+        start = time.time()
+        for R in records:
+            if self.timed:
+                stamp(R)
+            self.queue.put_nowait(R)
+            self.n += 1
+            # keep the rate: sleep when ahead of schedule
+            ahead = self.n / float(self.rate) - (time.time() - start)
+            if ahead > 0.001:
+                gevent.sleep(ahead)
+            elif self.n % 100 == 0:
+                # behind: let the consumers run anyway
+                gevent.sleep(0)
@@ -3,38 +3,56 @@ import gevent
 import time
 
 from oandapyV20.endpoints.pricing import PricingStream
+from pricehub import PriceHubClient
 from oandapyV20.exceptions import V20Error, StreamTerminated
 from requests.exceptions import ConnectionError
+from console.perf import stamp
+import metrics
 import logging
 
 logger = logging.getLogger(__name__)
 
 
 class GStreamingPrices(gevent.Greenlet):
-    """Greenlet to handle streaming prices."""
+    """Greenlet to handle streaming prices.
 
-    def __init__(self, instruments, api, accountID, queue, sleepTime=0):
+    The prices are streamed from OANDA or, if the path of the socket of
+    a pricehub is passed, from the local pricehub.
+    If timed, the records are timestamped on receipt, see console.perf.
+    """
+
+    def __init__(self, instruments, api, accountID, queue, sleepTime=0,
+                 hub=None, timed=False):
         super(GStreamingPrices, self).__init__()
         self.instruments = instruments
         self.api = api
         self.accountID = accountID
         self.queue = queue
         self.sleepTime = sleepTime
+        self.hub = hub
+        self.timed = timed
         self.prev = {}
 
+    def stream(self):
+        if self.hub:
+            return PriceHubClient(self.hub, self.instruments)
+
+        r = PricingStream(
+                accountID=self.accountID,
+                params={"instruments": ",".join(self.instruments)})
+        return self.api.request(r)
+
     def _run(self):
 
         se = None  # save exception for reraise
+        stats = metrics.StreamStats("prices")
         while True:
-            # setup the stream-request
-            r = PricingStream(
-                    accountID=self.accountID,
-                    params={"instruments": ",".join(self.instruments)})
-
             n = 0
             try:
-                for R in self.api.request(r):
-                    # now = datetime.now()
+                for R in self.stream():
+                    stats.message(R)
+                    if self.timed:
+                        stamp(R)
                     self.queue.put_nowait(R)
                     gevent.sleep(0)
                     n += 1
@@ -47,6 +65,7 @@ class GStreamingPrices(gevent.Greenlet):
 
             except ConnectionError as e:
                 logger.error("ConnectionError: %s %d", e, n)
+                stats.reconnect()
                 time.sleep(3)
 
             except StreamTerminated as e:
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import gevent
+import time
+
+from oandapyV20.endpoints.transactions import TransactionsStream
+from oandapyV20.exceptions import V20Error, StreamTerminated
+from requests.exceptions import ConnectionError
+import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class GStreamingTransactions(gevent.Greenlet):
+    """Greenlet to handle streaming transactions.
+
+    Each transaction sets the trigger event so that greenlets waiting
+    on it, like GAccountDetails, can act on the transaction right away.
+    If a queue is passed the transactions are also put on that queue.
+    """
+
+    def __init__(self, api, accountID, trigger=None, queue=None):
+        super(GStreamingTransactions, self).__init__()
+        self.api = api
+        self.accountID = accountID
+        self.trigger = trigger
+        self.queue = queue
+
+    def _run(self):
+
+        se = None  # save exception for reraise
+        stats = metrics.StreamStats("transactions")
+        while True:
+            r = TransactionsStream(accountID=self.accountID)
+
+            n = 0
+            try:
+                for R in self.api.request(r):
+                    stats.message(R)
+                    n += 1
+                    if R["type"] == "HEARTBEAT":
+                        continue
+
+                    if self.queue is not None:
+                        self.queue.put_nowait(R)
+                    if self.trigger is not None:
+                        self.trigger.set()
+                    gevent.sleep(0)
+
+            except V20Error as e:
+                se = e
+                logger.error("V20Error: %s %s %d", e.code, e.msg, n)
+                break
+
+            except ConnectionError as e:
+                logger.error("ConnectionError: %s %d", e, n)
+                stats.reconnect()
+                time.sleep(3)
+
+            except StreamTerminated as e:
+                se = e
+                logger.error("StreamTerminated: %s %d", e, n)
+                break
+
+            except Exception as e:
+                se = e
+                logger.error("Exception: %s %d", e, n)
+                break
+
+        raise se
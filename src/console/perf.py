@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Render performance of the console: tick latencies and frame rate.
+
+A price record gets a list of timestamps under the key TS when it is
+received; the price queue appends the enqueue and the dequeue time.
+When the row is on the screen the timestamps are recorded in the
+histograms of RenderStats.
+"""
+import time
+
+from latency import Histogram
+
+TS = "_ts"   # key of the timestamps in a price record
+
+
+def stamp(R):
+    """start the timestamps of record R: the time of receipt."""
+    R[TS] = [time.time()]
+    return R
+
+
+class RenderStats(object):
+    """Latency histograms and frame rate of the console."""
+
+    def __init__(self):
+        self.receive = Histogram("receive->enqueue")
+        self.queued = Histogram("queue wait")
+        self.render = Histogram("dequeue->screen")
+        self.tickToScreen = Histogram("tick to screen")
+        self.frame = Histogram("frame time")
+        self.ticks = 0      # ticks on the screen
+        self.frames = 0
+        self.start = time.time()
+
+    def tick(self, R, now):
+        """record the latencies of price record R, drawn at now."""
+        ts = R.get(TS)
+        if not ts or len(ts) < 3:
+            return
+        recv, enq, deq = ts[:3]
+        self.receive.record(enq - recv)
+        self.queued.record(deq - enq)
+        self.render.record(now - deq)
+        self.tickToScreen.record(now - recv)
+        self.ticks += 1
+
+    def frameDone(self, start, now):
+        self.frame.record(now - start)
+        self.frames += 1
+
+    def fps(self):
+        elapsed = time.time() - self.start
+        return self.frames / elapsed if elapsed else 0.0
+
+    def report(self):
+        """the report as a list of lines."""
+        elapsed = time.time() - self.start
+        lines = ["{:.1f}s: {} frames, {:.1f} frames/s, {} ticks drawn, "
+                 "{:.0f} ticks/s".format(
+                     elapsed, self.frames, self.fps(), self.ticks,
+                     self.ticks / elapsed if elapsed else 0.0)]
+        for H in [self.receive, self.queued, self.render,
+                  self.tickToScreen, self.frame]:
+            lines.append(str(H))
+        return lines
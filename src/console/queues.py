@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Conflating queue to pass prices from the stream to the consumers."""
+import time
+from collections import OrderedDict
+
+from gevent.event import Event
+from gevent.queue import Empty
+
+from console.perf import TS
+
+
+def instrumentKey(R):
+    """key of a stream record: the instrument or the type (HEARTBEAT)."""
+    return R.get("instrument", R["type"])
+
+
+class ConflatingQueue(object):
+    """Queue holding only the newest item per key.
+
+    A put of an item for a key that is already in the queue overwrites
+    that item, it keeps its position in the queue. So a consumer always
+    gets the freshest price and the size of the queue is bounded by the
+    number of keys, the instruments.
+
+    The interface is that of the gevent Queue as far as used by the
+    console: put/put_nowait never block.
+
+    If timed, the enqueue and dequeue times are appended to the
+    timestamps of the items that have them, see console.perf.
+    """
+
+    def __init__(self, key=instrumentKey, timed=False):
+        self._key = key
+        self.timed = timed
+        self._items = OrderedDict()
+        self._ready = Event()
+        self.puts = 0           # number of items put
+        self.overwritten = 0    # number of items overwritten by a newer one
+        self.maxdepth = 0       # max number of items in the queue
+
+    def put(self, item, block=True, timeout=None):
+        k = self._key(item)
+        self.puts += 1
+        if k in self._items:
+            self.overwritten += 1
+        else:
+            self.maxdepth = max(self.maxdepth, len(self._items) + 1)
+        if self.timed and TS in item:
+            item[TS].append(time.time())
+        self._items[k] = item
+        self._ready.set()
+
+    def put_nowait(self, item):
+        self.put(item, False)
+
+    def get(self, block=True, timeout=None):
+        while not self._items:
+            if not block or not self._ready.wait(timeout):
+                raise Empty
+            if not self._items:
+                self._ready.clear()
+
+        k, item = self._items.popitem(last=False)
+        if not self._items:
+            self._ready.clear()
+        if self.timed and TS in item:
+            item[TS].append(time.time())
+        return item
+
+    def get_nowait(self):
+        return self.get(False)
+
+    @property
+    def ready(self):
+        """event that is set while there are items in the queue."""
+        return self._ready
+
+    def empty(self):
+        return not self._items
+
+    def qsize(self):
+        return len(self._items)
+
+    __len__ = qsize
+
+    def stats(self):
+        return {"puts": self.puts,
+                "overwritten": self.overwritten,
+                "maxdepth": self.maxdepth,
+                "depth": len(self._items)}
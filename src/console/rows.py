@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Render the instrument rows of the console."""
+
+
+class RowRenderer(object):
+    """Create the set_text components of an instrument row.
+
+    The previous prices are kept as floats per instrument, so each price
+    string is parsed once. The positions are looked up by instrument in
+    the AccountModel, that indexes the account information when it
+    arrives. So rendering a row is a few dict lookups and the formatting.
+    If sparklines are passed the mid price is added to the sparkline of
+    the instrument and the sparkline is shown in the row.
+    """
+
+    def __init__(self, account, sparklines=None):
+        self.account = account
+        self.sparklines = sparklines
+        self.prev = {}   # instrument: (bid, ask)
+
+    def render(self, r):
+        """the row fields for price record r.
+
+        "positions": [
+          {
+            "shortUnrealizedPL": "0.0000",
+            "instrument": "DE30_EUR",
+            "longUnrealizedPL": "594.3000",
+            "netUnrealizedPL": "594.3000"
+          }
+         ],
+        """
+        instrument = r["instrument"]
+        bidS = r["bids"][0]["price"]
+        askS = r["asks"][0]["price"]
+        bid, ask = float(bidS), float(askS)
+        try:
+            prevBid, prevAsk = self.prev[instrument]
+        except KeyError:
+            directionB = " "
+            directionA = " "
+        else:
+            directionB = "^" if bid > prevBid else "v"
+            directionA = "^" if ask > prevAsk else "v"
+        self.prev[instrument] = (bid, ask)
+
+        modeB = "red" if directionB == "v" else "green"
+        modeA = "red" if directionA == "v" else "green"
+
+        ext = []
+        if self.sparklines is not None:
+            self.sparklines.add(instrument, (bid + ask) / 2)
+            ext.append(('', u" " + self.sparklines.render(instrument)))
+
+        netUnr = self.account.onPrice(r, bid, ask)
+        if netUnr is not None:
+            ext.append(('', "{:10.2f}".format(netUnr)))
+
+        # instrument row set_text components ...
+        return ["{:<11s}".format(instrument),
+                (modeB, "{:10s}".format(bidS)),
+                (modeA, "{:10s}".format(askS)),
+                ('', "{:s}".format(r["time"][11:22])),
+                directionB] + ext
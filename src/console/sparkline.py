@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Sparklines: mini-charts of the recent mid prices per instrument.
+
+A sparkline covers a window of seconds with a fixed number of buckets,
+one per character on the screen. The buckets are a ring buffer in an
+array of doubles holding the last mid price of that bucket. A tick
+overwrites the value of the current bucket, so the history is
+downsampled to the screen width while it is collected: memory is fixed
+and adding a tick is O(1).
+"""
+import time
+from array import array
+
+BARS = u"▁▂▃▄▅▆▇█"
+NAN = float("nan")
+
+
+class Sparkline(object):
+    """Ring buffer of width buckets covering the last window seconds."""
+
+    __slots__ = ["width", "bucketTime", "values", "bucket"]
+
+    def __init__(self, width=20, window=300):
+        self.width = width
+        self.bucketTime = float(window) / width
+        self.values = array('d', [NAN] * width)
+        self.bucket = None   # sequence number of the current bucket
+
+    def add(self, value, t):
+        """add a value at epoch time t."""
+        b = int(t / self.bucketTime)
+        current = self.bucket
+        if current is not None and b > current + 1:
+            # buckets without ticks keep the last value; at most width
+            # buckets to fill, once per bucket change
+            last = self.values[current % self.width]
+            for k in range(max(current + 1, b - self.width + 1), b):
+                self.values[k % self.width] = last
+        if current is None or b >= current:
+            self.values[b % self.width] = value
+            self.bucket = b
+
+    def render(self):
+        """the sparkline as a string of width characters, oldest first."""
+        if self.bucket is None:
+            return u" " * self.width
+
+        start = self.bucket + 1
+        V = [self.values[(start + k) % self.width] for k in range(self.width)]
+        known = [v for v in V if v == v]   # not NaN
+        lo, hi = min(known), max(known)
+        if hi == lo:
+            return u"".join(BARS[3] if v == v else u" " for v in V)
+
+        scale = (len(BARS) - 1) / (hi - lo)
+        return u"".join(BARS[int((v - lo) * scale)] if v == v else u" "
+                        for v in V)
+
+
+class Sparklines(object):
+    """The sparklines of all instruments."""
+
+    def __init__(self, width=20, minutes=5):
+        self.width = width
+        self.window = minutes * 60
+        self._lines = {}
+
+    def add(self, instrument, mid, t=None):
+        try:
+            S = self._lines[instrument]
+        except KeyError:
+            S = self._lines[instrument] = Sparkline(self.width, self.window)
+        S.add(mid, time.time() if t is None else t)
+
+    def render(self, instrument):
+        try:
+            return self._lines[instrument].render()
+        except KeyError:
+            return u" " * self.width
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""Lazily populated trades/orders subtrees of the instrument tree.
+
+The subtrees start with a placeholder. Only when a subtree becomes
+visible by expanding it, or its instrument, the trades or orders of that
+instrument are fetched. The results are cached per instrument until a
+transaction for that instrument invalidates them.
+"""
+import logging
+
+import gevent
+import urwid
+from urwidtrees.decoration import CollapsibleIndentedTree
+
+logger = logging.getLogger(__name__)
+
+KINDS = ["trades", "orders"]
+
+
+def tradeText(T):
+    return "{:>8s} {:>10s} @ {:<10s} {:>10s}".format(
+        T["id"], T["currentUnits"], T["price"], T.get("unrealizedPL", ""))
+
+
+def orderText(O):
+    return "{:>8s} {:<20s} {:>10s} @ {:<10s}".format(
+        O["id"], O["type"], O.get("units", ""), O.get("price", ""))
+
+
+class InstrumentCache(object):
+    """Cache of the open trades and the pending orders per instrument."""
+
+    def __init__(self, api, accountID):
+        self.api = api
+        self.accountID = accountID
+        self._cache = {}    # (instrument, kind): list of trades / orders
+        self.requests = 0   # number of requests made
+
+    def get(self, instrument, kind):
+        """the cached items, None if not cached."""
+        return self._cache.get((instrument, kind))
+
+    def fetch(self, instrument, kind):
+        """fetch the items of kind for the instrument and cache them."""
+        # deferred: the endpoints are not needed for the first paint
+        from oandapyV20.endpoints.trades import TradesList
+        from oandapyV20.endpoints.orders import OrderList
+
+        if kind == "trades":
+            r = TradesList(self.accountID,
+                           params={"instrument": instrument, "state": "OPEN"})
+        else:
+            r = OrderList(self.accountID,
+                          params={"instrument": instrument, "state": "PENDING"})
+        rv = self.api.request(r)
+        self.requests += 1
+        self._cache[(instrument, kind)] = rv.get(kind, [])
+        return self._cache[(instrument, kind)]
+
+    def invalidate(self, instrument=None):
+        """drop the cached items of the instrument, or all."""
+        if instrument is None:
+            self._cache.clear()
+            return
+        for kind in KINDS:
+            self._cache.pop((instrument, kind), None)
+
+
+class LazyCollapsibleIndentedTree(CollapsibleIndentedTree):
+    """CollapsibleIndentedTree calling onExpand(pos) on an expand."""
+
+    def __init__(self, walker, onExpand=None, **kwargs):
+        super(LazyCollapsibleIndentedTree, self).__init__(walker, **kwargs)
+        self.onExpand = onExpand
+
+    def set_position_collapsed(self, pos, is_collapsed):
+        super(LazyCollapsibleIndentedTree,
+              self).set_position_collapsed(pos, is_collapsed)
+        if not is_collapsed and self.onExpand:
+            self.onExpand(pos)
+
+    def set_collapsed_all(self, is_collapsed):
+        super(LazyCollapsibleIndentedTree,
+              self).set_collapsed_all(is_collapsed)
+        if not is_collapsed and self.onExpand:
+            self.onExpand(None)
+
+
+class LazySubtrees(object):
+    """Create and fill the trades/orders subtrees on demand.
+
+    add() creates a subtree with a placeholder and registers it. The
+    tree calls expanded(pos), the subtrees that became visible are
+    filled from the cache or, if not cached, by a greenlet fetching
+    them. The subtrees are updated in place, so the tree structure
+    stays valid.
+    """
+
+    def __init__(self, cache=None, Text=urwid.Text):
+        self.cache = cache    # InstrumentCache, can be set later
+        self.Text = Text
+        self.tree = None      # the collapsible tree, set by attach
+        self.treebox = None
+        self._children = {}   # (instrument, kind): children list
+        self._pos = {}        # (instrument, kind): position in the tree
+        self._loading = {}    # (instrument, kind): greenlet
+
+    def attach(self, tree, treebox):
+        self.tree = tree
+        self.treebox = treebox
+        tree.onExpand = self.expanded
+
+    def add(self, parent, pos, instrument, kind):
+        """add the lazy subtree kind to parent, at position pos."""
+        children = [(self.Text("..."), None)]
+        parent[1].append((self.Text(kind), children))
+        self._children[(instrument, kind)] = children
+        self._pos[(instrument, kind)] = pos
+
+    def visible(self, key):
+        pos = self._pos[key]
+        return not (self.tree.is_collapsed(pos[:-1]) or
+                    self.tree.is_collapsed(pos))
+
+    def expanded(self, pos):
+        """load the subtrees that became visible by expanding pos."""
+        for key, P in self._pos.items():
+            if pos is None or P[:len(pos)] == pos:
+                if self.visible(key):
+                    self.load(*key)
+
+    def load(self, instrument, kind):
+        if self.cache is None:
+            return   # not connected yet
+        items = self.cache.get(instrument, kind)
+        if items is not None:
+            self._fill(instrument, kind, items)
+        elif (instrument, kind) not in self._loading:
+            self._fill(instrument, kind, None)
+            self._loading[(instrument, kind)] = \
+                gevent.spawn(self._fetch, instrument, kind)
+
+    def _fetch(self, instrument, kind):
+        from oandapyV20.exceptions import V20Error
+        try:
+            items = self.cache.fetch(instrument, kind)
+        except V20Error as e:
+            logger.error("V20Error: %s %s %s %s",
+                         instrument, kind, e.code, e.msg)
+            self._children[(instrument, kind)][:] = \
+                [(self.Text("error: {}".format(e.code)), None)]
+        except Exception as e:
+            logger.exception("fetch %s %s: %s", instrument, kind, e)
+            self._children[(instrument, kind)][:] = \
+                [(self.Text("error: {}".format(e)), None)]
+        else:
+            self._fill(instrument, kind, items)
+        finally:
+            del self._loading[(instrument, kind)]
+            self.refresh()
+
+    def _fill(self, instrument, kind, items):
+        if items is None:
+            lines = ["loading ..."]
+        elif not items:
+            lines = ["no {}".format(kind)]
+        else:
+            fmt = tradeText if kind == "trades" else orderText
+            lines = [fmt(I) for I in items]
+        # replace in place: the tree refers to this list
+        self._children[(instrument, kind)][:] = \
+            [(self.Text(l), None) for l in lines]
+        self.refresh()
+
+    def refresh(self):
+        if self.treebox is not None:
+            self.treebox.refresh()
+
+    def onTransaction(self, T):
+        """invalidate the cache for the instrument of transaction T.
+
+        Visible subtrees are reloaded, the others when expanded again.
+        """
+        instrument = T.get("instrument")
+        self.cache.invalidate(instrument)
+        for key in self._pos:
+            if instrument is None or key[0] == instrument:
+                if self.visible(key):
+                    self.load(*key)
+
+    def run(self, queue):
+        """handle the transactions of the queue."""
+        for T in queue:
+            self.onTransaction(T)
@@ -0,0 +1,507 @@
+# -*- coding: utf-8 -*-
+"""Streaming indicators, updated in O(1) per bar.
+
+An IndicatorSet holds the indicators of one series. The indicators are
+created by the set and shared: the SMA, Bollinger bands and WMA over the
+same period use one RollingWindow, the ring buffer of the last values
+with a running sum and sum of squares; MACD uses the EMAs of the set.
+
+    S = IndicatorSet()
+    ema = S.ema(20)
+    bb = S.bollinger(20, 2.0)      # shares the window of 20 with sma(20)
+    macd = S.macd(12, 26, 9)       # uses ema(12) and ema(26)
+    S.update(close)                # per bar; high, low for the ATR
+    ema.value, bb.value            # None until there are enough bars
+
+  sma(n), ema(n), wma(n)     moving averages
+  rsi(n), atr(n)             Wilder smoothed, seeded by the mean of n
+  bollinger(n, k)            (lower, mean, upper), population std
+  macd(fast, slow, signal)   (macd, signal, histogram)
+  rollingMin(n), rollingMax(n)  monotonic deques, amortized O(1)
+
+Batch mode: S.batch(closes, highs, lows) returns the series of every
+indicator of the set as NumPy arrays, NaN while not defined, computed
+vectorized. It gives the same values as the streaming updates up to the
+rounding of the floating point sums, for warm-up checks and backtests.
+NumPy (>= 1.20) is only needed for the batch mode.
+
+The indicators are added before the first update: an indicator added
+later would start from windows that already hold data, ValueError.
+"""
+import math
+from collections import deque, OrderedDict
+
+# the running sums are recomputed every RESYNC windows against drift
+RESYNC = 64
+# block size of the vectorized recursive smoothing (EMA, Wilder)
+BLOCK = 128
+
+
+class RollingWindow(object):
+    """The last n values with their running sum and sum of squares.
+
+    The sums are of the values less the first one, shift, so the
+    variance of prices far from 0 does not cancel out.
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.ring = [0.0] * n
+        self.pos = 0
+        self.count = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.prevSum = 0.0     # the sum before the last value
+        self.shift = None
+        self._wraps = 0
+
+    def add(self, x):
+        n = self.n
+        if self.shift is None:
+            self.shift = x
+        x -= self.shift
+        self.prevSum = self.sum
+        if self.count >= n:
+            old = self.ring[self.pos]
+            self.sum -= old
+            self.sumsq -= old * old
+        self.ring[self.pos] = x
+        self.sum += x
+        self.sumsq += x * x
+        self.count += 1
+        self.pos += 1
+        if self.pos == n:
+            self.pos = 0
+            self._wraps += 1
+            if self._wraps % RESYNC == 0:
+                self.sum = math.fsum(self.ring)
+                self.sumsq = math.fsum(v * v for v in self.ring)
+
+    @property
+    def full(self):
+        return self.count >= self.n
+
+    @property
+    def mean(self):
+        return self.shift + self.sum / self.n
+
+    @property
+    def std(self):
+        m = self.sum / self.n
+        return math.sqrt(max(0.0, self.sumsq / self.n - m * m))
+
+
+class Indicator(object):
+    """an indicator of a set: update per bar, the value or None."""
+
+    name = None
+    value = None
+
+    def update(self, c, h, l):
+        raise NotImplementedError
+
+    def batch(self, S, c, h, l):
+        """the series of the values, NaN while not defined."""
+        raise NotImplementedError
+
+
+def _nans(np, size):
+    return np.full(size, np.nan)
+
+
+def _smooth(np, x, alpha, start, seed):
+    """y[start] = seed, y[i] = y[i-1] + alpha * (x[i] - y[i-1]) after,
+    NaN before start; vectorized by blocks."""
+    y = _nans(np, len(x))
+    if start >= len(x):
+        return y
+    y[start] = seed
+    beta = 1.0 - alpha
+    prev = seed
+    i = start + 1
+    while i < len(x):
+        block = x[i:i + BLOCK]
+        k = np.arange(len(block))
+        # y[i+k] = beta^(k+1) prev + alpha sum_j beta^(k-j) x[i+j]
+        if beta > 0:
+            w = beta ** -k.astype(float)
+            acc = np.cumsum(block * w) / w
+            y[i:i + len(block)] = beta ** (k + 1) * prev + alpha * acc
+        else:
+            y[i:i + len(block)] = block
+        prev = y[i + len(block) - 1]
+        i += len(block)
+    return y
+
+
+def _rollingSum(np, x, n):
+    c = np.cumsum(np.concatenate(([0.0], x)))
+    return c[n:] - c[:-n]
+
+
+class SMA(Indicator):
+    def __init__(self, S, n):
+        self.name = "sma({})".format(n)
+        self.w = S.window(n)
+
+    def update(self, c, h, l):
+        self.value = self.w.mean if self.w.full else None
+
+    def batch(self, S, c, h, l):
+        np = S.np
+        n = self.w.n
+        y = _nans(np, len(c))
+        if len(c) >= n:
+            y[n - 1:] = c[0] + _rollingSum(np, c - c[0], n) / n
+        return y
+
+
+class EMA(Indicator):
+    """exponential moving average, alpha 2/(n+1), seeded by the SMA."""
+
+    def __init__(self, S, n):
+        self.name = "ema({})".format(n)
+        self.n = n
+        self.alpha = 2.0 / (n + 1)
+        self.w = S.window(n)
+
+    def update(self, c, h, l):
+        if self.value is not None:
+            self.value += self.alpha * (c - self.value)
+        elif self.w.full:
+            self.value = self.w.mean
+
+    def batch(self, S, c, h, l):
+        n = self.n
+        if len(c) < n:
+            return _nans(S.np, len(c))
+        return _smooth(S.np, c, self.alpha, n - 1, c[:n].sum() / n)
+
+
+class WMA(Indicator):
+    """linearly weighted moving average, weights 1..n."""
+
+    def __init__(self, S, n):
+        self.name = "wma({})".format(n)
+        self.n = n
+        self.w = S.window(n)
+        self.weighted = 0.0
+        self.norm = n * (n + 1) / 2.0
+
+    def update(self, c, h, l):
+        w = self.w
+        x = c - w.shift
+        if w.count <= self.n:
+            self.weighted += w.count * x
+        else:
+            self.weighted += self.n * x - w.prevSum
+        self.value = w.shift + self.weighted / self.norm if w.full else None
+
+    def batch(self, S, c, h, l):
+        np = S.np
+        n = self.n
+        y = _nans(np, len(c))
+        if len(c) >= n:
+            weights = np.arange(n, 0, -1, dtype=float)
+            y[n - 1:] = c[0] + np.convolve(c - c[0], weights,
+                                           "valid") / self.norm
+        return y
+
+
+class Bollinger(Indicator):
+    """(lower, mean, upper): mean -/+ k population standard deviations."""
+
+    def __init__(self, S, n, k):
+        self.name = "bollinger({},{:g})".format(n, k)
+        self.k = k
+        self.w = S.window(n)
+
+    def update(self, c, h, l):
+        w = self.w
+        if w.full:
+            m, d = w.mean, self.k * w.std
+            self.value = (m - d, m, m + d)
+
+    def batch(self, S, c, h, l):
+        np = S.np
+        n = self.w.n
+        y = _nans(np, (len(c), 3))
+        if len(c) >= n:
+            x = c - c[0]
+            m = _rollingSum(np, x, n) / n
+            var = _rollingSum(np, x * x, n) / n - m * m
+            d = self.k * np.sqrt(np.maximum(var, 0.0))
+            m += c[0]
+            y[n - 1:] = np.column_stack((m - d, m, m + d))
+        return y
+
+
+class _Wilder(Indicator):
+    """Wilder smoothing of a per bar input: the mean of the first n,
+    then avg += (x - avg) / n."""
+
+    def __init__(self, n):
+        self.n = n
+        self.avg = None
+        self.seed = []
+
+    def smooth(self, x):
+        if self.avg is not None:
+            self.avg += (x - self.avg) / self.n
+        else:
+            self.seed.append(x)
+            if len(self.seed) == self.n:
+                self.avg = sum(self.seed) / self.n
+                self.seed = None
+        return self.avg
+
+    def smoothBatch(self, np, x, first):
+        """the smoothed series of x[first:], aligned with x."""
+        n = self.n
+        if len(x) - first < n:
+            return _nans(np, len(x))
+        start = first + n - 1
+        return _smooth(np, x, 1.0 / n, start, x[first:start + 1].sum() / n)
+
+
+class RSI(Indicator):
+    """relative strength index, Wilder smoothed gains and losses."""
+
+    def __init__(self, S, n):
+        self.name = "rsi({})".format(n)
+        self.gains = _Wilder(n)
+        self.losses = _Wilder(n)
+        self.prev = None
+
+    def update(self, c, h, l):
+        if self.prev is not None:
+            d = c - self.prev
+            g = self.gains.smooth(d if d > 0 else 0.0)
+            s = self.losses.smooth(-d if d < 0 else 0.0)
+            if g is not None:
+                self.value = 100.0 if s == 0 else \
+                    100.0 - 100.0 / (1.0 + g / s)
+        self.prev = c
+
+    def batch(self, S, c, h, l):
+        np = S.np
+        d = np.concatenate(([0.0], np.diff(c))) if len(c) else c
+        g = self.gains.smoothBatch(np, np.maximum(d, 0.0), 1)
+        s = self.losses.smoothBatch(np, np.maximum(-d, 0.0), 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            y = 100.0 - 100.0 / (1.0 + g / s)
+        y[(s == 0) & ~np.isnan(g)] = 100.0
+        return y
+
+
+class ATR(Indicator):
+    """average true range, Wilder smoothed; high = low = close if the
+    bars have only a close."""
+
+    def __init__(self, S, n):
+        self.name = "atr({})".format(n)
+        self.tr = _Wilder(n)
+        self.prev = None
+
+    def update(self, c, h, l):
+        h = c if h is None else h
+        l = c if l is None else l
+        if self.prev is None:
+            tr = h - l
+        else:
+            tr = max(h - l, abs(h - self.prev), abs(l - self.prev))
+        self.prev = c
+        self.value = self.tr.smooth(tr)
+
+    def batch(self, S, c, h, l):
+        np = S.np
+        h = c if h is None else h
+        l = c if l is None else l
+        tr = h - l
+        if len(c) > 1:
+            pc = c[:-1]
+            tr[1:] = np.maximum(tr[1:], np.maximum(np.abs(h[1:] - pc),
+                                                   np.abs(l[1:] - pc)))
+        return self.tr.smoothBatch(np, tr, 0)
+
+
+class MACD(Indicator):
+    """(macd, signal, histogram): ema(fast) - ema(slow) and its EMA."""
+
+    def __init__(self, S, fast, slow, signal):
+        self.name = "macd({},{},{})".format(fast, slow, signal)
+        self.fast = S.ema(fast)
+        self.slow = S.ema(slow)
+        self.signalN = signal
+        self.alpha = 2.0 / (signal + 1)
+        self.seed = []
+        self.signal = None
+
+    def update(self, c, h, l):
+        f, s = self.fast.value, self.slow.value
+        if f is None or s is None:
+            return
+        m = f - s
+        if self.signal is not None:
+            self.signal += self.alpha * (m - self.signal)
+        else:
+            self.seed.append(m)
+            if len(self.seed) < self.signalN:
+                return
+            self.signal = sum(self.seed) / self.signalN
+            self.seed = None
+        self.value = (m, self.signal, m - self.signal)
+
+    def batch(self, S, c, h, l):
+        np = S.np
+        m = S.series(self.fast) - S.series(self.slow)
+        y = _nans(np, (len(c), 3))
+        first = int(np.argmax(~np.isnan(m))) if (~np.isnan(m)).any() \
+            else len(c)
+        start = first + self.signalN - 1
+        if start < len(c):
+            signal = _smooth(np, np.nan_to_num(m), self.alpha, start,
+                             m[first:start + 1].sum() / self.signalN)
+            y[start:, 0] = m[start:]
+            y[start:, 1] = signal[start:]
+            y[start:, 2] = m[start:] - signal[start:]
+        return y
+
+
+class _RollingExtreme(Indicator):
+    """min / max of the last n by a monotonic deque of (bar, value)."""
+
+    def __init__(self, S, n, name, better):
+        self.name = "{}({})".format(name, n)
+        self.n = n
+        self.better = better   # keeps a over b at the back
+        self.q = deque()
+        self.i = 0
+
+    def update(self, c, h, l):
+        q = self.q
+        while q and not self.better(q[-1][1], c):
+            q.pop()
+        q.append((self.i, c))
+        if q[0][0] <= self.i - self.n:
+            q.popleft()
+        self.i += 1
+        self.value = q[0][1] if self.i >= self.n else None
+
+
+class RollingMin(_RollingExtreme):
+    def __init__(self, S, n):
+        super(RollingMin, self).__init__(S, n, "min", lambda a, b: a < b)
+
+    def batch(self, S, c, h, l):
+        np = S.np
+        y = _nans(np, len(c))
+        if len(c) >= self.n:
+            y[self.n - 1:] = np.lib.stride_tricks.sliding_window_view(
+                c, self.n).min(axis=1)
+        return y
+
+
+class RollingMax(_RollingExtreme):
+    def __init__(self, S, n):
+        super(RollingMax, self).__init__(S, n, "max", lambda a, b: a > b)
+
+    def batch(self, S, c, h, l):
+        np = S.np
+        y = _nans(np, len(c))
+        if len(c) >= self.n:
+            y[self.n - 1:] = np.lib.stride_tricks.sliding_window_view(
+                c, self.n).max(axis=1)
+        return y
+
+
+class IndicatorSet(object):
+    """The indicators of a series, see the module docstring."""
+
+    def __init__(self):
+        self.windows = OrderedDict()      # n: RollingWindow
+        self.indicators = OrderedDict()   # name: Indicator, update order
+        self.count = 0
+        self._series = None               # batch: name: array
+
+    def window(self, n):
+        try:
+            return self.windows[n]
+        except KeyError:
+            self._adding("window({})".format(n))
+            w = self.windows[n] = RollingWindow(n)
+            return w
+
+    def _adding(self, name):
+        if self.count:
+            raise ValueError("indicators: {} added after the first "
+                             "update".format(name))
+
+    def _get(self, cls, *args):
+        I = cls(self, *args)
+        # the indicators it depends on are added first by cls
+        if I.name not in self.indicators:
+            self._adding(I.name)
+        return self.indicators.setdefault(I.name, I)
+
+    def sma(self, n):
+        return self._get(SMA, n)
+
+    def ema(self, n):
+        return self._get(EMA, n)
+
+    def wma(self, n):
+        return self._get(WMA, n)
+
+    def bollinger(self, n, k=2.0):
+        return self._get(Bollinger, n, k)
+
+    def rsi(self, n=14):
+        return self._get(RSI, n)
+
+    def atr(self, n=14):
+        return self._get(ATR, n)
+
+    def macd(self, fast=12, slow=26, signal=9):
+        return self._get(MACD, fast, slow, signal)
+
+    def rollingMin(self, n):
+        return self._get(RollingMin, n)
+
+    def rollingMax(self, n):
+        return self._get(RollingMax, n)
+
+    def update(self, c, h=None, l=None):
+        """add a bar: the windows first, then the indicators in order."""
+        for w in self.windows.values():
+            w.add(c)
+        for I in self.indicators.values():
+            I.update(c, h, l)
+        self.count += 1
+
+    def values(self):
+        return OrderedDict((name, I.value)
+                           for name, I in self.indicators.items())
+
+    # -- batch mode
+    def series(self, I):
+        """the batch series of indicator I, computed once per batch."""
+        try:
+            return self._series[I.name]
+        except KeyError:
+            y = self._series[I.name] = I.batch(self, *self._inputs)
+            return y
+
+    def batch(self, closes, highs=None, lows=None):
+        """the series of all indicators of the set, by name."""
+        import numpy
+        self.np = numpy
+        asarray = lambda v: None if v is None else \
+            numpy.asarray(v, dtype=float)
+        self._inputs = (asarray(closes), asarray(highs), asarray(lows))
+        self._series = OrderedDict()
+        try:
+            return OrderedDict((name, self.series(I))
+                               for name, I in self.indicators.items())
+        finally:
+            self._series = None
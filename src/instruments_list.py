@@ -1,14 +1,17 @@
 # -*- coding: utf-8 -*-
-"""retrieve the tradable instruments for account."""
+"""retrieve the tradable instruments for account.
+
+The instruments come from the catalog: they are fetched once and cached
+on disk, see catalog.py for the queries by type and currency.
+"""
 
 import json
 import oandapyV20
-import oandapyV20.endpoints.accounts as accounts
+from catalog import Catalog
 from exampleauth import exampleAuth
 
 accountID, token = exampleAuth()
 client = oandapyV20.API(access_token=token)
 
-r = accounts.AccountInstruments(accountID=accountID)
-rv = client.request(r)
-print(json.dumps(rv, indent=2))
+catalog = Catalog(client, accountID).load()
+print(json.dumps({"instruments": catalog.specs()}, indent=2))
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Durable journal of the transactions of an account.
+
+The transactions are appended to a file, one JSON record per line, and
+the ID of the last one is checkpointed next to it. After a restart the
+journal catches up from that ID with TransactionsSinceID pages before
+it follows the TransactionsStream, so no transaction is lost:
+
+    J = TransactionJournal("transactions.jsonl")
+    for T in J.stream(api, accountID):
+        ...                      # each transaction once, in ID order
+
+The transaction IDs of an account increase by one, so the journal
+deduplicates by ID and detects gaps: a streamed transaction or a
+heartbeat with a lastTransactionID beyond the last ID in the journal
+makes it fetch the missing range with TransactionIDRange first.
+
+A new journal starts at the last transaction of the account, it does
+not fetch the history.
+
+The checkpoint is written after the journal is synced to disk
+(fsync), through a synced temporary file that is renamed. A line that
+was partly written when the process stopped is cut off when the
+journal is opened again.
+"""
+import os
+import json
+import logging
+
+from oandapyV20.endpoints.transactions import (
+    TransactionsSinceID, TransactionIDRange, TransactionsStream
+)
+from oandapyV20.endpoints.accounts import AccountSummary
+
+logger = logging.getLogger(__name__)
+
+
+class TransactionJournal(object):
+    """Transactions file with a checkpoint, see the module docstring."""
+
+    def __init__(self, fileName="transactions.jsonl"):
+        self.fileName = fileName
+        self.checkpointName = fileName + ".checkpoint"
+        self._truncatePartial()
+        self.lastID = self._recover()
+        self.appended = 0
+        self.duplicates = 0
+        self.caughtUp = 0
+        self.request = None   # the TransactionsStream, to terminate it
+        self._O = open(fileName, "a")
+
+    def _truncatePartial(self):
+        """cut off a last line without a newline: a partial write."""
+        try:
+            with open(self.fileName, "rb+") as F:
+                F.seek(0, os.SEEK_END)
+                size = F.tell()
+                F.seek(max(0, size - 65536))
+                tail = F.read()
+                if not tail or tail.endswith(b"\n"):
+                    return
+                pos = size - len(tail) + tail.rfind(b"\n") + 1
+                logger.warning("journal: cut off a partial line of %d "
+                               "bytes", size - pos)
+                F.truncate(pos)
+                F.flush()
+                os.fsync(F.fileno())
+        except (IOError, OSError):
+            pass
+
+    def _recover(self):
+        """the last ID: the checkpoint, or a later ID in the journal if
+        the process stopped between the write and the checkpoint."""
+        lastID = None
+        try:
+            with open(self.checkpointName) as I:
+                lastID = int(I.read().strip())
+        except (IOError, OSError, ValueError):
+            pass
+        tail = self._lastRecord()
+        if tail is not None and (lastID is None or int(tail["id"]) > lastID):
+            lastID = int(tail["id"])
+        return lastID
+
+    def _lastRecord(self):
+        try:
+            with open(self.fileName, "rb") as I:
+                I.seek(0, os.SEEK_END)
+                I.seek(max(0, I.tell() - 65536))
+                lines = I.read().splitlines()
+        except (IOError, OSError):
+            return None
+        for line in reversed(lines):
+            try:
+                R = json.loads(line.decode("utf-8"))
+            except ValueError:
+                continue   # a partly written line
+            if "id" in R:
+                return R
+        return None
+
+    def checkpoint(self):
+        """sync the journal, then write the last ID durably."""
+        if not self._O.closed:
+            self._O.flush()
+            os.fsync(self._O.fileno())
+        tmp = self.checkpointName + ".tmp"
+        with open(tmp, "w") as O:
+            O.write("{}\n".format(self.lastID))
+            O.flush()
+            os.fsync(O.fileno())
+        os.rename(tmp, self.checkpointName)
+
+    def append(self, T, checkpoint=True):
+        """append a transaction, False if it is in the journal already."""
+        tid = int(T["id"])
+        if self.lastID is not None and tid <= self.lastID:
+            self.duplicates += 1
+            return False
+        self._O.write(json.dumps(T) + "\n")
+        self._O.flush()
+        self.lastID = tid
+        self.appended += 1
+        if checkpoint:
+            self.checkpoint()
+        return True
+
+    def close(self):
+        self._O.close()
+
+    # -- catch up
+    def start(self, api, accountID):
+        """the last ID of a new journal: the last of the account."""
+        rv = api.request(AccountSummary(accountID=accountID))
+        self.lastID = int(rv["lastTransactionID"])
+        self.checkpoint()
+        logger.info("journal: new, starting after %s", self.lastID)
+
+    def catchUp(self, api, accountID):
+        """append the transactions after the last ID, returns them."""
+        if self.lastID is None:
+            self.start(api, accountID)
+            return []
+        new = []
+        while True:
+            r = TransactionsSinceID(accountID=accountID,
+                                    params={"id": self.lastID})
+            rv = api.request(r)
+            page = [T for T in rv.get("transactions", [])
+                    if self.append(T, checkpoint=False)]
+            new.extend(page)
+            if not page or self.lastID >= int(rv["lastTransactionID"]):
+                break
+        if new:
+            self.checkpoint()
+        self.caughtUp += len(new)
+        logger.info("journal: caught up %d transactions, last %s",
+                    len(new), self.lastID)
+        return new
+
+    def fill(self, api, accountID, toID):
+        """append the missing transactions up to toID, returns them."""
+        new = []
+        while self.lastID < toID:
+            r = TransactionIDRange(accountID=accountID,
+                                   params={"from": self.lastID + 1,
+                                           "to": toID})
+            rv = api.request(r)
+            page = [T for T in rv.get("transactions", [])
+                    if self.append(T, checkpoint=False)]
+            if not page:
+                break
+            new.extend(page)
+        self.checkpoint()
+        self.caughtUp += len(new)
+        logger.info("journal: gap filled with %d transactions up to %s",
+                    len(new), toID)
+        return new
+
+    def stream(self, api, accountID, heartbeats=False):
+        """the new transactions: the catch up, then the live stream.
+
+        With heartbeats the HEARTBEAT records are passed on too.
+        """
+        for T in self.catchUp(api, accountID):
+            yield T
+
+        self.request = TransactionsStream(accountID=accountID)
+        for R in api.request(self.request):
+            if R["type"] == "HEARTBEAT":
+                if int(R["lastTransactionID"]) > self.lastID:
+                    for T in self.fill(api, accountID,
+                                       int(R["lastTransactionID"])):
+                        yield T
+                if heartbeats:
+                    yield R
+                continue
+
+            if int(R["id"]) > self.lastID + 1:
+                for T in self.fill(api, accountID, int(R["id"]) - 1):
+                    yield T
+            if self.append(R):
+                yield R
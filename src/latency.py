@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Latency histograms.
+
+A Histogram counts latencies in log-linear buckets of microseconds:
+exact below 64us, above that 32 buckets per power of two, so the
+relative error of a percentile is at most ~3%. Recording is an index
+calculation and an increment, the memory is fixed (~900 counters for
+latencies up to an hour).
+
+    H = Histogram("tick to screen")
+    H.record(t1 - t0)                   # seconds
+    H.percentile(99)                    # microseconds
+    print(H)                            # summary line
+"""
+from array import array
+
+SUB = 32         # sub-buckets per power of two
+SHIFT = 5        # log2(SUB)
+MAXUS = 3600 * 1000000
+
+
+def bucketOf(us):
+    """the bucket index of a value in microseconds."""
+    if us < 2 * SUB:
+        return us
+    e = us.bit_length() - (SHIFT + 1)
+    return (e + 1) * SUB + (us >> e) - SUB
+
+
+def valueOf(idx):
+    """the lowest value in microseconds of a bucket."""
+    if idx < 2 * SUB:
+        return idx
+    e = idx // SUB - 1
+    return (idx - e * SUB) << e
+
+
+class Histogram(object):
+    """Log-linear histogram of latencies, see the module docstring."""
+
+    def __init__(self, name=""):
+        self.name = name
+        self.counts = array('Q', [0] * (bucketOf(MAXUS) + 1))
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0.0     # sum in seconds
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        """record a latency in seconds."""
+        us = int(seconds * 1000000)
+        if us < 0:
+            us = 0
+        elif us > MAXUS:
+            us = MAXUS
+        self.counts[bucketOf(us)] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """add the counts of another histogram."""
+        for i, c in enumerate(other.counts):
+            if c:
+                self.counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        for attr, f in [("min", min), ("max", max)]:
+            v = getattr(other, attr)
+            if v is not None:
+                cur = getattr(self, attr)
+                setattr(self, attr, v if cur is None else f(cur, v))
+
+    def percentile(self, p):
+        """the p-th percentile in microseconds, None if empty."""
+        if not self.count:
+            return None
+        rank = max(1, int(round(self.count * p / 100.0)))
+        n = 0
+        for i, c in enumerate(self.counts):
+            n += c
+            if n >= rank:
+                # the middle of the bucket, within the observed range
+                v = (valueOf(i) + valueOf(i + 1)) / 2.0
+                return min(max(v, self.min * 1e6), self.max * 1e6)
+
+    @property
+    def mean(self):
+        """the mean in microseconds, None if empty."""
+        return self.total / self.count * 1e6 if self.count else None
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)):
+        """dict with count, min, mean, percentiles and max in us."""
+        S = {"count": self.count}
+        if self.count:
+            S.update({"min": self.min * 1e6, "mean": self.mean,
+                      "max": self.max * 1e6})
+            for p in percentiles:
+                S["p{:g}".format(p)] = self.percentile(p)
+        return S
+
+    def __str__(self):
+        if not self.count:
+            return "{:20s} no samples".format(self.name)
+        return ("{:20s} n={:<8d} min={:9.1f} p50={:9.1f} p90={:9.1f} "
+                "p99={:9.1f} p99.9={:9.1f} max={:9.1f} us".format(
+                    self.name, self.count, self.min * 1e6,
+                    self.percentile(50), self.percentile(90),
+                    self.percentile(99), self.percentile(99.9),
+                    self.max * 1e6))
@@ -4,14 +4,17 @@ demonstrates:
 - placing a market order
 - placing a faulty market order
 - usage of contrib.requests
+- placing the orders concurrently with bulkorders
 - logging
 """
+from gevent import monkey
+monkey.patch_all()
+
 import json
 from oandapyV20 import API
-import oandapyV20.endpoints.orders as orders
 from oandapyV20.contrib.requests import MarketOrderRequest
-from oandapyV20.exceptions import V20Error
 from exampleauth import exampleAuth
+from bulkorders import BulkOrders
 import logging
 
 logging.basicConfig(
@@ -30,16 +33,13 @@ orderConf = [
 # client
 api = API(access_token=token)
 
-# create and process order requests
-for O in orderConf:
-    r = orders.OrderCreate(accountID=accountID, data=O)
-    print("processing : {}".format(r))
+# create the orders concurrently, the results in the order of orderConf
+engine = BulkOrders(api, accountID, size=len(orderConf))
+for R in engine.run(orderConf):
+    print("processing : {} {}".format(R["clientID"], orderConf[R["index"]]))
     print("===============================")
-    print(r.data)
-    try:
-        response = api.request(r)
-    except V20Error as e:
-        print("V20Error: {}".format(e))
+    if R["ok"]:
+        print("Response: {} ({:.3f}s)\n{}".format(
+            R["status"], R["latency"], json.dumps(R["response"], indent=2)))
     else:
-        print("Response: {}\n{}".format(r.status_code,
-                                        json.dumps(response, indent=2)))
+        print("V20Error: {} ({:.3f}s)".format(R["error"], R["latency"]))
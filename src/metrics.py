@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+"""Metrics registry with a Prometheus scrape endpoint.
+
+Counters, gauges and histograms are registered in a Registry and
+exposed in the Prometheus text format by serve(port), on
+http://127.0.0.1:<port>/metrics.
+
+Updates on the hot path take no lock: a counter keeps a cell per OS
+thread that only that thread increments, the cells are summed on a
+scrape. The cells are keyed by the ident of the real thread, not the
+one patched by gevent: greenlets of a thread share its cell, so short
+lived greenlets do not add cells. Histograms record in a latency.Histogram and are converted to
+cumulative buckets on a scrape. Gauges can be a callback, evaluated on
+a scrape only, for example the depth of a queue.
+
+The metrics of the streams, the REST requests and the orders are
+defined here, so all applications export the same names:
+
+    metrics.instrumentAPI(api)           # latency/errors per endpoint
+    S = metrics.StreamStats("prices")
+    S.message(R)                         # for each stream record
+    metrics.serve(9100)
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from latency import Histogram as LatencyHistogram, valueOf
+
+logger = logging.getLogger(__name__)
+
+
+def _threadIdent():
+    """get_ident of the OS threads, also if gevent patched it."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        monkey = None
+    if monkey is not None and monkey.is_module_patched("threading"):
+        return monkey.get_original("_thread", "get_ident")
+    import _thread
+    return _thread.get_ident
+
+
+_getIdent = _threadIdent()
+
+# the upper bounds, in seconds, of the buckets of a histogram
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0]
+
+
+def _labelstr(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(
+        n, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for n, v in zip(names, values)) + "}"
+
+
+class CounterChild(object):
+    """a counter for one set of label values."""
+
+    __slots__ = ["_cells"]
+
+    def __init__(self):
+        self._cells = {}   # OS thread ident: count
+
+    def inc(self, n=1):
+        t = _getIdent()
+        try:
+            self._cells[t] += n
+        except KeyError:
+            self._cells[t] = n
+
+    @property
+    def value(self):
+        return sum(list(self._cells.values()))
+
+
+class HistogramChild(object):
+    """a histogram for one set of label values."""
+
+    __slots__ = ["_h"]
+
+    def __init__(self):
+        self._h = LatencyHistogram()
+
+    def observe(self, seconds):
+        self._h.record(seconds)
+
+    def time(self):
+        """context manager observing the duration of the block."""
+        return _Timer(self)
+
+    def buckets(self):
+        """[(le, cumulative count)], the count and the sum."""
+        counts = list(self._h.counts)
+        total = self._h.count
+        cum = []
+        n, idx = 0, 0
+        for le in BUCKETS:
+            limit = int(le * 1000000)
+            while idx < len(counts) and valueOf(idx + 1) <= limit:
+                n += counts[idx]
+                idx += 1
+            cum.append((le, n))
+        return cum, total, self._h.total
+
+
+class _Timer(object):
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.time() - self.start)
+
+
+class GaugeChild(object):
+    """a gauge for one set of label values: set or a callback."""
+
+    __slots__ = ["_value", "_fn"]
+
+    def __init__(self):
+        self._value = 0.0
+        self._fn = None
+
+    def set(self, v):
+        self._value = v
+
+    def setFunction(self, fn):
+        self._fn = fn
+
+    @property
+    def value(self):
+        return self._fn() if self._fn is not None else self._value
+
+
+class Metric(object):
+    """a metric and its children by label values."""
+
+    TYPE = None
+    CHILD = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._children = OrderedDict()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values):
+        try:
+            return self._children[values]
+        except KeyError:
+            if len(values) != len(self.labelnames):
+                raise ValueError("{}: labels {} expected".format(
+                    self.name, self.labelnames))
+            child = self._children.setdefault(values, self.CHILD())
+            return child
+
+    def samples(self):
+        """[(suffix, labelstr, value)]"""
+        S = []
+        for values, child in list(self._children.items()):
+            S.append(("", _labelstr(self.labelnames, values), child.value))
+        return S
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help),
+                 "# TYPE {} {}".format(self.name, self.TYPE)]
+        for suffix, labels, value in self.samples():
+            lines.append("{}{}{} {}".format(self.name, suffix, labels,
+                                            repr(float(value))))
+        return lines
+
+
+class Counter(Metric):
+    TYPE = "counter"
+    CHILD = CounterChild
+
+    def inc(self, n=1):
+        self._default.inc(n)
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+    CHILD = GaugeChild
+
+    def set(self, v):
+        self._default.set(v)
+
+    def setFunction(self, fn):
+        self._default.setFunction(fn)
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+    CHILD = HistogramChild
+
+    def observe(self, seconds):
+        self._default.observe(seconds)
+
+    def samples(self):
+        S = []
+        for values, child in list(self._children.items()):
+            cum, count, total = child.buckets()
+            for le, n in cum:
+                S.append(("_bucket", _labelstr(
+                    self.labelnames + ("le",), values + (repr(le),)), n))
+            S.append(("_bucket", _labelstr(self.labelnames + ("le",),
+                                           values + ("+Inf",)), count))
+            labels = _labelstr(self.labelnames, values)
+            S.append(("_count", labels, count))
+            S.append(("_sum", labels, total))
+        return S
+
+
+class Registry(object):
+    """The registered metrics."""
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+
+    def _register(self, cls, name, help, labels):
+        if name not in self._metrics:
+            self._metrics[name] = cls(name, help, labels)
+        return self._metrics[name]
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._register(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=()):
+        return self._register(Histogram, name, help, labels)
+
+    def render(self):
+        """all metrics in the Prometheus text format."""
+        lines = []
+        for m in list(self._metrics.values()):
+            try:
+                lines.extend(m.render())
+            except Exception as e:
+                logger.error("metric %s: %s", m.name, e)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# the metrics of the streams, the requests and the orders
+TICKS = REGISTRY.counter(
+    "oanda_stream_ticks_total", "price ticks received",
+    ["stream", "instrument"])
+MESSAGES = REGISTRY.counter(
+    "oanda_stream_messages_total", "stream records by type",
+    ["stream", "type"])
+GAPS = REGISTRY.histogram(
+    "oanda_stream_gap_seconds", "time between stream records",
+    ["stream"])
+SILENCE = REGISTRY.gauge(
+    "oanda_stream_silence_seconds", "time since the last stream record",
+    ["stream"])
+RECONNECTS = REGISTRY.counter(
+    "oanda_stream_reconnects_total", "reconnects of a stream",
+    ["stream"])
+REQUEST_LATENCY = REGISTRY.histogram(
+    "oanda_request_seconds", "latency of the REST requests",
+    ["endpoint"])
+REQUEST_ERRORS = REGISTRY.counter(
+    "oanda_request_errors_total", "failed REST requests",
+    ["endpoint", "code"])
+ORDERS = REGISTRY.counter(
+    "oanda_orders_total", "orders by outcome", ["outcome"])
+QUEUE_DEPTH = REGISTRY.gauge(
+    "oanda_queue_depth", "items in a queue", ["queue"])
+LOG_RECORDS = REGISTRY.gauge(
+    "oanda_log_records", "records of the asynchronous log by state",
+    ["state"])
+
+
+class StreamStats(object):
+    """Metrics of a stream: ticks per instrument, gaps and reconnects."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.last = None
+        self._ticks = {}    # instrument: counter child
+        self._types = {}    # type: counter child
+        self._gaps = GAPS.labels(stream)
+        self._reconnects = RECONNECTS.labels(stream)
+        SILENCE.labels(stream).setFunction(
+            lambda: time.time() - self.last if self.last else 0.0)
+
+    def message(self, R):
+        now = time.time()
+        if self.last is not None:
+            self._gaps.observe(now - self.last)
+        self.last = now
+
+        T = R.get("type")
+        try:
+            self._types[T].inc()
+        except KeyError:
+            self._types[T] = MESSAGES.labels(self.stream, T)
+            self._types[T].inc()
+
+        instrument = R.get("instrument")
+        if T == "PRICE" and instrument:
+            try:
+                self._ticks[instrument].inc()
+            except KeyError:
+                self._ticks[instrument] = TICKS.labels(self.stream,
+                                                       instrument)
+                self._ticks[instrument].inc()
+
+    def reconnect(self):
+        self._reconnects.inc()
+
+
+def order(response=None, error=None):
+    """count the outcome of an order request."""
+    if error is not None:
+        ORDERS.labels("error_{}".format(getattr(error, "code", ""))).inc()
+    elif "orderFillTransaction" in response:
+        ORDERS.labels("filled").inc()
+    elif "orderCancelTransaction" in response:
+        ORDERS.labels("cancelled").inc()
+    elif "orderRejectTransaction" in response:
+        ORDERS.labels("rejected").inc()
+    else:
+        ORDERS.labels("created").inc()
+
+
+def queueDepth(name, queue):
+    """export the depth of a queue, read on a scrape."""
+    QUEUE_DEPTH.labels(name).setFunction(queue.qsize)
+
+
+def instrumentAPI(api):
+    """time the REST requests of api per endpoint class.
+
+    Stream requests are not timed, their records are counted by
+    StreamStats.
+    """
+    request = api.request
+
+    def timedRequest(endpoint):
+        name = type(endpoint).__name__
+        if getattr(endpoint, "STREAM", False):
+            return request(endpoint)
+        start = time.time()
+        try:
+            rv = request(endpoint)
+        except Exception as e:
+            REQUEST_ERRORS.labels(name, getattr(e, "code", "")
+                                  or type(e).__name__).inc()
+            raise
+        finally:
+            REQUEST_LATENCY.labels(name).observe(time.time() - start)
+        return rv
+
+    api.request = timedRequest
+    return api
+
+
+def serve(port, host="127.0.0.1", registry=REGISTRY):
+    """serve /metrics on host:port from a (green) thread."""
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type",
+                             "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            logger.debug("metrics: " + fmt, *args)
+
+    server = HTTPServer((host, port), Handler)
+    t = threading.Thread(target=server.serve_forever, name="metrics")
+    t.daemon = True
+    t.start()
+    logger.info("metrics on http://%s:%d/metrics", host, port)
+    return server
@@ -36,8 +36,8 @@ urwid repos: urwid and urwidtrees.
 THIS PROGRAM IS SOLELY FOR DEMONSTRATION PURPOSE
 """
 import sys
+import time
 import urwid
-import subprocess
 import logging
 from collections import OrderedDict
 import gevent
@@ -50,18 +50,26 @@ if sys.version_info.major == 2:
 # ------------------------------------
 from gevent.pool import Group
 from gevent.queue import Queue
+from gevent.event import Event
 
-from oandapyV20 import API
-from oandapyV20.exceptions import V20Error
-from exampleauth import exampleAuth
 from datetime import datetime
 
 from urwidtrees.widgets import TreeBox
 from urwidtrees.tree import SimpleTree
 # from urwidtrees.nested import NestedTree
 # from urwidtrees.decoration import ArrowTree, CollapsibleArrowTree
-from urwidtrees.decoration import CollapsibleIndentedTree
-from console.greenlets import GAccountDetails, GStreamingPrices
+# oandapyV20 and the greenlets are imported by startStreams: they are
+# not needed for the first paint of the screen
+from console.account import AccountModel
+from console.queues import ConflatingQueue
+from console.perf import RenderStats
+from console.rows import RowRenderer
+from console.sparkline import Sparklines
+from console.subtrees import (
+    KINDS,
+    LazyCollapsibleIndentedTree,
+    LazySubtrees
+)
 
 
 logging.basicConfig(
@@ -75,85 +83,83 @@ logger = logging.getLogger(__name__)
 
 # greenlets ...
 class WidgetUpdate(gevent.Greenlet):
-    """Greenlet to update the widgets based on queue information."""
+    """Greenlet to update the widgets based on queue information.
+
+    The greenlet sleeps until there is new data. New prices and account
+    information mark the rows and the header dirty. The dirty widgets
+    are redrawn in batches, at most fps times per second.
+    """
 
-    def __init__(self, q_nav, q_price, widget=None):
+    def __init__(self, q_nav, q_price, widget=None, fps=20,
+                 sparklines=None, stats=None, onFrame=None):
         super(WidgetUpdate, self).__init__()
         self.q_nav = q_nav
         self.q_price = q_price
         self.widget = widget
-        self.prev = {}
-
-    def mkrecord(self, snapshot, r):
-        """update the instrument row by creating all row fields.
-
-        "positions": [
-          {
-            "shortUnrealizedPL": "0.0000",
-            "instrument": "DE30_EUR",
-            "longUnrealizedPL": "594.3000",
-            "netUnrealizedPL": "594.3000"
-          }
-         ],
-        """
-        try:
-            prev = self.prev[r["instrument"]]
-        except KeyError:
-            directionB = " "
-            directionA = " "
-        else:
-            directionB = "^" if float(r["bids"][0]["price"]) > \
-                         float(prev["bids"][0]["price"]) else "v"
-            directionA = "^" if float(r["asks"][0]["price"]) > \
-                         float(prev["asks"][0]["price"]) else "v"
-
-        modeB = "red" if directionB == "v" else "green"
-        modeA = "red" if directionA == "v" else "green"
-
-        ext = []
-        if snapshot:
-            positions = snapshot.get('state').get('positions')
-            for P in positions:
-                if r["instrument"] == P["instrument"]:
-                    netUnr = float(P.get('netUnrealizedPL'))
-                    ext.append(('', "{:10.2f}".format(netUnr)))
-
-        # instrument row set_text components ...
-        return ["{:<11s}".format(r["instrument"]),
-                (modeB, "{:10s}".format(r["bids"][0]["price"])),
-                (modeA, "{:10s}".format(r["asks"][0]["price"])),
-                ('', "{:s}".format(r["time"][11:22])),
-                directionB] + ext
+        self.fps = fps
+        self.stats = stats        # RenderStats to record the latencies
+        self.onFrame = onFrame    # called after the widgets of a frame
+        self.account = AccountModel()
+        self.rows = RowRenderer(self.account, sparklines)
+        self.navReady = Event()
+
+    def mkrecord(self, r):
+        """update the instrument row by creating all row fields."""
+        return self.rows.render(r)
+
+    def navReader(self):
+        """apply the account information of the NAV-queue."""
+        for snapshot in self.q_nav:
+            if "account" in snapshot:
+                # the initial AccountDetails
+                self.account.seed(snapshot)
+            else:
+                self.account.apply(snapshot)
+            self.navReady.set()
 
     def _run(self):
+        from oandapyV20.exceptions import V20Error
 
-        NAV = "0.0"
         TIME = ("%s" % datetime.now())[11:22]
-        snapshot = None
+        frameTime = 1.0 / self.fps
+        nav = gevent.spawn(self.navReader)
+        dirty = {}   # instrument: latest price record
         n = 0
         se = None  # Saved exception
         while True:
             try:
-                if not self.q_nav.empty():
-                    snapshot = self.q_nav.get()
-                    state = snapshot.get('state')
-                    NAV = state.get('NAV')
-
-                if not self.q_price.empty():
-                    R = self.q_price.get()
-                    if self.widget and R["type"] == "PRICE":
+                # sleep until there is something to draw
+                gevent.wait([self.q_price.ready, self.navReady], count=1)
+                start = time.time()
+                redrawHeader = self.navReady.is_set()
+                self.navReady.clear()
+
+                while not self.q_price.empty():
+                    R = self.q_price.get_nowait()
+                    if R["type"] == "PRICE":
+                        dirty[R["instrument"]] = R
+
+                for instrument, R in dirty.items():
+                    if self.widget:
                         # update the instrument row
-                        self.widget[R["instrument"]].set_text(
-                            self.mkrecord(snapshot, R)
-                        )
-                        # save as 'previous'
-                        self.prev[R["instrument"]] = R
-                        TIME = R["time"]
-
-                # update the header: NAV and time
-                s = getattr(self.widget["header"], "struw")
-                s = s.format(NAV=float(NAV), time=TIME[11:22])
-                self.widget["header"].set_text(('bg', s))
+                        self.widget[instrument].set_text(self.mkrecord(R))
+                    TIME = R["time"]
+                    redrawHeader = True
+
+                if redrawHeader:
+                    # update the header: NAV and time
+                    s = getattr(self.widget["header"], "struw")
+                    s = s.format(NAV=self.account.NAV, time=TIME[11:22])
+                    self.widget["header"].set_text(('bg', s))
+
+                if self.onFrame:
+                    self.onFrame()
+                if self.stats:
+                    now = time.time()
+                    for R in dirty.values():
+                        self.stats.tick(R, now)
+                    self.stats.frameDone(start, now)
+                dirty.clear()
 
             except V20Error as e:
                 logging.error("V20Error: code: %s msg: %s loop count: %d",
@@ -166,8 +172,10 @@ class WidgetUpdate(gevent.Greenlet):
                 break
 
             n += 1
-            gevent.sleep(0)
+            # cap the frame rate: the prices meanwhile are conflated
+            gevent.sleep(max(0, frameTime - (time.time() - start)))
 
+        nav.kill()
         # raise se
 
 
@@ -231,38 +239,35 @@ class FocusableNode(urwid.WidgetWrap):
 # lists of such trees.
 
 
-def dyn_add_subtree(parent, j, selectable_nodes):
-    Text = FocusableText if selectable_nodes else urwid.Text
-
-    subtree = (Text('%s' % j), [])
-    subtree[1].append((Text('xxx'), None))
-    parent[1].append(subtree)
-
-
-def instrument_tree(instruments, selectable_nodes=True):
+def instrument_tree(instruments, subtrees, selectable_nodes=True,
+                    trendWidth=0):
 
     Text = FocusableText if selectable_nodes else urwid.Text
 
     # define root node
-    tree = (Text('Instruments    Bid       Ask       Time        Result'), [])
+    title = 'Instruments    Bid       Ask       Time        '
+    if trendWidth:
+        title += ' {:{w}s}'.format('Trend', w=trendWidth)
+    tree = (Text(title + 'Result'), [])
 
     # add instruments as children
-    for i, V in instruments.items():
+    for x, (i, V) in enumerate(instruments.items()):
         subtree = (FocusableNode(V), [])
 
-        # and grandchildren.. orders / pos
+        # and grandchildren.. trades / orders, filled when expanded
         if isinstance(V, urwid.Text):
-            children = ["trades", "orders"]
-            for j in children:
-                dyn_add_subtree(subtree, j, selectable_nodes)
+            for y, j in enumerate(KINDS):
+                subtrees.add(subtree, (0, x, y), i, j)
 
         tree[1].append(subtree)
 
     return tree
 
 
-def construct_instrument_tree(selectable_nodes=True, instruments=[]):
-    forrest = [instrument_tree(instruments, selectable_nodes)]
+def construct_instrument_tree(subtrees, selectable_nodes=True,
+                              instruments=[], trendWidth=0):
+    forrest = [instrument_tree(instruments, subtrees, selectable_nodes,
+                               trendWidth)]
     return SimpleTree(forrest)
 
 
@@ -280,19 +285,42 @@ def mkHeader():
 
 if __name__ == "__main__":
 
+    import argparse
     from console.config import Config
 
+    parser = argparse.ArgumentParser(prog="oanda_console")
+    parser.add_argument('--headless', action='store_true',
+                        help="run without a terminal on a replayed or "
+                             "synthetic feed and report the render "
+                             "performance")
+    parser.add_argument('--replay', default=None,
+                        help="file with price records to feed (headless), "
+                             "default a synthetic feed")
+    parser.add_argument('--rate', type=int, default=10000,
+                        help="ticks per second to feed (headless)")
+    parser.add_argument('--duration', type=float, default=10,
+                        help="seconds to run (headless)")
+    parser.add_argument('--size', default="120x50",
+                        help="screen size as colsxrows (headless)")
+    parser.add_argument('--metrics', type=int, metavar='PORT',
+                        help="serve the metrics on "
+                             "http://127.0.0.1:PORT/metrics")
+    clargs = parser.parse_args()
+
     low = OrderedDict()
 
     # Queues
-    Q_PRICE = Queue()   # Price queue
-    Q_NAV = Queue()     # Net Asset Value queue
+    Q_PRICE = ConflatingQueue(timed=True)   # latest price per instrument
+    Q_NAV = Queue(maxsize=16)               # Net Asset Value queue
+    stats = RenderStats()
+    if clargs.metrics:
+        import metrics
+        metrics.queueDepth("price", Q_PRICE)
+        metrics.queueDepth("nav", Q_NAV)
+        metrics.serve(clargs.metrics)
 
-    accountID, access_token = exampleAuth()
     cfg = Config()
 
-    api = API(access_token=access_token, environment="practice")
-
     # list of widgets
     x = 0
     loIw = OrderedDict()
@@ -319,8 +347,17 @@ if __name__ == "__main__":
                        u') to quit.'])
     low.update({"footer": menu})
 
-    innertree = CollapsibleIndentedTree(
-        construct_instrument_tree(instruments=loIw)
+    # sparklines of the mid prices, if configured
+    sparklines = None
+    if cfg.config.get("sparkline"):
+        sparklines = Sparklines(**cfg.config["sparkline"])
+
+    # the trades/orders subtrees are fetched when expanded
+    subtrees = LazySubtrees(Text=FocusableText)
+    innertree = LazyCollapsibleIndentedTree(
+        construct_instrument_tree(
+            subtrees, instruments=loIw,
+            trendWidth=sparklines.width if sparklines else 0)
     )
     for P in innertree.positions():
         # print P, innertree.depth(P)
@@ -328,6 +365,7 @@ if __name__ == "__main__":
             innertree.collapse(P)
 
     treebox = TreeBox(innertree)
+    subtrees.attach(innertree, treebox)
     todelete = None
 
     pile = urwid.Pile(loIw.values())
@@ -339,40 +377,117 @@ if __name__ == "__main__":
     # add all the instrument widgets to the low (list of widgets)
     [low.update({k: v}) for k, v in loIw.items()]
 
+    if clargs.headless:
+        # the same widget pipeline, the frames rendered to a canvas
+        from console.greenlets import GReplayPrices
+
+        cols, rows = [int(x) for x in clargs.size.split("x")]
+        feed = GReplayPrices(cfg.instruments, Q_PRICE, rate=clargs.rate,
+                             fileName=clargs.replay, timed=True)
+        gui = WidgetUpdate(q_nav=Q_NAV, q_price=Q_PRICE, widget=low,
+                           fps=cfg.config.get("fps", 20),
+                           sparklines=sparklines, stats=stats,
+                           onFrame=lambda: layout.render((cols, rows),
+                                                         focus=True))
+        feed.start()
+        gui.start()
+        gevent.sleep(clargs.duration)
+        gevent.killall([feed, gui])
+        print("{} ticks fed, price queue: {}".format(feed.n,
+                                                    Q_PRICE.stats()))
+        print("\n".join(stats.report()))
+        sys.exit(0)
+
     # ----------------------------------------------------------------
     # manage asynchronous tasks
     gr = Group()
 
-    # Add the greenlet to fetch streaming prices
-    # and let it write the REST-call responses to Q_PRICE
-    p_stream = GStreamingPrices(instruments=cfg.instruments,
-                                api=api,
-                                accountID=accountID,
-                                queue=Q_PRICE)
-    p_stream.start()
-    gr.add(p_stream)
-
-    # Add the greenlet to fetch account summary information
-    # and let it write the REST-call response to Q_NAV
-    acctsum = GAccountDetails(api=api,
-                              accountID=accountID,
-                              queue=Q_NAV,
-                              sleepTime=1)
-    acctsum.start()
-    gr.add(acctsum)
-
-    # Add the greenlet to update the urwid widgets based on information
-    # in the queues
-    gui = WidgetUpdate(q_nav=Q_NAV, q_price=Q_PRICE, widget=low)
-    gui.start()
-    gr.add(gui)
+    def startStreams(loop, user_data=None):
+        """connect and start the greenlets, after the first paint."""
+        loop.draw_screen()
+        from oandapyV20 import API
+        from exampleauth import exampleAuth
+        from console.greenlets import (
+            GAccountDetails,
+            GStreamingPrices,
+            GStreamingTransactions
+        )
+        from console.subtrees import InstrumentCache
+        from catalog import Catalog
+
+        accountID, access_token = exampleAuth()
+        api = API(access_token=access_token, environment="practice")
+        if clargs.metrics:
+            metrics.instrumentAPI(api)
+        subtrees.cache = InstrumentCache(api, accountID)
+        subtrees.expanded(None)
+
+        # an unknown instrument would make the price stream fail
+        catalog = Catalog(api, accountID).load()
+        unknown = catalog.unknown(cfg.instruments)
+        if unknown:
+            logger.warning("unknown instruments in %s: %s",
+                           cfg.fileName, ", ".join(unknown))
+        instruments = [i for i in cfg.instruments if i in catalog]
+
+        # Add the greenlet to fetch streaming prices
+        # and let it write the REST-call responses to Q_PRICE
+        p_stream = GStreamingPrices(instruments=instruments,
+                                    api=api,
+                                    accountID=accountID,
+                                    queue=Q_PRICE,
+                                    hub=cfg.config.get("pricehub"),
+                                    timed=True)
+        p_stream.start()
+        gr.add(p_stream)
+
+        # Add the greenlet to stream transactions, each transaction
+        # triggers the fetch of the account changes and invalidates
+        # the cached trades/orders of the instrument
+        TX = Event()
+        Q_TX = Queue()
+        t_stream = GStreamingTransactions(api=api,
+                                          accountID=accountID,
+                                          trigger=TX,
+                                          queue=Q_TX)
+        t_stream.start()
+        gr.add(t_stream)
+        gr.add(gevent.spawn(subtrees.run, Q_TX))
+
+        # Add the greenlet to fetch account summary information
+        # and let it write the REST-call response to Q_NAV
+        acctsum = GAccountDetails(api=api,
+                                  accountID=accountID,
+                                  queue=Q_NAV,
+                                  sleepTime=1,
+                                  maxSleepTime=60,
+                                  trigger=TX)
+        acctsum.start()
+        gr.add(acctsum)
+
+        # Add the greenlet to update the urwid widgets based on information
+        # in the queues
+        gui = WidgetUpdate(q_nav=Q_NAV, q_price=Q_PRICE, widget=low,
+                           fps=cfg.config.get("fps", 20),
+                           sparklines=sparklines,
+                           stats=stats)
+        gui.start()
+        gr.add(gui)
 
     # gr.join()
     loop = urwid.MainLoop(layout, cfg.palette, unhandled_input=exit_on_q,
                           event_loop=urwid.AsyncioEventLoop())
+    loop.set_alarm_in(0, startStreams)
     try:
         loop.run()
     except urwid.ExitMainLoop:
         pass
 
+    logger.info("price queue: %s", Q_PRICE.stats())
+    for line in stats.report():
+        logger.info("render: %s", line)
+    if subtrees.cache is not None:
+        logger.info("trades/orders requests: %d", subtrees.cache.requests)
+
+    import subprocess
     subprocess.call("clear", shell=True)
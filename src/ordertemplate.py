@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Prebuilt market order payloads.
+
+An OrderTemplate is built once per instrument: the fixed fields of the
+order, the price and units formats of the instrument and the take
+profit / stop loss factors per direction. Building an order is then a
+dict copy, two multiplications and the formatting:
+
+    T = OrderTemplate(catalog["USD_JPY"], takeProfit=0.5, stopLoss=0.5)
+    data = T.build(-100, 151.234)   # the OrderCreate body
+
+For the warm order path the body can be serialized ahead, only the
+take profit and stop loss prices are filled in when the order is sent:
+
+    P = T.prepare(-100)
+    body = P.body(151.234)          # the JSON body, bytes
+"""
+import re
+import json
+
+# placeholders for the prices in a serialized body
+_TP = "@@tp@@"
+_SL = "@@sl@@"
+_PLACEHOLDERS = re.compile("({}|{})".format(_TP, _SL))
+
+
+class OrderTemplate(object):
+    """Market order payloads for an instrument, see the module docstring.
+
+    takeProfit and stopLoss are distances in percent of the price.
+    """
+
+    def __init__(self, instrument, takeProfit=None, stopLoss=None,
+                 timeInForce="FOK", positionFill="DEFAULT"):
+        self.instrument = instrument
+        self._price = instrument.priceFormat.format
+        self._units = instrument.unitsFormat.format
+        self._base = {"type": "MARKET",
+                      "timeInForce": timeInForce,
+                      "instrument": instrument.name,
+                      "positionFill": positionFill}
+        # factors on the price by direction: long 1, short -1
+        self._tp = {1: 1.0 + takeProfit / 100.0,
+                    -1: 1.0 - takeProfit / 100.0} if takeProfit else None
+        self._sl = {1: 1.0 - stopLoss / 100.0,
+                    -1: 1.0 + stopLoss / 100.0} if stopLoss else None
+
+    def build(self, units, price=None):
+        """the order body for units at the (entry) price."""
+        order = dict(self._base)
+        order["units"] = self._units(units)
+        direction = 1 if units > 0 else -1
+        if self._tp and price is not None:
+            order["takeProfitOnFill"] = {
+                "timeInForce": "GTC",
+                "price": self._price(price * self._tp[direction])}
+        if self._sl and price is not None:
+            order["stopLossOnFill"] = {
+                "timeInForce": "GTC",
+                "price": self._price(price * self._sl[direction])}
+        return {"order": order}
+
+    def stop(self, units, price):
+        """the stop loss price for units at the price, None if none."""
+        if not self._sl:
+            return None
+        return price * self._sl[1 if units > 0 else -1]
+
+    def prepare(self, units):
+        """the order for units, serialized but for the prices."""
+        return PreparedOrder(self, units)
+
+
+class PreparedOrder(object):
+    """A serialized order body with the TP / SL prices to fill in."""
+
+    def __init__(self, template, units):
+        self.units = units
+        direction = 1 if units > 0 else -1
+        order = template.build(units)["order"]
+        self._tp = self._sl = None
+        if template._tp:
+            self._tp = template._tp[direction]
+            order["takeProfitOnFill"] = {"timeInForce": "GTC", "price": _TP}
+        if template._sl:
+            self._sl = template._sl[direction]
+            order["stopLossOnFill"] = {"timeInForce": "GTC", "price": _SL}
+        self._price = template._price
+        text = json.dumps({"order": order}, separators=(",", ":"))
+        # text, placeholder, text, ...: the factor of each placeholder
+        parts = _PLACEHOLDERS.split(text)
+        self._parts = [p.encode() for p in parts[0::2]]
+        self._factors = [self._tp if p == _TP else self._sl
+                         for p in parts[1::2]]
+
+    def body(self, price):
+        """the JSON body with the prices for the entry price."""
+        out = [self._parts[0]]
+        for factor, part in zip(self._factors, self._parts[1:]):
+            out.append(self._price(price * factor).encode())
+            out.append(part)
+        return b"".join(out)
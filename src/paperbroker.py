@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""Paper trading: a local broker that fills orders against the ticks.
+
+PaperBroker has the request(endpoint) method of the API and handles the
+endpoints the bots use, with the same payloads and response layout:
+
+  OrderCreate         market orders, filled at the current ask / bid,
+                      with takeProfitOnFill / stopLossOnFill
+  PositionDetails     the long and short side of the instrument
+  PositionClose       longUnits / shortUnits: "ALL" or a number
+  AccountInstruments  the instrument specs passed, or defaults
+
+Feed it every price record with onTick(R): it keeps the latest bid/ask
+per instrument and fills the take profit and stop loss orders of the
+open trades that the tick crosses, at the tick price.
+
+The positions are netted like positionFill DEFAULT: an order first
+reduces the open trades of the other side (FIFO), the rest opens a
+trade. The transactions are OANDA shaped (MARKET_ORDER, ORDER_FILL with
+tradeOpened / tradesClosed, TAKE_PROFIT_ORDER, STOP_LOSS_ORDER, and
+ORDER_CANCEL LINKED_TRADE_CLOSED for the TP / SL orders of a trade that
+is closed otherwise) and kept in .transactions. The units are written
+with the tradeUnitsPrecision of the instrument. The PL is in the quote currency of the
+instrument, there is no conversion, financing or margin.
+"""
+import time
+import logging
+from collections import OrderedDict
+
+from oandapyV20.exceptions import V20Error
+
+logger = logging.getLogger(__name__)
+
+
+def defaultSpec(name):
+    """an instrument spec for an instrument without one."""
+    jpy = name.endswith("_JPY")
+    return {"name": name, "type": "CURRENCY",
+            "displayPrecision": 3 if jpy else 5,
+            "pipLocation": -2 if jpy else -4,
+            "tradeUnitsPrecision": 0,
+            "marginRate": "0.05"}
+
+
+def _pathArg(r, i):
+    """argument i of the path of endpoint r: v3/accounts/<id>/..."""
+    return r._endpoint.split("/")[i]
+
+
+class PaperBroker(object):
+    """Simulated broker, see the module docstring."""
+
+    def __init__(self, accountID="paper", instruments=None, balance=100000.0):
+        self.accountID = accountID
+        self.specs = dict((S["name"], S) for S in instruments or [])
+        self.balance = balance
+        self.prices = {}            # instrument: (bid, ask, time)
+        self.trades = OrderedDict()  # id: trade, in the order opened
+        self.transactions = []
+        self.pl = 0.0
+        self._id = 0
+        self._handlers = {
+            "OrderCreate": self._orderCreate,
+            "PositionDetails": self._positionDetails,
+            "PositionClose": self._positionClose,
+            "AccountInstruments": self._accountInstruments,
+        }
+
+    # -- the API
+    def request(self, r):
+        try:
+            handler = self._handlers[type(r).__name__]
+        except KeyError:
+            raise V20Error(400, "paper broker: {} is not supported".format(
+                type(r).__name__))
+        rv = handler(r)
+        r.status_code = r.expected_status
+        r.response = rv
+        return rv
+
+    # -- prices
+    def onTick(self, R):
+        """the latest price of an instrument, triggers TP / SL."""
+        if R.get("type", "PRICE") != "PRICE":
+            return
+        instrument = R["instrument"]
+        try:
+            bid = float(R["closeoutBid"])
+            ask = float(R["closeoutAsk"])
+        except KeyError:
+            bid = float(R["bids"][0]["price"])
+            ask = float(R["asks"][0]["price"])
+        t = R.get("time")
+        self.prices[instrument] = (bid, ask, t)
+
+        for T in list(self.trades.values()):
+            if T["instrument"] != instrument:
+                continue
+            long = T["units"] > 0
+            price = bid if long else ask
+            tp, sl = T.get("takeProfit"), T.get("stopLoss")
+            if tp is not None and (price >= tp if long else price <= tp):
+                self._closeTrades([T], price, "TAKE_PROFIT_ORDER", t)
+            elif sl is not None and (price <= sl if long else price >= sl):
+                self._closeTrades([T], price, "STOP_LOSS_ORDER", t)
+
+    def _quote(self, instrument):
+        try:
+            return self.prices[instrument]
+        except KeyError:
+            raise V20Error(400, "paper broker: no price for {}".format(
+                instrument))
+
+    def _units(self, instrument, units):
+        """units as OANDA writes them, in the precision of the instrument."""
+        spec = self.specs.get(instrument) or defaultSpec(instrument)
+        precision = int(spec.get("tradeUnitsPrecision", 0))
+        if not precision:
+            return str(int(round(units)))
+        return "{:.{}f}".format(units, precision)
+
+    # -- transactions
+    def _tx(self, type, t, **kwargs):
+        self._id += 1
+        T = {"id": str(self._id), "type": type, "accountID": self.accountID,
+             "time": t or "{:.6f}".format(time.time())}
+        T.update(kwargs)
+        self.transactions.append(T)
+        return T
+
+    def _fill(self, instrument, units, price, reason, t, tp=None, sl=None,
+              orderID=None, trades=None):
+        """fill units at price: reduce the trades of the other side
+        (default all of the instrument), open the rest."""
+        closed = []
+        remaining = units
+        for T in list(self.trades.values()) if trades is None else trades:
+            if not remaining:
+                break
+            if T["instrument"] != instrument or \
+                    (T["units"] > 0) == (remaining > 0):
+                continue
+            n = -T["units"] if abs(T["units"]) <= abs(remaining) \
+                else remaining
+            closed.append(self._reduce(T, n, price))
+            remaining -= n
+
+        fill = {"orderID": orderID or str(self._id), "instrument": instrument,
+                "units": self._units(instrument, units),
+                "price": repr(price),
+                "reason": reason}
+        if closed:
+            fill["tradesClosed"] = [C for C in closed if C["full"]]
+            fill["tradeReduced"] = next(
+                (C for C in closed if not C["full"]), None)
+            for C in closed:
+                del C["full"]
+            if fill["tradeReduced"] is None:
+                del fill["tradeReduced"]
+        fill["pl"] = "{:.4f}".format(
+            sum(float(C["realizedPL"]) for C in closed))
+
+        ended = [C.pop("trade") for C in closed if "trade" in C]
+        tx = self._tx("ORDER_FILL", t, **fill)
+        for T in ended:
+            # the TP / SL orders of the trade that did not fill it
+            for key in ("takeProfitOrderID", "stopLossOrderID"):
+                linked = T.get(key)
+                if linked and linked != fill["orderID"]:
+                    self._tx("ORDER_CANCEL", t, orderID=linked,
+                             reason="LINKED_TRADE_CLOSED",
+                             closedTradeID=T["id"],
+                             tradeCloseTransactionID=tx["id"])
+        if remaining:
+            trade = {"id": tx["id"], "instrument": instrument,
+                     "units": remaining, "price": price, "openTime": t}
+            self.trades[trade["id"]] = trade
+            tx["tradeOpened"] = {"tradeID": trade["id"],
+                                 "units": self._units(instrument,
+                                                      remaining),
+                                 "price": repr(price)}
+            if tp is not None:
+                trade["takeProfit"] = tp
+                trade["takeProfitOrderID"] = self._tx(
+                    "TAKE_PROFIT_ORDER", t, tradeID=trade["id"],
+                    price=repr(tp), timeInForce="GTC",
+                    reason="ON_FILL")["id"]
+            if sl is not None:
+                trade["stopLoss"] = sl
+                trade["stopLossOrderID"] = self._tx(
+                    "STOP_LOSS_ORDER", t, tradeID=trade["id"],
+                    price=repr(sl), timeInForce="GTC",
+                    reason="ON_FILL")["id"]
+        tx["accountBalance"] = "{:.4f}".format(self.balance)
+        return tx
+
+    def _reduce(self, T, units, price):
+        """close units (of the sign closing) of trade T at price."""
+        pl = (price - T["price"]) * -units
+        self.pl += pl
+        self.balance += pl
+        T["units"] += units
+        full = T["units"] == 0
+        C = {"tradeID": T["id"],
+             "units": self._units(T["instrument"], units),
+             "price": repr(price), "realizedPL": "{:.4f}".format(pl),
+             "full": full}
+        if full:
+            del self.trades[T["id"]]
+            C["trade"] = T   # for the cancels of its linked orders
+        return C
+
+    def _closeTrades(self, trades, price, reason, t):
+        for T in trades:
+            instrument = T["instrument"]
+            # the TP / SL order of the trade fills it
+            orderID = T.get("takeProfitOrderID"
+                            if reason == "TAKE_PROFIT_ORDER"
+                            else "stopLossOrderID")
+            tx = self._fill(instrument, -T["units"], price, reason, t,
+                            orderID=orderID, trades=[T])
+            logger.info("paper: %s %s %s @%s pl %s", reason, instrument,
+                        tx["units"], tx["price"], tx["pl"])
+
+    # -- endpoints
+    def _orderCreate(self, r):
+        order = r.data["order"]
+        if order.get("type", "MARKET") != "MARKET":
+            raise V20Error(400, "paper broker: only market orders")
+        instrument = order["instrument"]
+        units = float(order["units"])
+        bid, ask, t = self._quote(instrument)
+        create = self._tx("MARKET_ORDER", t, instrument=instrument,
+                          units=order["units"],
+                          timeInForce=order.get("timeInForce", "FOK"),
+                          positionFill=order.get("positionFill", "DEFAULT"),
+                          reason="CLIENT_ORDER")
+        for k in ["takeProfitOnFill", "stopLossOnFill", "clientExtensions"]:
+            if k in order:
+                create[k] = order[k]
+        tp = order.get("takeProfitOnFill", {}).get("price")
+        sl = order.get("stopLossOnFill", {}).get("price")
+        first = self._id
+        fill = self._fill(instrument, units, ask if units > 0 else bid,
+                          "MARKET_ORDER", t,
+                          tp=float(tp) if tp else None,
+                          sl=float(sl) if sl else None,
+                          orderID=create["id"])
+        return {"orderCreateTransaction": create,
+                "orderFillTransaction": fill,
+                "relatedTransactionIDs": [str(i) for i in
+                                          range(first, self._id + 1)],
+                "lastTransactionID": str(self._id)}
+
+    def _side(self, instrument, long):
+        trades = [T for T in self.trades.values()
+                  if T["instrument"] == instrument and (T["units"] > 0) == long]
+        units = sum(T["units"] for T in trades)
+        side = {"units": self._units(instrument, units), "tradeIDs":
+                [T["id"] for T in trades]}
+        if units:
+            side["averagePrice"] = repr(
+                sum(T["price"] * T["units"] for T in trades) / units)
+            quote = self.prices.get(instrument)
+            if quote:
+                price = quote[0] if long else quote[1]
+                side["unrealizedPL"] = "{:.4f}".format(sum(
+                    (price - T["price"]) * T["units"] for T in trades))
+        return trades, side
+
+    def _positionDetails(self, r):
+        instrument = _pathArg(r, 4)
+        _, long = self._side(instrument, True)
+        _, short = self._side(instrument, False)
+        return {"position": {"instrument": instrument,
+                             "long": long, "short": short},
+                "lastTransactionID": str(self._id)}
+
+    def _positionClose(self, r):
+        instrument = _pathArg(r, 4)
+        bid, ask, t = self._quote(instrument)
+        rv = {}
+        first = self._id + 1
+        for side, long in [("long", True), ("short", False)]:
+            what = r.data.get("{}Units".format(side))
+            if what is None or what == "NONE":
+                continue
+            trades, _ = self._side(instrument, long)
+            units = sum(T["units"] for T in trades)
+            if not units:
+                raise V20Error(400, "CLOSEOUT_POSITION_DOESNT_EXIST")
+            if what != "ALL":
+                units = min(abs(units), float(what)) * (1 if long else -1)
+            create = self._tx("MARKET_ORDER", t, instrument=instrument,
+                              units=self._units(instrument, -units),
+                              reason="POSITION_CLOSEOUT")
+            rv["{}OrderCreateTransaction".format(side)] = create
+            rv["{}OrderFillTransaction".format(side)] = self._fill(
+                instrument, -units, bid if long else ask,
+                "MARKET_ORDER_POSITION_CLOSEOUT", t, orderID=create["id"])
+        rv["relatedTransactionIDs"] = [str(i) for i in
+                                       range(first, self._id + 1)]
+        rv["lastTransactionID"] = str(self._id)
+        return rv
+
+    def _accountInstruments(self, r):
+        names = set(self.specs) | set(self.prices)
+        return {"instruments": [self.specs.get(n) or defaultSpec(n)
+                                for n in sorted(names)],
+                "lastTransactionID": str(self._id)}
+
+    def summary(self):
+        fills = [T for T in self.transactions if T["type"] == "ORDER_FILL"]
+        return {"transactions": len(self.transactions),
+                "fills": len(fills),
+                "openTrades": len(self.trades),
+                "pl": self.pl,
+                "balance": self.balance}
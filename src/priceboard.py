@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""Shared-memory board with the latest price of instruments.
+
+The board is a memory-mapped file holding a fixed array of slots. Each
+slot contains the instrument name, a sequence number and the bid, ask and
+time of the latest price.
+
+There is one writer: the owner of the stream, for example the pricehub.
+Any number of processes can read the board. Writes are seqlock-style:
+the writer makes the sequence number odd, writes the values and makes
+the sequence number even again. A reader retries if it sees an odd
+sequence number or if the sequence number changed while reading. So
+there are no locks, no sockets and no JSON decoding involved in a read.
+If the sequence number stays odd, the writer died in an update: after
+SPINS retries the reader yields, after TIMEOUT seconds it raises
+RuntimeError.
+
+A writer started with another capacity grows the file and lays out the
+slots anew; the readers see the capacity in the header change and map
+the file again.
+
+The sequence numbers are read and written through a memoryview of
+unsigned long longs, that is a single 8 byte copy. struct.pack_into
+clears the bytes before packing and a reader could see a zeroed sequence
+number.
+
+Example:
+
+    # the stream owner
+    board = PriceBoardWriter("/dev/shm/priceboard")
+    for R in api.request(r):
+        board.updateTick(R)
+
+    # some other process
+    board = PriceBoard("/dev/shm/priceboard")
+    bid, ask, t = board["EUR_USD"]
+"""
+import os
+import mmap
+import struct
+import calendar
+import time
+
+DEFAULT_BOARD = "/dev/shm/priceboard" if os.path.isdir("/dev/shm") \
+                else "/tmp/priceboard"
+
+MAGIC = b"PRCBRD01"
+HEADER = struct.Struct("<8sII")     # magic, capacity, slots in use
+NAME = struct.Struct("<16s")
+SEQ = struct.Struct("<Q")
+VALUES = struct.Struct("<ddd")      # bid, ask, time (epoch)
+SLOTSIZE = NAME.size + SEQ.size + VALUES.size
+# a reader retries a slot being written SPINS times, then yields, and
+# gives up after TIMEOUT seconds
+SPINS = 1000
+TIMEOUT = 1.0
+
+
+def tickTime(t):
+    """epoch of a RFC3339 time like: 2017-09-25T11:38:55.123456789Z."""
+    secs, _, frac = t.rstrip("Z").partition(".")
+    e = calendar.timegm(time.strptime(secs, "%Y-%m-%dT%H:%M:%S"))
+    return e + (float("0." + frac) if frac else 0.0)
+
+
+class PriceBoard(object):
+    """Read the latest prices from the board."""
+
+    def __init__(self, path=DEFAULT_BOARD):
+        self.path = path
+        self._mm = None
+        self._map()
+
+    def _map(self):
+        """map the board, again if the writer changed the capacity."""
+        if self._mm is not None:
+            self.close()
+        with open(self.path, "rb") as I:
+            self._mm = mmap.mmap(I.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.capacity, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a priceboard".format(self.path))
+        self._seq = memoryview(self._mm).cast("Q")
+        # the header as unsigned ints: the capacity is [2]
+        self._header = memoryview(self._mm)[:HEADER.size].cast("I")
+        self._slots = {}   # instrument: offset of the slot
+        self._refresh()
+
+    def _refresh(self):
+        """map the instruments to slots, new slots may have been added."""
+        if self._header[2] != self.capacity:
+            return self._map()
+        _, _, n = HEADER.unpack_from(self._mm, 0)
+        for i in range(len(self._slots), n):
+            offset = HEADER.size + i * SLOTSIZE
+            name, = NAME.unpack_from(self._mm, offset)
+            self._slots[name.rstrip(b"\0").decode("ascii")] = offset
+
+    def instruments(self):
+        self._refresh()
+        return list(self._slots.keys())
+
+    def get(self, instrument, default=None):
+        """return (bid, ask, time) of the instrument."""
+        if self._header[2] != self.capacity:
+            self._map()
+        try:
+            offset = self._slots[instrument]
+        except KeyError:
+            self._refresh()
+            if instrument not in self._slots:
+                return default
+            offset = self._slots[instrument]
+
+        mm, seq = self._mm, self._seq
+        seqIdx = (offset + NAME.size) // SEQ.size
+        valOffset = offset + NAME.size + SEQ.size
+        spins = 0
+        while True:
+            s1 = seq[seqIdx]
+            if s1 & 1:     # write in progress
+                spins += 1
+                if spins >= SPINS:
+                    self._wait(seq, seqIdx, instrument)
+                    spins = 0
+                continue
+            values = VALUES.unpack_from(mm, valOffset)
+            if s1 == seq[seqIdx]:
+                return values if s1 else default
+
+    def _wait(self, seq, seqIdx, instrument):
+        """yield until the slot is not being written, or TIMEOUT."""
+        deadline = time.time() + TIMEOUT
+        while seq[seqIdx] & 1:
+            if time.time() > deadline:
+                raise RuntimeError("priceboard: {} is being written for "
+                                   "more than {}s, did the writer die?"
+                                   .format(instrument, TIMEOUT))
+            time.sleep(0.0001)
+
+    def __getitem__(self, instrument):
+        values = self.get(instrument)
+        if values is None:
+            raise KeyError(instrument)
+        return values
+
+    def close(self):
+        self._seq.release()
+        self._header.release()
+        self._mm.close()
+
+
+class PriceBoardWriter(object):
+    """The single writer of the board."""
+
+    def __init__(self, path=DEFAULT_BOARD, capacity=256):
+        size = HEADER.size + capacity * SLOTSIZE
+        # do not truncate an existing board: readers may have it mapped
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        self.capacity = capacity
+        self._seq = memoryview(self._mm).cast("Q")
+        self._slots = {}   # instrument: [index of the seq, sequence nr]
+        magic, cap, n = HEADER.unpack_from(self._mm, 0)
+        if magic == MAGIC and cap == capacity:
+            # adopt the slots of the previous writer, so the
+            # slot offsets cached by the readers stay valid
+            for i in range(n):
+                offset = HEADER.size + i * SLOTSIZE
+                name, = NAME.unpack_from(self._mm, offset)
+                seqIdx = (offset + NAME.size) // SEQ.size
+                seq = self._seq[seqIdx]
+                self._slots[name.rstrip(b"\0").decode("ascii")] = \
+                    [seqIdx, seq + (seq & 1)]
+        else:
+            HEADER.pack_into(self._mm, 0, MAGIC, capacity, 0)
+
+    def _addSlot(self, instrument):
+        n = len(self._slots)
+        if n >= self.capacity:
+            raise ValueError("priceboard full: {}".format(self.capacity))
+        offset = HEADER.size + n * SLOTSIZE
+        NAME.pack_into(self._mm, offset, instrument.encode("ascii"))
+        # make the slot visible to readers once the name is in place
+        HEADER.pack_into(self._mm, 0, MAGIC, self.capacity, n + 1)
+        slot = self._slots[instrument] = \
+            [(offset + NAME.size) // SEQ.size, 0]
+        return slot
+
+    def update(self, instrument, bid, ask, t):
+        try:
+            slot = self._slots[instrument]
+        except KeyError:
+            slot = self._addSlot(instrument)
+
+        seqIdx, seq = slot
+        self._seq[seqIdx] = seq + 1
+        VALUES.pack_into(self._mm, (seqIdx + 1) * SEQ.size, bid, ask, t)
+        self._seq[seqIdx] = seq + 2
+        slot[1] = seq + 2
+
+    def updateTick(self, R):
+        """update the board from a PricingStream record."""
+        if R["type"] != "PRICE":
+            return
+        self.update(R["instrument"],
+                    float(R["bids"][0]["price"]),
+                    float(R["asks"][0]["price"]),
+                    tickTime(R["time"]))
+
+    def close(self):
+        self._seq.release()
+        self._mm.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(prog='priceboard')
+    parser.add_argument('--board', default=DEFAULT_BOARD,
+                        help='path of the priceboard')
+    parser.add_argument('instruments', nargs='*', help='instruments to show')
+    clargs = parser.parse_args()
+
+    board = PriceBoard(clargs.board)
+    for i in clargs.instruments or board.instruments():
+        print(json.dumps({i: board.get(i)}))
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""Local fan-out hub for a single upstream price stream.
+
+Keep one PricingStream to OANDA for the union of the instruments of all
+local subscribers and republish the ticks over a Unix socket.
+
+A subscriber connects to the socket and sends one line of JSON with the
+instruments it wants to receive. An empty list means: all instruments of
+the upstream subscription, so the hub must have been started with
+--instruments; otherwise the hub answers with an ERROR record and closes
+the connection.
+
+    {"instruments": ["EUR_USD", "EUR_JPY"]}
+
+After that the hub sends the price records as newline delimited JSON,
+just like the records of the PricingStream. Heartbeats are sent to all
+subscribers. If a subscriber requests instruments that are not in the
+upstream subscription yet, the upstream stream is restarted for the
+new union of instruments; when the last subscriber of an instrument
+leaves, it is restarted without it (the instruments the hub was started
+with are kept). If the upstream stream fails, whatever the
+error, it is logged and the stream is restarted after a backoff.
+
+Each subscriber gets its own writer greenlet. Pending ticks of a
+subscriber are conflated per instrument: a slow subscriber receives the
+latest price of an instrument and never stalls the hub.
+
+Optionally the hub is the owner of a priceboard: the latest prices are
+written to shared memory for processes that only need the current
+bid/ask of an instrument, see priceboard.py.
+
+Example:
+
+  pricehub.py --socket /tmp/pricehub.sock --instruments EUR_USD
+
+  and in some other process:
+
+  for R in PriceHubClient("/tmp/pricehub.sock", ["EUR_USD"]):
+      print(R)
+"""
+import os
+import json
+import socket
+import argparse
+import logging
+from collections import OrderedDict
+
+import gevent
+from gevent.event import Event
+from gevent.server import StreamServer
+from oandapyV20.endpoints.pricing import PricingStream
+from oandapyV20.exceptions import V20Error, StreamTerminated
+
+DEFAULT_SOCKET = "/tmp/pricehub.sock"
+# backoff of the upstream reconnects, seconds
+BACKOFF = 1.0
+MAXBACKOFF = 60.0
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber(object):
+    """Local subscriber of the hub."""
+
+    def __init__(self, sock, instruments):
+        self.sock = sock
+        self.instruments = set(instruments)
+        self.pending = OrderedDict()   # instrument: encoded record
+        self.conflated = 0             # number of overwritten records
+        self.ready = Event()
+        self.closed = False
+
+    def wants(self, instrument):
+        return not self.instruments or instrument in self.instruments
+
+    def offer(self, key, line):
+        """offer an encoded record, this never blocks."""
+        if key in self.pending:
+            self.conflated += 1
+        self.pending[key] = line
+        self.ready.set()
+
+    def writer(self):
+        """write the pending records to the subscriber."""
+        while not self.closed:
+            self.ready.wait()
+            self.ready.clear()
+            pending, self.pending = self.pending, OrderedDict()
+            try:
+                self.sock.sendall(b"".join(pending.values()))
+            except socket.error as e:
+                logger.info("subscriber gone: %s", e)
+                self.closed = True
+
+
+class PriceHub(object):
+    """Single upstream PricingStream fanned out to local subscribers."""
+
+    def __init__(self, api, accountID, instruments=None, board=None):
+        self.api = api
+        self.accountID = accountID
+        self.initial = set(instruments or [])
+        self.instruments = set(self.initial)   # of the upstream
+        self.board = board   # optional PriceBoardWriter
+        self.subscribers = []
+        self._upstream = None
+        self.n = 0
+
+    def publish(self, R):
+        """publish a record of the upstream stream to the subscribers."""
+        line = (json.dumps(R) + "\n").encode("utf-8")
+        if R["type"] == "PRICE":
+            if self.board is not None:
+                self.board.updateTick(R)
+            key = R["instrument"]
+            for S in self.subscribers:
+                if S.wants(key):
+                    S.offer(key, line)
+        else:
+            for S in self.subscribers:
+                S.offer(R["type"], line)
+
+    def _stream(self, instruments):
+        backoff = BACKOFF
+        while True:
+            r = PricingStream(accountID=self.accountID,
+                              params={"instruments": ",".join(instruments)})
+            logger.info("upstream for: %s", ",".join(instruments))
+            try:
+                for R in self.api.request(r):
+                    self.publish(R)
+                    self.n += 1
+                    backoff = BACKOFF
+                    gevent.sleep(0)
+                logger.error("upstream ended %d", self.n)
+
+            except V20Error as e:
+                logger.error("V20Error: %s %s %d", e.code, e.msg, self.n)
+
+            except Exception as e:
+                logger.exception("upstream %s: %s %d",
+                                 type(e).__name__, e, self.n)
+
+            logger.info("upstream reconnect in %.1fs", backoff)
+            gevent.sleep(backoff)
+            backoff = min(2 * backoff, MAXBACKOFF)
+
+    def restart(self):
+        """(re)start the upstream stream for the union of instruments."""
+        if self._upstream is not None:
+            self._upstream.kill()
+        if self.instruments:
+            self._upstream = gevent.spawn(self._stream,
+                                          sorted(self.instruments))
+
+    def _reject(self, sock, message):
+        """answer a subscription with an ERROR record and close."""
+        logger.error("subscription rejected: %s", message)
+        E = {"type": "ERROR", "message": message}
+        try:
+            sock.sendall((json.dumps(E) + "\n").encode("utf-8"))
+        except socket.error:
+            pass
+        finally:
+            sock.close()
+
+    def _update(self):
+        """restart the upstream if the union of instruments changed."""
+        wanted = set(self.initial)
+        for S in self.subscribers:
+            wanted |= S.instruments
+        if wanted != self.instruments:
+            self.instruments = wanted
+            self.restart()
+
+    def handle(self, sock, address):
+        """handle a subscriber connection."""
+        f = sock.makefile("rb")
+        try:
+            req = json.loads(f.readline().decode("utf-8") or "{}")
+        except ValueError as e:
+            return self._reject(sock, "bad subscription: {}".format(e))
+
+        instruments = req.get("instruments") if isinstance(req, dict) \
+            else None
+        if not isinstance(req, dict) or \
+                not isinstance(instruments or [], list) or \
+                not all(isinstance(i, str) for i in instruments or []):
+            return self._reject(sock, "bad subscription: expected "
+                                      '{"instruments": [names]}')
+        instruments = instruments or []
+        if not instruments and not self.instruments:
+            return self._reject(sock, "no instruments: the hub has no "
+                                      "upstream subscription, name the "
+                                      "instruments")
+        S = Subscriber(sock, instruments)
+        self.subscribers.append(S)
+        logger.info("subscriber for: %s", ",".join(instruments) or "ALL")
+        self._update()
+
+        try:
+            S.writer()
+        finally:
+            self.subscribers.remove(S)
+            logger.info("subscriber left, conflated: %d", S.conflated)
+            sock.close()
+            self._update()
+
+    def serve_forever(self, path=DEFAULT_SOCKET):
+        if os.path.exists(path):
+            os.unlink(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(64)
+        self.restart()
+        StreamServer(listener, self.handle).serve_forever()
+
+
+class PriceHubClient(object):
+    """Iterate over the records published by the hub.
+
+    The records are the same as those of the PricingStream, so an
+    instance can take the place of api.request(PricingStream(...)).
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET, instruments=None):
+        self.path = path
+        self.instruments = instruments or []
+
+    def __iter__(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        try:
+            req = {"instruments": list(self.instruments)}
+            sock.sendall((json.dumps(req) + "\n").encode("utf-8"))
+            for line in sock.makefile("rb"):
+                R = json.loads(line.decode("utf-8"))
+                if R.get("type") == "ERROR":
+                    raise ValueError("pricehub: {}".format(R["message"]))
+                yield R
+        finally:
+            sock.close()
+
+    def terminate(self, message=""):
+        """terminate the stream, like PricingStream.terminate."""
+        raise StreamTerminated(message)
+
+
+if __name__ == "__main__":
+    from gevent import monkey
+    monkey.patch_all()
+
+    from oandapyV20 import API
+    from exampleauth import exampleAuth
+    from priceboard import PriceBoardWriter
+
+    parser = argparse.ArgumentParser(prog='pricehub')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET,
+                        help='path of the unix socket')
+    parser.add_argument('--instruments', type=str, nargs='?',
+                        action='append', help='initial instruments')
+    parser.add_argument('--board', type=str,
+                        help='path of a priceboard to write the prices to')
+    clargs = parser.parse_args()
+
+    logging.basicConfig(
+        filename="./pricehub.log",
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(name)s : %(message)s',
+    )
+
+    accountID, access_token = exampleAuth()
+    api = API(access_token=access_token, environment="practice")
+    board = PriceBoardWriter(clargs.board) if clargs.board else None
+    hub = PriceHub(api, accountID, clargs.instruments, board=board)
+    hub.serve_forever(clargs.socket)
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""On-demand profiling of a running process.
+
+A Profiler is installed at start and does nothing until it gets a
+signal (SIGUSR2) or a command on its control socket. It then profiles
+the live process for some seconds and writes the result:
+
+  sample    a sampling profile: a thread takes the stack of the main
+            thread every interval. Under gevent the samples are
+            attributed to the running greenlet. The output is a file
+            of collapsed stacks, the input format of flamegraph.pl,
+            speedscope and the like.
+  cprofile  a cProfile run of the main thread, written as pstats.
+
+Start and stop run in the main thread, from the signal handler; a
+second signal stops a running profile early. The control socket only
+forwards its command by that signal. Send commands with:
+
+  python src/profiling.py --pid <pid>                     # signal
+  python src/profiling.py --socket <path> sample 30       # socket
+  python src/profiling.py --socket <path> cprofile 10
+  python src/profiling.py --socket <path> stop
+
+While off no hooks are active: the cost is an installed signal handler
+and, if a socket is used, a thread blocked in accept.
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+MODES = ["sample", "cprofile"]
+SIGNAL = signal.SIGUSR2
+
+
+def _originals():
+    """thread functions, sleep and socket not patched by gevent."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        monkey = None
+    if monkey is not None and monkey.is_module_patched("threading"):
+        return (monkey.get_original("_thread", "start_new_thread"),
+                monkey.get_original("_thread", "get_ident"),
+                monkey.get_original("time", "sleep"),
+                monkey.get_original("socket", "socket"))
+    import _thread
+    return (_thread.start_new_thread, _thread.get_ident, time.sleep,
+            socket.socket)
+
+
+def frameName(f):
+    code = f.f_code
+    return "{} ({}:{})".format(code.co_name,
+                               os.path.basename(code.co_filename),
+                               code.co_firstlineno)
+
+
+def greenletName(g):
+    name = getattr(g, "name", None)
+    if name and isinstance(name, str):
+        return name
+    return type(g).__name__
+
+
+class Profiler(object):
+    """On-demand profiler, see the module docstring."""
+
+    def __init__(self, outdir=".", prefix=None, seconds=30,
+                 interval=0.005, mode="sample"):
+        self.outdir = outdir
+        self.prefix = prefix or os.path.splitext(
+            os.path.basename(sys.argv[0]))[0] or "python"
+        self.seconds = seconds
+        self.interval = interval
+        self.mode = mode
+        self._startThread, self._getIdent, self._sleep, self._socket = \
+            _originals()
+        self._mainIdent = None
+        self._pending = None     # (mode, seconds) requested by the socket
+        self._session = None     # the running profile
+        self.lastOutput = None
+
+    # -- control
+    def install(self, signum=SIGNAL, path=None):
+        """install the signal handler and, if a path is passed, the
+        control socket. To be called from the main thread."""
+        self._mainIdent = self._getIdent()
+        self.signum = signum
+        signal.signal(signum, self._onSignal)
+        if path:
+            self._startThread(self._serve, (path,))
+        logger.info("profiler: signal %d, socket %s, output %s",
+                    signum, path, self.outdir)
+        return self
+
+    def request(self, mode=None, seconds=None):
+        """request a start (or a stop if running) from any thread."""
+        self._pending = (mode or self.mode, seconds or self.seconds)
+        signal.pthread_kill(self._mainIdent, self.signum)
+
+    def _onSignal(self, signum, frame):
+        if self._session is not None:
+            # a request while running is a stop, it is done
+            self._pending = None
+            self._stop()
+            return
+        mode, seconds = self._pending or (self.mode, self.seconds)
+        self._pending = None
+        if mode == "stop":
+            return
+        self._start(mode, seconds)
+
+    # -- profiles
+    def _start(self, mode, seconds):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        ext = "collapsed" if mode == "sample" else "pstats"
+        output = os.path.join(self.outdir, "{}-{}-{}.{}".format(
+            self.prefix, os.getpid(), stamp, ext))
+        session = {"mode": mode, "output": output, "done": False,
+                   "start": time.time()}
+        if mode == "cprofile":
+            import cProfile
+            session["profile"] = cProfile.Profile()
+            session["profile"].enable()
+        else:
+            session["stacks"] = defaultdict(int)
+            session["current"] = [None]   # running greenlet
+            session["trace"] = self._traceGreenlets(session["current"])
+        self._session = session
+        self._startThread(self._run, (session, seconds))
+        logger.info("profiler: %s for %ss -> %s", mode, seconds, output)
+
+    def _traceGreenlets(self, current):
+        """track the running greenlet, if greenlets are in use."""
+        greenlet = sys.modules.get("greenlet")
+        if greenlet is None:
+            return None
+        current[0] = greenlet.getcurrent()
+
+        def trace(event, args):
+            if event in ("switch", "throw"):
+                current[0] = args[1]
+            if prev is not None:
+                prev(event, args)
+
+        prev = greenlet.settrace(trace)
+        return (greenlet, prev)
+
+    def _run(self, session, seconds):
+        """sampler / timer thread of a session."""
+        end = time.time() + seconds
+        while not session["done"] and time.time() < end:
+            if session["mode"] == "sample":
+                self._sample(session)
+                self._sleep(self.interval)
+            else:
+                self._sleep(min(0.1, max(0, end - time.time())))
+        if not session["done"]:
+            # stop in the main thread
+            signal.pthread_kill(self._mainIdent, self.signum)
+
+    def _sample(self, session):
+        f = sys._current_frames().get(self._mainIdent)
+        if f is None:
+            return
+        stack = []
+        while f is not None:
+            stack.append(frameName(f))
+            f = f.f_back
+        g = session["current"][0]
+        stack.append(greenletName(g) if g is not None else "MainThread")
+        stack.reverse()
+        session["stacks"][";".join(stack)] += 1
+
+    def _stop(self):
+        session, self._session = self._session, None
+        session["done"] = True
+        output = session["output"]
+        try:
+            if session["mode"] == "cprofile":
+                session["profile"].disable()
+                session["profile"].dump_stats(output)
+            else:
+                if session["trace"]:
+                    greenlet, prev = session["trace"]
+                    greenlet.settrace(prev)
+                with open(output, "w") as O:
+                    for stack, n in session["stacks"].items():
+                        O.write("{} {}\n".format(stack, n))
+        except (IOError, OSError) as e:
+            logger.error("profiler: can't write %s: %s", output, e)
+        else:
+            self.lastOutput = output
+            logger.info("profiler: %s done after %.1fs -> %s",
+                        session["mode"], time.time() - session["start"],
+                        output)
+
+    # -- control socket
+    def _serve(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+        srv = self._socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        srv.bind(path)
+        srv.listen(1)
+        while True:
+            conn, _ = srv.accept()
+            try:
+                args = conn.recv(1024).decode().split()
+                reply = self._command(args)
+                conn.sendall((reply + "\n").encode())
+            except Exception as e:
+                logger.error("profiler: socket: %s", e)
+            finally:
+                conn.close()
+
+    def _command(self, args):
+        mode = args[0] if args else self.mode
+        if mode == "stop":
+            if self._session is None:
+                return "not running"
+            self.request("stop")
+            return "stopping {}".format(self._session["output"])
+        if mode not in MODES:
+            return "unknown command: {}".format(mode)
+        if self._session is not None:
+            return "running: {}".format(self._session["output"])
+        seconds = float(args[1]) if len(args) > 1 else self.seconds
+        self.request(mode, seconds)
+        return "started {} for {}s".format(mode, seconds)
+
+
+def install(outdir=".", path=None, signum=SIGNAL, **kwargs):
+    """create and install a Profiler."""
+    return Profiler(outdir, **kwargs).install(signum, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="profiling")
+    parser.add_argument('--pid', type=int,
+                        help='signal the process to start/stop a profile')
+    parser.add_argument('--socket', type=str,
+                        help='control socket of the process')
+    parser.add_argument('command', nargs='*',
+                        help='sample|cprofile [seconds] | stop')
+    clargs = parser.parse_args()
+
+    if clargs.pid:
+        os.kill(clargs.pid, SIGNAL)
+    elif clargs.socket:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(clargs.socket)
+        s.sendall(" ".join(clargs.command).encode())
+        print(s.recv(1024).decode().strip())
+        s.close()
+    else:
+        parser.print_help()
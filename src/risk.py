@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Pre-trade risk checks, in process.
+
+Every order intent is checked against the limits of the configuration
+before it is sent. The check only uses local state: the positions of the
+orders filled by this process, the price passed or the price board, and
+the times of the recent orders. It does not make any request, a check
+costs a few microseconds.
+
+The limits come from the trading and risk sections of a configuration
+like console.yml. The checks are optional: RiskEngine.load(fileName)
+returns None if no file is given or it does not exist.
+
+    trading:
+      EUR_USD:
+        units: 100000        # max units of an order
+        defaultStop: 1%      # max distance of the stop loss
+    risk:
+      ordersPerMinute: 10    # max orders per minute, all instruments
+      requireStop: true      # reject orders without a stop loss
+      exposure:              # max absolute net exposure per currency
+        EUR: 1000000
+        USD: 250000
+
+An instrument without a trading entry has no units or stop distance
+limit, the other limits apply; `units: 0` denies an instrument. The
+exposure is kept for the ISO currencies (CURRENCIES) of an instrument
+only: DE30_EUR counts in EUR, DE30 is not a currency.
+
+    R = RiskEngine.load("console.yml")
+    reason = R.check("EUR_USD", 1000, price=1.1012, stop=1.0902)
+    if reason is None:
+        ... send the order, then R.filled("EUR_USD", 1000, 1.1012)
+"""
+import os
+import time
+import logging
+from collections import deque
+
+from console.config import Config
+
+logger = logging.getLogger(__name__)
+
+# the currencies of the exposure limits; not the metals or CFD names
+CURRENCIES = frozenset("""
+    AUD CAD CHF CNH CZK DKK EUR GBP HKD HUF JPY MXN NOK NZD PLN SEK SGD
+    THB TRY USD ZAR""".split())
+
+
+def _currencies(instrument):
+    """the (base, quote) of an instrument, None if not a currency."""
+    base, _, quote = instrument.partition("_")
+    return (base if base in CURRENCIES else None,
+            quote if quote in CURRENCIES else None)
+
+
+def percent(v):
+    """1% / "1%" / 1 -> 1.0"""
+    if v is None:
+        return None
+    return float(str(v).rstrip("%"))
+
+
+class RiskEngine(object):
+    """Checks order intents against limits, see the module docstring."""
+
+    def __init__(self, trading, ordersPerMinute=None, exposure=None,
+                 requireStop=False, board=None):
+        # instrument: (max units, max stop distance in percent), None
+        # if there is no limit
+        self.limits = dict((I, (None if L.get("units") is None
+                                else float(L["units"]),
+                                percent(L.get("defaultStop"))))
+                           for I, L in (trading or {}).items())
+        self.ordersPerMinute = ordersPerMinute
+        self.maxExposure = dict(exposure or {})
+        self.requireStop = requireStop
+        self.board = board
+        self.positions = {}   # instrument: [units, quote amount]
+        self.exposure = {}    # currency: net amount
+        self._orders = deque()
+        self.rejected = 0
+
+    @classmethod
+    def fromConfig(cls, cfg, board=None):
+        """the engine with the limits of a console Config."""
+        config = cfg.config
+        risk = config.get("risk") or {}
+        return cls(config.get("trading"),
+                   ordersPerMinute=risk.get("ordersPerMinute"),
+                   exposure=risk.get("exposure"),
+                   requireStop=risk.get("requireStop", False),
+                   board=board)
+
+    @classmethod
+    def load(cls, fileName, board=None):
+        """the engine with the limits of the configuration file, None if
+        there is no file: the orders are not checked."""
+        if not fileName:
+            return None
+        if not os.path.exists(fileName):
+            logger.warning("risk: %s does not exist, no risk checks",
+                           fileName)
+            return None
+        return cls.fromConfig(Config(fileName), board=board)
+
+    def _price(self, instrument, units):
+        if self.board is not None:
+            quote = self.board.get(instrument)
+            if quote:
+                return quote[1] if units > 0 else quote[0]
+        return None
+
+    def check(self, instrument, units, price=None, stop=None, now=None):
+        """None if the order is within the limits, else the reason."""
+        reason = self._check(instrument, units, price, stop, now)
+        if reason is not None:
+            self.rejected += 1
+            logger.warning("risk: %s %s rejected: %s", instrument, units,
+                           reason)
+        return reason
+
+    def _check(self, instrument, units, price, stop, now):
+        maxUnits, maxStop = self.limits.get(instrument, (None, None))
+        if maxUnits == 0:
+            return "{} is not traded".format(instrument)
+
+        if not units:
+            return "no units"
+        if maxUnits is not None and abs(units) > maxUnits:
+            return "units {:g} over the max of {:g}".format(abs(units),
+                                                         maxUnits)
+
+        if price is None:
+            price = self._price(instrument, units)
+
+        if stop is None:
+            if self.requireStop:
+                return "no stop loss"
+        elif maxStop is not None:
+            if price is None:
+                return "no price to check the stop distance"
+            distance = abs(price - stop) / price * 100.0
+            if distance > maxStop:
+                return "stop distance {:.3f}% over the max of {}%".format(
+                    distance, maxStop)
+
+        if self.maxExposure:
+            base, quote = _currencies(instrument)
+            for ccy, amount in ((base, units),
+                                (quote, -units * (price or 0.0))):
+                limit = self.maxExposure.get(ccy) if ccy else None
+                if limit is None:
+                    continue
+                if price is None:
+                    return "no price to check the {} exposure".format(ccy)
+                net = self.exposure.get(ccy, 0.0) + amount
+                if abs(net) > limit:
+                    return "{} exposure {:.0f} over the max of {}".format(
+                        ccy, net, limit)
+
+        if self.ordersPerMinute:
+            now = now or time.time()
+            recent = self._orders
+            while recent and now - recent[0] >= 60:
+                recent.popleft()
+            if len(recent) >= self.ordersPerMinute:
+                return "{} orders in the last minute".format(len(recent))
+            # the slot is taken by the check, a failed order counts too
+            recent.append(now)
+
+        return None
+
+    def filled(self, instrument, units, price):
+        """update the positions and exposure for a fill."""
+        P = self.positions.setdefault(instrument, [0.0, 0.0])
+        quoteAmount = -units * price
+        P[0] += units
+        P[1] += quoteAmount
+        base, quote = _currencies(instrument)
+        if base:
+            self.exposure[base] = self.exposure.get(base, 0.0) + units
+        if quote:
+            self.exposure[quote] = self.exposure.get(quote, 0.0) + \
+                quoteAmount
+
+    def closed(self, instrument):
+        """the position of the instrument is closed."""
+        P = self.positions.pop(instrument, None)
+        if P is None:
+            return
+        base, quote = _currencies(instrument)
+        if base:
+            self.exposure[base] -= P[0]
+        if quote:
+            self.exposure[quote] -= P[1]
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""Sharded multi-core version of simplebot.
+
+One reader process reads the PricingStream and shards the ticks by
+instrument over N worker processes. The ticks are passed as fixed size
+records through shared-memory ring buffers (shmring.py), so there is no
+pickling or JSON decoding in the workers.
+
+Each worker owns the PriceTable and the indicators of the instruments of
+its shard. When the state of an instrument changes the worker sends an
+order intent to the single executor process, that closes the existing
+position and places the order, like BotTrader of simplebot does.
+
+Since the workers do not share anything, the indicator work scales with
+the number of cores.
+
+Example:
+
+  shardedbot.py --granularity M1 --units 100 --workers 4 \\
+      --instruments EUR_USD --instruments EUR_JPY --instruments USD_JPY
+
+  replay the records of a file written by concurrent_stream.py, the
+  intents are only logged then:
+
+  shardedbot.py --granularity M1 --units 100 --workers 4 \\
+      --instruments EUR_USD --replay prices.txt
+"""
+import sys
+import time
+import argparse
+import logging
+import multiprocessing
+
+from oandapyV20 import API
+import oandapyV20.endpoints.instruments as instruments
+import oandapyV20.endpoints.pricing as pricing
+from oandapyV20.definitions.instruments import CandlestickGranularity
+from exampleauth import exampleAuth
+from pricehub import PriceHubClient
+from priceboard import tickTime, PriceBoard
+from shmring import ShmRing
+from risk import RiskEngine
+from simplebot import (
+    PriceTable, PRecordFactory, MAx, BotTrader,
+    NEUTRAL, SHORT, LONG, mapstate, replay
+)
+
+logger = logging.getLogger(__name__)
+
+RECORD = "<Hddd"      # instrument index, epoch, closeoutBid, closeoutAsk
+HEARTBEAT = 0xFFFF    # instrument index of a heartbeat record
+
+
+class ShardState(object):
+    """PriceTable and indicators of one instrument in a worker."""
+
+    def __init__(self, instrument, granularity, clargs, candles):
+        self.instrument = instrument
+        self.cf = PRecordFactory(granularity)
+        self.pt = PriceTable(instrument, granularity)
+        self.mavgX = MAx(self.pt, clargs.shortMA, clargs.longMA)
+        self.pt.setHandler("onAddItem", self.mavgX.calculate,
+                           batch=self.mavgX.calculateBatch)
+        self.pt.addItems(candles)
+        self.state = NEUTRAL
+
+    def onTick(self, epoch, mid):
+        """process a tick, returns the new state on a state change."""
+        rec = self.cf.addTick(epoch, mid)
+        if rec:
+            self.pt.addItem(*rec)
+
+        prev, self.state = self.state, self.mavgX.state
+        if self.state != prev and self.state in [SHORT, LONG]:
+            return self.state
+        return None
+
+
+def worker(n, ringName, shard, granularity, clargs, candles, intents, stop):
+    """worker process: calculate the indicators of the shard."""
+    ring = ShmRing(name=ringName, fmt=RECORD)
+    states = {k: ShardState(i, granularity, clargs, candles[i])
+              for k, i in shard.items()}
+
+    def intent(S, state, price):
+        units = clargs.units * (1 if state == LONG else -1)
+        intents.put((S.instrument, units, price, time.time()))
+
+    # the state after the initial candles
+    for S in states.values():
+        state = S.onTick(0, None)
+        if state:
+            intent(S, state, S.pt._c[S.pt.idx-1])
+
+    ticks, idle = 0, 0
+    start = time.time()
+    while not stop.is_set() or len(ring):
+        rec = ring.get()
+        if rec is None:
+            # back off gently when there is nothing to do
+            idle += 1
+            time.sleep(0 if idle < 100 else 0.001)
+            continue
+
+        idle = 0
+        ticks += 1
+        k, epoch, bid, ask = rec
+        if k == HEARTBEAT:
+            # a heartbeat may close a bar that changes the state
+            for S in states.values():
+                state = S.onTick(epoch, None)
+                if state:
+                    intent(S, state, S.pt._c[S.pt.idx-1])
+            continue
+
+        S = states[k]
+        state = S.onTick(epoch, (bid + ask) / 2.0)
+        if state:
+            intent(S, state, ask if state == LONG else bid)
+
+    elapsed = time.time() - start
+    logger.info("worker %d: %d ticks %.0f ticks/s", n, ticks,
+                ticks / elapsed if elapsed else 0)
+    ring.close()
+
+
+def executor(granularity, clargs, intents):
+    """executor process: the single place where orders are placed."""
+    traders = {}
+    # one risk engine: the exposure is over all instruments
+    risk = RiskEngine.load(
+        clargs.risk,
+        board=PriceBoard(clargs.board) if clargs.board else None)
+    while True:
+        intent = intents.get()
+        if intent is None:
+            break
+
+        instrument, units, price, t = intent
+        logger.info("intent: %s %s %d @%s latency %.6f", instrument,
+                    mapstate(LONG if units > 0 else SHORT), units, price,
+                    time.time() - t)
+        if clargs.replay:
+            continue
+
+        if instrument not in traders:
+            traders[instrument] = BotTrader(instrument, granularity,
+                                            clargs.units, clargs,
+                                            warmup=False, risk=risk)
+        T = traders[instrument]
+        T.close()
+        T.order(units, price, signal=t)
+
+
+def fetchCandles(api, instrument, granularity, count):
+    params = {"granularity": granularity, "count": count}
+    r = instruments.InstrumentsCandles(instrument=instrument, params=params)
+    rv = api.request(r)
+    return [(c['time'], float(c['mid']['c']), int(c['volume']))
+            for c in rv['candles'] if c['complete'] is True]
+
+
+class ShardedRuntime(object):
+    """reader of the stream, feeding the workers."""
+
+    def __init__(self, instruments, granularity, clargs):
+        self.instruments = sorted(instruments)
+        self.granularity = granularity
+        self.clargs = clargs
+        self.index = {i: k for k, i in enumerate(self.instruments)}
+        nworkers = min(clargs.workers, len(self.instruments))
+        # instrument index -> worker
+        self.shardOf = [k % nworkers for k in range(len(self.instruments))]
+        self.rings = [ShmRing(create=True, fmt=RECORD, size=clargs.ringsize)
+                      for _ in range(nworkers)]
+        self.accountID, token = exampleAuth()
+        self.api = API(access_token=token)
+
+    def stream(self):
+        if self.clargs.replay:
+            return replay(self.clargs.replay)
+        if self.clargs.hub:
+            return PriceHubClient(self.clargs.hub, self.instruments)
+
+        r = pricing.PricingStream(
+            accountID=self.accountID,
+            params={"instruments": ",".join(self.instruments)})
+        return self.api.request(r)
+
+    def put(self, n, rec):
+        while not self.rings[n].put(rec):
+            # worker is behind, wait for it
+            if not self.workers[n].is_alive():
+                raise RuntimeError("worker {} died".format(n))
+            time.sleep(0.0001)
+
+    def run(self):
+        candles = {}
+        for i in self.instruments:
+            candles[i] = [] if self.clargs.replay else \
+                fetchCandles(self.api, i, self.granularity,
+                             self.clargs.longMA)
+
+        intents = multiprocessing.Queue()
+        stop = multiprocessing.Event()
+        self.workers = []
+        for n, ring in enumerate(self.rings):
+            shard = {k: i for k, i in enumerate(self.instruments)
+                     if self.shardOf[k] == n}
+            p = multiprocessing.Process(
+                target=worker,
+                args=(n, ring.name, shard, self.granularity, self.clargs,
+                      candles, intents, stop))
+            p.start()
+            self.workers.append(p)
+
+        ex = multiprocessing.Process(target=executor,
+                                     args=(self.granularity, self.clargs,
+                                           intents))
+        ex.start()
+
+        ticks = 0
+        start = time.time()
+        try:
+            for R in self.stream():
+                if R["type"] == "PRICE":
+                    k = self.index.get(R["instrument"])
+                    if k is None:
+                        continue
+                    self.put(self.shardOf[k],
+                             (k, tickTime(R["time"]),
+                              float(R["closeoutBid"]),
+                              float(R["closeoutAsk"])))
+                    ticks += 1
+                elif R["type"] == "HEARTBEAT":
+                    rec = (HEARTBEAT, tickTime(R["time"]), 0.0, 0.0)
+                    for n in range(len(self.rings)):
+                        self.put(n, rec)
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            stop.set()
+            for p in self.workers:
+                p.join()
+            intents.put(None)
+            ex.join()
+            for ring in self.rings:
+                ring.close()
+
+            elapsed = time.time() - start
+            msg = "reader: {} ticks in {:.2f}s {:.0f} ticks/s".format(
+                ticks, elapsed, ticks / elapsed if elapsed else 0)
+            logger.info(msg)
+            sys.stderr.write(msg + "\n")
+
+
+if __name__ == "__main__":
+
+    granularities = CandlestickGranularity().definitions.keys()
+    parser = argparse.ArgumentParser(prog='shardedbot')
+    parser.add_argument('--longMA', default=20, type=int,
+                        help='period of the long movingaverage')
+    parser.add_argument('--shortMA', default=10, type=int,
+                        help='period of the short movingaverage')
+    parser.add_argument('--stopLoss', default=0.5, type=float,
+                        help='stop loss value as a percentage of entryvalue')
+    parser.add_argument('--takeProfit', default=0.5, type=float,
+                        help='take profit value as a percentage of entryvalue')
+    parser.add_argument('--instruments', type=str, nargs='?',
+                        action='append', help='instruments', required=True)
+    parser.add_argument('--granularity', choices=granularities, required=True)
+    parser.add_argument('--units', type=int, required=True)
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--ringsize', type=int, default=8192,
+                        help='# of tick records per ring buffer')
+    parser.add_argument('--hub', type=str,
+                        help='socket of a pricehub to get the ticks from')
+    parser.add_argument('--board', type=str,
+                        help='priceboard with the latest bid/ask for orders')
+    parser.add_argument('--replay', type=str,
+                        help='file with price records to replay')
+    parser.add_argument('--risk', type=str,
+                        help='configuration with the trading and risk '
+                             'limits, like console.yml, see risk.py '
+                             '(default: no risk checks)')
+
+    clargs = parser.parse_args()
+
+    logging.basicConfig(
+        filename="./shardedbot.log",
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(name)s : %(message)s',
+        force=True
+    )
+
+    runtime = ShardedRuntime(clargs.instruments, clargs.granularity, clargs)
+    runtime.run()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Single producer / single consumer ring buffer in shared memory.
+
+The ring holds fixed size records described by a struct format. The
+producer only writes the head counter, the consumer only writes the
+tail counter. A record is written before the head is advanced and read
+before the tail is advanced, so no locks are needed between the two
+processes.
+
+Example:
+
+    ring = ShmRing(create=True, fmt="<Hddd", size=4096)
+    # pass ring.name to the consumer process
+    ring.put((1, 1506339535.0, 1.1745, 1.1747))
+
+    ring = ShmRing(name=name, fmt="<Hddd")
+    rec = ring.get()    # None if the ring is empty
+"""
+import struct
+from multiprocessing import shared_memory
+
+# head, tail and size, in front of the records. The counters are read
+# and written through a memoryview of unsigned long longs: that is a
+# single 8 byte copy. struct.pack_into clears the bytes before packing,
+# so the other process could read a zeroed or half written counter.
+HEAD, TAIL, SIZE = 0, 1, 2
+COUNTERS = 3 * 8
+
+
+class ShmRing(object):
+    """SPSC ring of fixed size records in shared memory."""
+
+    def __init__(self, name=None, fmt="<Hddd", size=4096, create=False):
+        self._rec = struct.Struct(fmt)
+        if create:
+            nbytes = COUNTERS + size * self._rec.size
+            self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+
+        self._ctr = self._shm.buf[:COUNTERS].cast("Q")
+        if create:
+            self._ctr[HEAD] = self._ctr[TAIL] = 0
+            self._ctr[SIZE] = size
+
+        self.size = self._ctr[SIZE]
+        self.name = self._shm.name
+        self._owner = create
+        # local copies of the counters, only the other side is read back
+        self._head, self._tail = self._ctr[HEAD], self._ctr[TAIL]
+
+    def put(self, rec):
+        """put a record, returns False if the ring is full."""
+        if self._head - self._ctr[TAIL] >= self.size:
+            return False
+
+        offset = COUNTERS + (self._head % self.size) * self._rec.size
+        self._rec.pack_into(self._shm.buf, offset, *rec)
+        self._head += 1
+        self._ctr[HEAD] = self._head
+        return True
+
+    def get(self):
+        """get a record, returns None if the ring is empty."""
+        if self._ctr[HEAD] == self._tail:
+            return None
+
+        offset = COUNTERS + (self._tail % self.size) * self._rec.size
+        rec = self._rec.unpack_from(self._shm.buf, offset)
+        self._tail += 1
+        self._ctr[TAIL] = self._tail
+        return rec
+
+    def __len__(self):
+        return self._ctr[HEAD] - self._ctr[TAIL]
+
+    def close(self):
+        self._ctr.release()
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
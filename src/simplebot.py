@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 import re
+import json
 import time
+import atexit
 import argparse
 from datetime import datetime
+from collections import OrderedDict
 import calendar
-import json
 import logging
 from oandapyV20 import API
 from oandapyV20.exceptions import V20Error
@@ -12,14 +14,23 @@ import oandapyV20.endpoints.instruments as instruments
 import oandapyV20.endpoints.pricing as pricing
 import oandapyV20.endpoints.orders as orders
 import oandapyV20.endpoints.positions as positions
-from oandapyV20.contrib.requests import (
-    MarketOrderRequest,
-    TakeProfitDetails,
-    StopLossDetails
-)
 
 from oandapyV20.definitions.instruments import CandlestickGranularity
 from exampleauth import exampleAuth
+from pricehub import PriceHubClient
+from priceboard import PriceBoard, tickTime
+from tracing import Tracer
+from latency import Histogram
+from indicators import IndicatorSet
+from catalog import Catalog
+from ordertemplate import OrderTemplate
+from risk import RiskEngine
+from paperbroker import PaperBroker, defaultSpec
+from warmpath import WarmPath
+import profiling
+import metrics
+import asynclog
+from asynclog import LazyJSON
 
 """ Simple trading application based on MovingAverage crossover.
 
@@ -34,10 +45,14 @@ from exampleauth import exampleAuth
     - A MovingAverage - crosssover indicator, MAx, is added and
       attached to the pricetable. Each time the pricetable gets a new
       record added and 'onAddItem' event is triggered which has the
-      MAx calculate method attached.
+      MAx calculate method attached. The moving averages are streaming
+      indicators of the pricetable (indicators.py), updated per record.
     - if MAx has a state change LONG -> SHORT or SHORT -> LONG
       a marketorder is created with a stoploss and a takeprofit
       before placing the new order existing positions are closed
+    - with --risk console.yml each order is checked against the limits
+      of the trading and risk sections by the RiskEngine (risk.py)
+      before it is sent
     - check the logfile to trace statechanges, orders, etc.
 
 
@@ -51,6 +66,8 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# traces the stages from tick to trade when enabled by --trace
+TRACER = Tracer("tick-to-trade")
 
 NEUTRAL = 0
 SHORT = 1
@@ -67,27 +84,89 @@ def mapstate(s):
 
 
 class Event(object):
-
-    def __init__(self):
-        self.handlers = set()
-
-    def handle(self, handler):
-        logger.info("%s: adding handler: %s",
-                    self.__class__.__name__, handler.__name__)
-        self.handlers.add(handler)
+    """Event with handlers called in a fixed order.
+
+    Handlers are called by ascending priority, then in the order they
+    were added. They are bound into a tuple when the handlers change,
+    so firing is a loop over that tuple. A handler may have a batch
+    variant, called once with the list of argument tuples by fireBatch
+    (warm-up, replay); without one it is called per item. With timing
+    enabled the handlers are bound timed, per handler histograms.
+    """
+
+    def __init__(self, name=""):
+        self.name = name
+        self._entries = []     # (priority, sequence, handler, batch)
+        self._seq = 0
+        self.handlers = ()     # bound handlers, in order
+        self.batches = ()      # (batch or None, handler), in order
+        self.timings = None    # handler name: Histogram, if enabled
+
+    def handle(self, handler, priority=0, batch=None):
+        logger.info("%s: adding handler: %s (priority %d)",
+                    self.name or self.__class__.__name__,
+                    handler.__name__, priority)
+        self._seq += 1
+        self._entries.append((priority, self._seq, handler, batch))
+        self._bind()
         return self
 
     def unhandle(self, handler):
-        try:
-            self.handlers.remove(handler)
-        except:
+        entries = [E for E in self._entries if E[2] != handler]
+        if len(entries) == len(self._entries):
             raise ValueError("Handler is not handling this event, "
                              "so cannot unhandle it.")
+        self._entries = entries
+        self._bind()
         return self
 
-    def fire(self, *args, **kargs):
+    def enableTiming(self):
+        """time each handler from now on, see report."""
+        self.timings = OrderedDict()
+        self._bind()
+        return self
+
+    def _bind(self):
+        entries = sorted(self._entries, key=lambda E: E[:2])
+        if self.timings is None:
+            self.handlers = tuple(E[2] for E in entries)
+            self.batches = tuple((E[3], E[2]) for E in entries)
+        else:
+            self.handlers = tuple(self._timed(E[2]) for E in entries)
+            self.batches = tuple((E[3] and self._timed(E[3]), H)
+                                 for E, H in zip(entries, self.handlers))
+
+    def _timed(self, f):
+        name = getattr(f, "__qualname__", f.__name__)
+        h = self.timings.setdefault(name, Histogram(name))
+        clock = time.perf_counter
+
+        def timed(*args):
+            start = clock()
+            f(*args)
+            h.record(clock() - start)
+
+        timed.__name__ = name
+        return timed
+
+    def fire(self, *args):
         for handler in self.handlers:
-            handler(*args, **kargs)
+            handler(*args)
+
+    def fireBatch(self, items):
+        """deliver a list of argument tuples, handler by handler."""
+        for batch, handler in self.batches:
+            if batch is not None:
+                batch(items)
+            else:
+                for args in items:
+                    handler(*args)
+
+    def report(self):
+        if not self.timings:
+            return []
+        return ["{}: {}".format(self.name, h)
+                for h in self.timings.values() if h.count]
 
     def getHandlerCount(self):
         return len(self.handlers)
@@ -107,6 +186,11 @@ class Indicator(object):
     def calculate(self):
         raise Exception("override this method")
 
+    def _reserve(self, idx):
+        # the pricetable has grown
+        while idx > len(self.values):
+            self.values.extend([None] * len(self.values))
+
     def __len__(self):
         return len(self._pt)
 
@@ -136,19 +220,46 @@ class MAx(Indicator):
         self.lmaPeriod = lmaPeriod
         self._events = Event()
         self.state = NEUTRAL
+        # the moving averages of the pricetable, updated per item
+        self._sma = pt.indicators.sma(smaPeriod)
+        self._lma = pt.indicators.sma(lmaPeriod)
 
     def calculate(self, idx):
+        if idx != self._pt.idx:
+            # the indicators of the pricetable are at a later item
+            return self.calculateBatch([(idx,)])
+        self._set(idx, self._sma.value, self._lma.value)
+
+    def calculateBatch(self, items):
+        """calculate for a batch of consecutive (idx,) items, see
+        Event.fireBatch.
+
+        The indicators of the pricetable have the whole batch already,
+        so the averages per item come from windows of their own, primed
+        with the closes before the first item.
+        """
+        S = IndicatorSet()
+        sma, lma = S.sma(self.smaPeriod), S.sma(self.lmaPeriod)
+        c = self._pt._c
+        first = items[0][0]
+        for i in range(max(0, first - 1 - max(self.smaPeriod,
+                                              self.lmaPeriod)), first - 1):
+            S.update(c[i])
+        for idx, in items:
+            S.update(c[idx-1])
+            self._set(idx, sma.value, lma.value)
+
+    def _set(self, idx, SMA, LMA):
+        self._reserve(idx)
         if idx <= self.lmaPeriod:   # not enough values to calculate MAx
             self.values[idx-1] = None
             return
 
-        # perform inefficient MA calculations to get the MAx value
-        SMA = sum(self._pt._c[idx-self.smaPeriod:idx]) / self.smaPeriod
-        LMA = sum(self._pt._c[idx-self.lmaPeriod:idx]) / self.lmaPeriod
         self.values[idx-1] = SMA - LMA
         self.state = LONG if self.values[idx-1] > 0 else SHORT
-        logger.info("MAx: processed %s : state: %s",
-                    self._pt[-1][0], mapstate(self.state))
+        logger.debug("MAx: processed %s : state: %s",
+                     self._pt._dt[idx-1], mapstate(self.state))
+        TRACER.mark("calculate")
 
 
 class PriceTable(object):
@@ -159,25 +270,55 @@ class PriceTable(object):
         self._dt = [None] * 1000  # allocate space for datetime
         self._c = [None] * 1000   # allocate space for close values
         self._v = [None] * 1000   # allocate space for volume values
-        self._events = {}         # registered events
+        self.onAddItem = Event("onAddItem")   # fired with idx
+        # streaming indicators of the closes, see indicators.py
+        self.indicators = IndicatorSet()
         self.idx = 0
 
-    def fireEvent(self, name, *args, **kwargs):
-        if name in self._events:
-            f = self._events[name]
-            f(*args, **kwargs)
-
-    def setHandler(self, name, f):
-        if name not in self._events:
-            self._events[name] = Event()
-        self._events[name] += f
+    def fireEvent(self, name, *args):
+        getattr(self, name).fire(*args)
+
+    def setHandler(self, name, f, priority=0, batch=None):
+        """add handler f to event name, see Event."""
+        getattr(self, name).handle(f, priority, batch)
+
+    def _reserve(self, n):
+        """room for n more items: double the space if needed."""
+        while self.idx + n > len(self._dt):
+            m = len(self._dt)
+            self._dt.extend([None] * m)
+            self._c.extend([None] * m)
+            self._v.extend([None] * m)
+
+    def addItems(self, records):
+        """add (dt, c, v) records, the handlers get them as one batch.
+
+        The indicators of the table have all records when the handlers
+        run: a handler must not read them for an item before the last,
+        see MAx.calculateBatch.
+        """
+        self._reserve(len(records))
+        items = []
+        update = self.indicators.update
+        for dt, c, v in records:
+            update(c)
+            self._dt[self.idx] = dt
+            self._c[self.idx] = c
+            self._v[self.idx] = v
+            self.idx += 1
+            items.append((self.idx,))
+        self.onAddItem.fireBatch(items)
 
     def addItem(self, dt, c, v):
+        if self.idx == len(self._dt):
+            self._reserve(1)
         self._dt[self.idx] = dt
         self._c[self.idx] = c
         self._v[self.idx] = v
         self.idx += 1
-        self.fireEvent('onAddItem', self.idx)
+        self.indicators.update(c)
+        for handler in self.onAddItem.handlers:
+            handler(self.idx)
 
     def __len__(self):
         return self.idx
@@ -207,23 +348,29 @@ class PRecordFactory(object):
         self.data = {"c": None, "v": 0}
 
     def parseTick(self, t):
+        mid = None
+        if t["type"] == "PRICE":
+            mid = (float(t['closeoutBid']) + float(t['closeoutAsk'])) / 2.0
+
+        return self.addTick(self.epochTS(t["time"]), mid)
+
+    def addTick(self, epoch, mid=None):
+        """add a tick by its epoch and mid price, None for a heartbeat."""
         rec = None
         if not self._last:
-            if t["type"] != "PRICE":
+            if mid is None:
                 return rec
-            epoch = self.epochTS(t["time"])
             self._last = epoch - (epoch % self.interval)
 
-        if self.epochTS(t["time"]) > self._last + self.interval:
+        if epoch > self._last + self.interval:
             # save this record as comnpleted
             rec = (self.secs2time(self._last), self.data['c'], self.data['v'])
             # init new one
             self._last += self.interval
             self.data["v"] = 0
 
-        if t["type"] == "PRICE":
-            self.data["c"] = (float(t['closeoutBid']) +
-                              float(t['closeoutAsk'])) / 2.0
+        if mid is not None:
+            self.data["c"] = mid
             self.data["v"] += 1
 
         return rec
@@ -250,16 +397,54 @@ class PRecordFactory(object):
 
 class BotTrader(object):
 
-    def __init__(self, instrument, granularity, units, clargs):
-        self.accountID, token = exampleAuth()
-        self.client = API(access_token=token)
+    def __init__(self, instrument, granularity, units, clargs, warmup=True,
+                 risk=None, broker=None):
+        if getattr(clargs, "replay", None):
+            # offline: no account and no connection
+            self.accountID, self.client = "paper", None
+            warmup = False
+        else:
+            self.accountID, token = exampleAuth()
+            self.client = metrics.instrumentAPI(API(access_token=token))
+        # the orders and positions: the account or a paper broker
+        self.broker = broker or self.client
+        self.paper = broker
         self.units = units
         self.clargs = clargs
+        # pre-trade checks of the orders, None: no checks
+        self.risk = risk
+        self.now = None   # the time of the replayed tick
+        # latest bid/ask from a priceboard, if there is one
+        self.board = PriceBoard(clargs.board) if clargs.board else None
         self.pt = PriceTable(instrument, granularity)
+        # the order payload, with the precisions of the instrument
+        if self.client is None:
+            catalog = Catalog(self.broker, self.accountID, ttl=0).load()
+        else:
+            catalog = Catalog(self.client, self.accountID).load()
+        if instrument not in catalog:
+            raise ValueError("unknown instrument: {}".format(instrument))
+        self.template = OrderTemplate(catalog[instrument],
+                                      clargs.takeProfit, clargs.stopLoss)
+        # warm order path: a live connection and the serialized orders
+        self.warm = None
+        if getattr(clargs, "warm", None) and self.broker is self.client:
+            self.warm = WarmPath(self.client, self.accountID, instrument,
+                                 interval=clargs.warm).start()
+            self.prepared = dict((u, self.template.prepare(u))
+                                 for u in [units, -units])
         mavgX = MAx(self.pt, clargs.shortMA, clargs.longMA)
-        self.pt.setHandler("onAddItem", mavgX.calculate)
+        self.pt.setHandler("onAddItem", mavgX.calculate,
+                           batch=mavgX.calculateBatch)
+        if getattr(clargs, "trace", None):
+            # the time per handler, logged at exit
+            self.pt.onAddItem.enableTiming()
+            atexit.register(self.logTimings)
         self.indicators = [mavgX]
         self.state = NEUTRAL   # overall state based on calculated indicators
+        if not warmup:
+            # the indicators are maintained elsewhere, only trade
+            return
 
         # fetch initial historical data
         params = {"granularity": granularity,
@@ -267,15 +452,19 @@ class BotTrader(object):
         r = instruments.InstrumentsCandles(instrument=instrument,
                                            params=params)
         rv = self.client.request(r)
-        # and calculate indicators
-        for crecord in rv['candles']:
-            if crecord['complete'] is True:
-                self.pt.addItem(crecord['time'],
-                                float(crecord['mid']['c']),
-                                int(crecord['volume']))
+        # and calculate indicators, in one batch
+        self.pt.addItems([(crecord['time'],
+                           float(crecord['mid']['c']),
+                           int(crecord['volume']))
+                          for crecord in rv['candles']
+                          if crecord['complete'] is True])
 
         self._botstate()
 
+    def logTimings(self):
+        for line in self.pt.onAddItem.report():
+            logger.info("handler %s", line)
+
     def _botstate(self):
         # overall state, in this case the state of the only indicator ...
         prev = self.state
@@ -285,48 +474,68 @@ class BotTrader(object):
             logger.info("state change: from %s to %s", mapstate(prev),
                         mapstate(self.state))
             units *= (1 if self.state == LONG else -1)
+            signal = time.time()
             self.close()
-            self.order(units)
-
-    def order(self, units):
-        mop = {"instrument": self.pt.instrument,
-               "units": units}
-
-        def frmt(v):
-            # format a number over 6 digits: 12004.1, 1.05455
-            l = len(str(v).split(".")[0])
-            return "{{:{}.{}f}}".format(l, 6-l).format(v)
-
-        direction = 1 if units > 0 else -1
-        if self.clargs.takeProfit:   # takeProfit specified? add it
-            tpPrice = self.pt._c[self.pt.idx-1] * \
-                      (1.0 + (self.clargs.takeProfit/100.0) * direction)
-            mop.update({"takeProfitOnFill":
-                        TakeProfitDetails(price=frmt(tpPrice)).data})
-
-        if self.clargs.stopLoss:     # stopLosss specified? add it
-            slPrice = self.pt._c[self.pt.idx-1] * \
-                      (1.0 + (self.clargs.stopLoss/100.0) * -direction)
-            mop.update({"stopLossOnFill":
-                        StopLossDetails(price=frmt(slPrice)).data})
-
-        data = MarketOrderRequest(**mop).data
-        r = orders.OrderCreate(accountID=self.accountID, data=data)
+            self.order(units, signal=signal)
+
+    def order(self, units, price=None, signal=None):
+        # entry price: the passed price, the ask/bid from the board
+        # or the last close
+        if price is None:
+            price = self.pt._c[self.pt.idx-1]
+            if self.board is not None:
+                quote = self.board.get(self.pt.instrument)
+            elif self.paper is not None:
+                quote = self.paper.prices.get(self.pt.instrument)
+            else:
+                quote = None
+            if quote:
+                price = quote[1] if units > 0 else quote[0]
+
+        if self.risk is not None:
+            reason = self.risk.check(self.pt.instrument, units, price,
+                                     self.template.stop(units, price),
+                                     now=self.now)
+            TRACER.mark("risk")
+            if reason is not None:
+                metrics.ORDERS.labels("risk_rejected").inc()
+                return
+
         try:
-            response = self.client.request(r)
+            if self.warm is not None:
+                prepared = self.prepared.get(units) or \
+                    self.template.prepare(units)
+                TRACER.mark("prepareOrder")
+                response = self.warm.order(prepared, price, signal)
+                status = self.warm.status
+            else:
+                data = self.template.build(units, price)
+                r = orders.OrderCreate(accountID=self.accountID, data=data)
+                TRACER.mark("prepareOrder")
+                response = self.broker.request(r)
+                status = r.status_code
         except V20Error as e:
+            TRACER.mark("order")
+            metrics.order(error=e)
             logger.error("V20Error: %s", e)
         else:
-            logger.info("Response: %d %s", r.status_code,
-                        json.dumps(response, indent=2))
+            TRACER.mark("order")
+            metrics.order(response)
+            logger.info("Response: %d %s", status, LazyJSON(response))
+            fill = response.get("orderFillTransaction")
+            if fill and self.risk is not None:
+                self.risk.filled(self.pt.instrument, float(fill["units"]),
+                                 float(fill["price"]))
 
     def close(self):
         logger.info("Close existing positions ...")
+        # on the warm connection, if there is one
+        broker = self.warm or self.broker
         r = positions.PositionDetails(accountID=self.accountID,
                                       instrument=self.pt.instrument)
 
         try:
-            openPos = self.client.request(r)
+            openPos = broker.request(r)
 
         except V20Error as e:
             logger.error("V20Error: %s", e)
@@ -337,30 +546,82 @@ class BotTrader(object):
                 if openPos["position"][P]["units"] != "0":
                     toClose.update({"{}Units".format(P): "ALL"})
 
-            logger.info("prepare to close: {}".format(json.dumps(toClose)))
+            logger.info("prepare to close: %s", LazyJSON(toClose, None))
             r = positions.PositionClose(accountID=self.accountID,
                                         instrument=self.pt.instrument,
                                         data=toClose)
             rv = None
             try:
                 if toClose:
-                    rv = self.client.request(r)
-                    logger.info("close: response: %s",
-                                json.dumps(rv, indent=2))
+                    rv = broker.request(r)
+                    logger.info("close: response: %s", LazyJSON(rv))
+                if self.risk is not None:
+                    self.risk.closed(self.pt.instrument)
 
             except V20Error as e:
                 logger.error("V20Error: %s", e)
 
+        TRACER.mark("close")
+
     def run(self):
         cf = PRecordFactory(self.pt.granularity)
-        r = pricing.PricingStream(accountID=self.accountID,
-                                  params={"instruments": self.pt.instrument})
-        for tick in self.client.request(r):
-            rec = cf.parseTick(tick)
-            if rec:
-                self.pt.addItem(*rec)
-
-            self._botstate()
+        if getattr(self.clargs, "replay", None):
+            stream = replay(self.clargs.replay)
+        elif self.clargs.hub:
+            # ticks from the local pricehub
+            stream = PriceHubClient(self.clargs.hub, [self.pt.instrument])
+        else:
+            r = pricing.PricingStream(
+                accountID=self.accountID,
+                params={"instruments": self.pt.instrument})
+            stream = self.client.request(r)
+
+        stats = metrics.StreamStats("prices")
+        paper, replaying = self.paper, self.client is None
+        instrument = self.pt.instrument
+        n, start = 0, time.time()
+        try:
+            for tick in stream:
+                if tick["type"] == "PRICE" and \
+                        tick["instrument"] != instrument:
+                    continue   # a replay file may hold other instruments
+                n += 1
+                stats.message(tick)
+                TRACER.begin(tick.get("time"))
+                if paper is not None and tick["type"] == "PRICE":
+                    # fills the TP / SL orders the tick crosses
+                    paper.onTick(tick)
+                    if replaying:
+                        self.now = tickTime(tick["time"])
+                rec = cf.parseTick(tick)
+                TRACER.mark("parseTick")
+                if rec:
+                    self.pt.addItem(*rec)
+                    TRACER.mark("addItem")
+
+                self._botstate()
+                TRACER.mark("_botstate")
+                TRACER.end()
+        finally:
+            if paper is not None:
+                self.report(n, time.time() - start)
+
+    def report(self, ticks, elapsed):
+        """log and print the throughput and the paper results."""
+        S = self.paper.summary()
+        line = ("{} ticks in {:.2f}s: {:.0f} ticks/s, {} fills, {} open "
+                "trades, pl {:.4f}").format(
+                    ticks, elapsed, ticks / elapsed if elapsed else 0,
+                    S["fills"], S["openTrades"], S["pl"])
+        logger.info("paper: %s", line)
+        print(line)
+
+
+def replay(fileName):
+    """the records of a file, as written by concurrent_stream.py."""
+    with open(fileName) as I:
+        for line in I:
+            yield json.loads(line)
 
 
 # ------------------------
@@ -380,9 +641,54 @@ if __name__ == "__main__":
     parser.add_argument('--instrument', type=str, help='instrument', required=True)
     parser.add_argument('--granularity', choices=granularities, required=True)
     parser.add_argument('--units', type=int, required=True)
+    parser.add_argument('--hub', type=str,
+                        help='socket of a pricehub to get the ticks from')
+    parser.add_argument('--board', type=str,
+                        help='priceboard with the latest bid/ask for orders')
+    parser.add_argument('--trace', type=int, metavar='SECONDS',
+                        help='trace the tick-to-trade latencies and log '
+                             'the percentiles every SECONDS and at exit')
+    parser.add_argument('--metrics', type=int, metavar='PORT',
+                        help='serve the metrics on '
+                             'http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--synclog', action='store_true',
+                        help='log synchronously instead of from a '
+                             'background thread')
+    parser.add_argument('--profsock', type=str,
+                        help='control socket of the profiler, see '
+                             'profiling.py; SIGUSR2 works without it')
+    parser.add_argument('--risk', type=str,
+                        help='configuration with the trading and risk '
+                             'limits, like console.yml, see risk.py '
+                             '(default: no risk checks)')
+    parser.add_argument('--paper', action='store_true',
+                        help='fill the orders by a local paper broker, '
+                             'see paperbroker.py')
+    parser.add_argument('--replay', type=str,
+                        help='file with price records to replay, as fast '
+                             'as possible; needs --paper')
+    parser.add_argument('--warm', type=float, metavar='SECONDS',
+                        help='keep the REST connection alive by a request '
+                             'when idle for SECONDS and send prepared '
+                             'orders, see warmpath.py')
 
     clargs = parser.parse_args()
+    if clargs.replay and not clargs.paper:
+        parser.error("--replay needs --paper")
+    if not clargs.synclog:
+        asynclog.install()
+    if clargs.trace:
+        TRACER.enable(clargs.trace)
+    profiling.install(path=clargs.profsock)
+    if clargs.metrics:
+        metrics.serve(clargs.metrics)
+    risk = RiskEngine.load(
+        clargs.risk,
+        board=PriceBoard(clargs.board) if clargs.board else None)
+    broker = PaperBroker(instruments=[defaultSpec(clargs.instrument)]) \
+        if clargs.paper else None
     bot = BotTrader(instrument=clargs.instrument,
                     granularity=clargs.granularity,
-                    units=clargs.units, clargs=clargs)
+                    units=clargs.units, clargs=clargs, risk=risk,
+                    broker=broker)
     bot.run()
@@ -1,26 +1,35 @@
 # -*- coding: utf-8 -*-
-"""Simple demo of streaming transaction data."""
+"""Simple demo of streaming transaction data.
+
+The transactions are kept in a journal: after a restart the demo first
+catches up with the transactions it missed, see journal.py.
+"""
 from oandapyV20 import API
 from oandapyV20.exceptions import V20Error, StreamTerminated
-from oandapyV20.endpoints.transactions import TransactionsStream
 from exampleauth import exampleAuth
+from journal import TransactionJournal
 
 accountID, access_token = exampleAuth()
 api = API(access_token=access_token, environment="practice")
 
-s = TransactionsStream(accountID=accountID)
+journal = TransactionJournal("transactions.jsonl")
 MAXTRANS = 10
 
 print("read from stream until {} transactions received".format(MAXTRANS))
 try:
     n = 0
-    for R in api.request(s):
+    for R in journal.stream(api, accountID, heartbeats=True):
         print(R)
         n += 1
         if n > MAXTRANS:
-            s.terminate("max transactions received")
+            if journal.request is None:   # still catching up
+                print("max transactions received")
+                break
+            journal.request.terminate("max transactions received")
 
 except StreamTerminated as e:
     print("{}".format(e))
 except V20Error as e:
     print("Error: {}".format(e))
+finally:
+    journal.close()
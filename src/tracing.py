@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Stage tracing of the tick-to-trade path.
+
+A trace starts when a tick is received and gets a monotonic timestamp
+at each stage it passes. When the trace ends the time between a stage
+and the one before it is recorded in the histogram of that stage, so
+nested stages are accounted once: the time of addItem excludes the
+calculate fired from it. Traces that placed an order are also recorded
+as a whole in the tick-to-trade histogram.
+
+    TRACER = Tracer()
+    TRACER.begin(tick["time"])     # on receipt, with the server time
+    TRACER.mark("parseTick")       # after each stage
+    ...
+    TRACER.end()
+
+The percentiles are logged every interval seconds and at exit. Without
+begin, which only traces if enabled, a mark is a no-op.
+"""
+import atexit
+import logging
+import time
+from collections import OrderedDict
+
+from latency import Histogram
+from priceboard import tickTime
+
+logger = logging.getLogger(__name__)
+
+TRADE = "order"   # the stage that makes a trace a tick-to-trade trace
+
+
+class Tracer(object):
+    """Per stage latency histograms, see the module docstring."""
+
+    def __init__(self, name="tick-to-trade", interval=60, enabled=False):
+        self.name = name
+        self.interval = interval
+        self.enabled = enabled
+        self.stages = OrderedDict()   # stage: Histogram
+        self.serverToReceive = Histogram("server->receive")
+        self.tickToTrade = Histogram(name)
+        self.traces = 0
+        self._stamps = None   # [(stage, t)] of the current trace
+        self._lastDump = time.time()
+        atexit.register(self.dump)
+
+    def enable(self, interval=None):
+        self.enabled = True
+        if interval is not None:
+            self.interval = interval
+
+    def begin(self, serverTime=None):
+        """start the trace of a tick received now.
+
+        serverTime: the RFC3339 time of the tick, the server to receive
+        latency is the difference of the wall clocks.
+        """
+        if not self.enabled:
+            return
+        if self._stamps is not None:
+            self.end()
+        if serverTime:
+            self.serverToReceive.record(time.time() - tickTime(serverTime))
+        self._stamps = [("receive", time.perf_counter())]
+
+    def mark(self, stage):
+        """the current trace passed stage."""
+        if self._stamps is not None:
+            self._stamps.append((stage, time.perf_counter()))
+
+    def end(self):
+        """end the current trace and record its stages."""
+        stamps, self._stamps = self._stamps, None
+        if stamps is None:
+            return
+
+        prev = stamps[0][1]
+        traded = False
+        for stage, t in stamps[1:]:
+            try:
+                H = self.stages[stage]
+            except KeyError:
+                H = self.stages[stage] = Histogram(stage)
+            H.record(t - prev)
+            prev = t
+            traded = traded or stage == TRADE
+        if traded:
+            self.tickToTrade.record(prev - stamps[0][1])
+        self.traces += 1
+
+        if time.time() - self._lastDump >= self.interval:
+            self.dump()
+
+    def dump(self):
+        """log the percentiles of all stages."""
+        self._lastDump = time.time()
+        if not self.traces:
+            return
+        logger.info("%s: %d traces, stage latencies:", self.name, self.traces)
+        for H in [self.serverToReceive] + list(self.stages.values()) + \
+                [self.tickToTrade]:
+            logger.info("%s: %s", self.name, H)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Warm order path: a live REST connection and serialized orders.
+
+A bot may place an order hours after its last request. By then the
+server has closed the idle keep-alive connection and the order pays the
+DNS lookup, the TCP and the TLS handshakes. WarmPath has an API client
+of its own, with the token and environment of the bot's client, keeps
+its connection alive with a cheap request (the pricing of the
+instrument) whenever it has been idle for `interval` seconds, and sends
+the orders itself: the body is serialized ahead by
+OrderTemplate.prepare, only the TP / SL prices are filled in, and the
+bytes are posted with its session. The other requests of the signal
+path (the position details and close) go through request(r), on the
+same warm connection. The session of the bot's client is not used from
+the keep-alive thread, nor changed.
+
+The ping and the order share a lock, so an order never gets a second,
+cold connection because a ping holds the warm one; at worst it waits for
+the ping to finish. .status is the HTTP status of the last order.
+
+The time from the signal, the time passed to order(), to the last byte
+of the order handed to the socket is measured per order
+("signal-to-wire", from a hook in the connections of the session), so
+it includes the requests and checks before the order; and whether the
+signal path needed a new connection:
+
+    W = WarmPath(api, accountID, "EUR_USD", interval=15).start()
+    signal = time.time()
+    W.request(PositionClose(...))
+    rv = W.order(template.prepare(100), price, signal)
+    W.report()
+"""
+import time
+import json
+import atexit
+import logging
+import threading
+
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPSConnectionPool
+from oandapyV20 import API
+from oandapyV20.exceptions import V20Error
+from oandapyV20.oandapyV20 import TRADING_ENVIRONMENTS
+import oandapyV20.endpoints.pricing as pricing
+
+from latency import Histogram
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class WarmPath(object):
+    """Keeps the REST connection warm and posts prepared orders."""
+
+    def __init__(self, api, accountID, instrument, interval=15.0):
+        # a client of its own: the keep-alive thread must not share the
+        # session of the bot
+        self.api = metrics.instrumentAPI(
+            API(access_token=api.access_token,
+                environment=api.environment,
+                request_params=api.request_params))
+        self.accountID = accountID
+        self.instrument = instrument
+        self.interval = interval
+        base = TRADING_ENVIRONMENTS[self.api.environment]["api"]
+        self.url = "{}/v3/accounts/{}/orders".format(base, accountID)
+        self.headers = {"Content-Type": "application/json"}
+        self.lock = threading.Lock()
+        self.lastUse = 0
+        self.pings = 0
+        self.connects = 0
+        self.coldOrders = 0
+        self.status = None
+        self.signalToWire = Histogram("signal-to-wire")
+        self.roundTrip = Histogram("order-round-trip")
+        self._wire = None       # time the order was written
+        self._connected = 0     # time of the last new connection
+        self._armed = False     # an order is being sent
+        self._stop = threading.Event()
+        self._hook(base)
+
+    def _hook(self, base):
+        """count the connects and time the writes of our session."""
+        warm = self
+
+        class Connection(HTTPSConnectionPool.ConnectionCls):
+            def connect(self):
+                warm.connects += 1
+                warm._connected = time.time()
+                super(Connection, self).connect()
+
+            def send(self, data):
+                super(Connection, self).send(data)
+                if warm._armed:
+                    warm._wire = time.time()
+
+        class Pool(HTTPSConnectionPool):
+            ConnectionCls = Connection
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        adapter.poolmanager.pool_classes_by_scheme = dict(
+            adapter.poolmanager.pool_classes_by_scheme, https=Pool)
+        self.api.client.mount(base, adapter)
+
+    def start(self):
+        """start the keep-alive thread, the report is logged at exit."""
+        t = threading.Thread(target=self._run, name="warmpath")
+        t.daemon = True
+        t.start()
+        atexit.register(self.logReport)
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        self.ping()
+        while not self._stop.wait(1.0):
+            if time.time() - self.lastUse >= self.interval:
+                self.ping()
+
+    def ping(self):
+        """a cheap request to keep the connection alive."""
+        r = pricing.PricingInfo(accountID=self.accountID,
+                                params={"instruments": self.instrument})
+        with self.lock:
+            try:
+                self.api.request(r)
+            except Exception as e:
+                logger.warning("warmpath: ping failed: %s", e)
+            self.lastUse = time.time()
+            self.pings += 1
+
+    def request(self, r):
+        """api.request(r) on the warm connection."""
+        with self.lock:
+            try:
+                return self.api.request(r)
+            finally:
+                self.lastUse = time.time()
+
+    def order(self, prepared, price, signal=None):
+        """post the prepared order, returns the response like
+        api.request(OrderCreate) does, raises V20Error. signal is the
+        time of the signal, default now."""
+        start = time.time()
+        signal = signal or start
+        body = prepared.body(price)
+        with self.lock:
+            self._wire, self._armed = None, True
+            try:
+                response = self.api.client.post(
+                    self.url, data=body, headers=self.headers,
+                    **self.api.request_params)
+            finally:
+                self._armed = False
+                self.lastUse = time.time()
+            cold = self._connected >= signal
+
+        end = time.time()
+        metrics.REQUEST_LATENCY.labels("OrderCreate").observe(end - start)
+        if self._wire is not None:
+            self.signalToWire.record(self._wire - signal)
+        self.roundTrip.record(end - start)
+        if cold:
+            self.coldOrders += 1
+        logger.info("warmpath: order %s: signal-to-wire %.6f round trip "
+                    "%.6f%s", prepared.units,
+                    self._wire - signal if self._wire else -1, end - start,
+                    " (new connection)" if cold else "")
+
+        self.status = response.status_code
+        content = response.content.decode("utf-8")
+        if response.status_code >= 400:
+            metrics.REQUEST_ERRORS.labels("OrderCreate",
+                                          response.status_code).inc()
+            raise V20Error(response.status_code, content)
+        return json.loads(content)
+
+    def report(self):
+        return ["{}, {}".format(self.signalToWire, self.roundTrip),
+                "signals on a new connection: {}, connects: {}, pings: {}"
+                .format(self.coldOrders, self.connects, self.pings)]
+
+    def logReport(self):
+        for line in self.report():
+            logger.info("warmpath: %s", line)